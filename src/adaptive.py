@@ -0,0 +1,94 @@
+from typing import Optional
+
+import qrcode.constants
+
+from payload_encoding import PayloadEncoding
+from qr_creator import MAX_QR_VERSION, max_data_size
+
+# From the most robust level to the one with the most capacity
+ERROR_CORRECTION_LEVELS = [
+    qrcode.constants.ERROR_CORRECT_H,
+    qrcode.constants.ERROR_CORRECT_Q,
+    qrcode.constants.ERROR_CORRECT_M,
+    qrcode.constants.ERROR_CORRECT_L,
+]
+
+
+# AIMD over the chunk size: every acknowledged chunk grows it by a fixed step, every repeat halves it. The chunk size
+# grows at most a step beyond the biggest chunk acknowledged, the chunks shown before the acknowledgements come back
+# don't overshoot what the link reads.
+# The error correction level is lowered (more capacity) after a streak of successes with the biggest chunk the current
+# level can carry, and raised again after consecutive failures. The QR version follows from the frame size, up to
+# max_version (lower for the tiles of a frame).
+class AdaptiveController:
+    def __init__(
+        self,
+        frame_overhead: int,
+        chunk_size: int = 150,
+        min_chunk_size: int = 32,
+        increase_step: int = 32,
+        decrease_factor: float = 0.5,
+        success_streak_to_lower_level: int = 8,
+        failures_to_raise_level: int = 2,
+        error_correction_level: int = qrcode.constants.ERROR_CORRECT_H,
+        encoding: PayloadEncoding = PayloadEncoding.base64,
+        max_version: int = MAX_QR_VERSION,
+    ):
+        self._frame_overhead = frame_overhead
+        self._encoding = encoding
+        self._max_version = max_version
+        self._min_chunk_size = min_chunk_size
+        self._increase_step = increase_step
+        self._decrease_factor = decrease_factor
+        self._success_streak_to_lower_level = success_streak_to_lower_level
+        self._failures_to_raise_level = failures_to_raise_level
+
+        self._level_index = ERROR_CORRECTION_LEVELS.index(error_correction_level)
+        self._chunk_size = max(min_chunk_size, min(chunk_size, self.max_chunk_size))
+
+        self._successes = 0
+        self._failures = 0
+        self._acknowledged_size = 0
+
+    @property
+    def chunk_size(self) -> int:
+        return self._chunk_size
+
+    @property
+    def error_correction_level(self) -> int:
+        return ERROR_CORRECTION_LEVELS[self._level_index]
+
+    @property
+    def max_chunk_size(self) -> int:
+        return max_data_size(self.error_correction_level, self._max_version, self._encoding) - self._frame_overhead
+
+    def on_success(self, chunk_size: Optional[int] = None) -> None:
+        # chunk_size: of the acknowledged chunk
+        self._successes += 1
+        self._failures = 0
+        self._acknowledged_size = max(self._acknowledged_size, self._chunk_size if chunk_size is None else chunk_size)
+
+        limit = min(self.max_chunk_size, self._acknowledged_size + self._increase_step)
+        if self._chunk_size < limit:
+            self._chunk_size = min(self._chunk_size + self._increase_step, limit)
+        elif self._chunk_size >= self.max_chunk_size and (
+            self._successes >= self._success_streak_to_lower_level
+            and self._level_index < len(ERROR_CORRECTION_LEVELS) - 1
+        ):
+            self._level_index += 1
+            self._successes = 0
+
+    def on_failure(self) -> None:
+        self._failures += 1
+        self._successes = 0
+
+        self._chunk_size = max(self._min_chunk_size, int(self._chunk_size * self._decrease_factor))
+        self._acknowledged_size = min(self._acknowledged_size, self._chunk_size)
+
+        if self._failures >= self._failures_to_raise_level and self._level_index > 0:
+            self._level_index -= 1
+            self._failures = 0
+            self._chunk_size = min(self._chunk_size, self.max_chunk_size)
+
+    def __str__(self) -> str:
+        return f"chunk size: {self._chunk_size}, error correction level: {self.error_correction_level}"
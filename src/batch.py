@@ -0,0 +1,135 @@
+import os
+import struct
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Optional, Union
+
+from reception import ReceivedFile
+
+"""
+A batch session sends several files after a single handshake. The content of the session is the manifest followed by
+the files one after the other, all in one sequence space. The start_connection options carry the manifest length
+(batch=<length>), so the receiver knows where the files start once the first chunks arrived.
+
+Manifest, for every file:
+Size: 8 bytes
+Name length: 2 bytes
+Name: UTF-8, the base name of the file (its suffix included)
+"""
+
+MANIFEST_ENTRY_FORMAT = "<QH"
+MANIFEST_ENTRY_LENGTH = struct.calcsize(MANIFEST_ENTRY_FORMAT)
+
+# Every file of the batch stays mapped until the session ends
+MAX_BATCH_FILES = 100
+
+
+@dataclass(frozen=True)
+class BatchFile:
+    name: str
+    size: int
+
+
+def build_manifest(files: list[BatchFile]) -> bytes:
+    manifest = bytearray()
+    for file in files:
+        name = file.name.encode()
+        manifest += struct.pack(MANIFEST_ENTRY_FORMAT, file.size, len(name)) + name
+
+    return bytes(manifest)
+
+
+def parse_manifest(data: bytes) -> list[BatchFile]:
+    files = []
+    offset = 0
+    while offset < len(data):
+        if offset + MANIFEST_ENTRY_LENGTH > len(data):
+            raise ValueError("Invalid manifest")
+
+        size, name_length = struct.unpack_from(MANIFEST_ENTRY_FORMAT, data, offset)
+        offset += MANIFEST_ENTRY_LENGTH
+
+        if offset + name_length > len(data):
+            raise ValueError("Invalid manifest")
+
+        files.append(BatchFile(data[offset : offset + name_length].decode(errors="replace"), size))
+        offset += name_length
+
+    return files
+
+
+# The parts (the manifest and the mapped files) sliced as if they were one bytes object, nothing is copied but the
+# requested slice.
+class BatchContent:
+    def __init__(self, parts: list[Union[bytes, memoryview]]):
+        self._parts = parts
+        self._offsets = [0]
+        for part in parts:
+            self._offsets.append(self._offsets[-1] + len(part))
+
+    def __len__(self) -> int:
+        return self._offsets[-1]
+
+    def __getitem__(self, key: slice) -> bytes:
+        start, stop, _ = key.indices(len(self))
+
+        data = bytearray()
+        index = bisect_right(self._offsets, start) - 1
+        while start < stop and index < len(self._parts):
+            part_start = self._offsets[index]
+            part_stop = min(stop, self._offsets[index + 1])
+            data += self._parts[index][start - part_start : part_stop - part_start]
+            start = part_stop
+            index += 1
+
+        return bytes(data)
+
+
+# Saves the files of a batch as soon as all their bytes were received, in the order of the manifest.
+class BatchReception:
+    def __init__(self, manifest_length: int):
+        self._manifest_length = manifest_length
+
+        self._files: Optional[list[BatchFile]] = None
+        self._next_file = 0
+        self._next_offset = manifest_length
+
+        self.saved: list[str] = []
+
+    def save_completed(self, received_file: ReceivedFile, folder: str) -> list[str]:
+        if self._files is None:
+            if received_file.received_length < self._manifest_length:
+                return []
+
+            self._files = parse_manifest(received_file.read(0, self._manifest_length))
+
+        saved = []
+        while self._next_file < len(self._files):
+            file = self._files[self._next_file]
+            if received_file.received_length < self._next_offset + file.size:
+                break
+
+            file_name = self._available_name(folder, file.name)
+            received_file.save_range(self._next_offset, file.size, os.path.join(folder, file_name))
+            saved.append(file_name)
+
+            self._next_file += 1
+            self._next_offset += file.size
+
+        self.saved += saved
+
+        return saved
+
+    @staticmethod
+    def _available_name(folder: str, name: str) -> str:
+        # Never a path out of the folder, nor a file that is already there
+        name = os.path.basename(name.replace("\\", "/")) or "File"
+        stem, suffix = os.path.splitext(name)
+
+        available_name = name
+        copy = 1
+        while os.path.exists(os.path.join(folder, available_name)):
+            available_name = f"{stem} ({copy}){suffix}"
+            copy += 1
+
+        return available_name
@@ -0,0 +1,50 @@
+# Time of a frame checksum per protocol version and payload size.
+# Run from src: python -m benchmarks.checksum
+import argparse
+import time
+import zlib
+
+from protocol import LATEST_VERSION, VERSION, RequestType, calculate_hash
+
+PAYLOAD_SIZES = [0, 150, 1000, 2900]
+
+
+def _crc32(version: int, request_type: RequestType, sequence: int, payload: bytes) -> bytes:
+    # Reference only, 4 bytes do not fill the checksum field
+    return zlib.crc32(
+        payload, zlib.crc32(bytes([version, request_type.value]) + sequence.to_bytes(4, "little"))
+    ).to_bytes(4, "little")
+
+
+def _timed(function, payload: bytes, repeats: int) -> float:
+    start = time.perf_counter()
+    for sequence in range(repeats):
+        function(VERSION, RequestType.send_data, sequence, payload)
+
+    return (time.perf_counter() - start) / repeats * 1_000_000
+
+
+def print_checksum_times(repeats: int):
+    print("Checksum time per frame (us)")
+    print(f"{'payload bytes':<15}{'version 1':>12}{f'version {LATEST_VERSION}':>12}{'crc32':>12}{'speedup':>10}")
+
+    for payload_size in PAYLOAD_SIZES:
+        payload = (bytes(range(256)) * 12)[:payload_size]
+
+        crc64_time = _timed(calculate_hash, payload, repeats)
+        blake2b_time = _timed(lambda _, *args: calculate_hash(LATEST_VERSION, *args), payload, repeats)
+        crc32_time = _timed(_crc32, payload, repeats)
+
+        print(
+            f"{payload_size:<15}{crc64_time:>12.2f}{blake2b_time:>12.2f}{crc32_time:>12.2f}"
+            f"{crc64_time / blake2b_time:>9.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the frame checksums of the protocol versions")
+    parser.add_argument("--repeats", help="Number of checksums per payload size and version", type=int, default=1000)
+
+    arguments = parser.parse_args()
+
+    print_checksum_times(arguments.repeats)
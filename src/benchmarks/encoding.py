@@ -0,0 +1,66 @@
+# Bytes of file data per frame and encode / decode time of every payload encoding.
+# Run from src: python -m benchmarks.encoding
+import argparse
+import time
+
+import qrcode.constants
+
+from payload_encoding import PayloadEncoding, decode_payload, encode_payload
+from protocol import HEADER_LENGTH
+from qr_creator import QRCodeCreator, max_data_size
+
+ERROR_CORRECTION_LEVELS = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
+VERSIONS = [10, 20, 30, 40]
+
+
+def _timed(function, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def print_capacities():
+    print("Data bytes per frame (header excluded)")
+    print(f"{'level':<6}{'version':<8}" + "".join(f"{encoding.value:>10}" for encoding in PayloadEncoding) + "  gain")
+
+    for name, level in ERROR_CORRECTION_LEVELS.items():
+        for version in VERSIONS:
+            sizes = [max_data_size(level, version, encoding) - HEADER_LENGTH for encoding in PayloadEncoding]
+            gain = max(sizes) / sizes[0] - 1
+            print(f"{name:<6}{version:<8}" + "".join(f"{size:>10}" for size in sizes) + f"  {gain:+.0%}")
+
+
+def print_timings(repeats: int):
+    creator = QRCodeCreator()
+    data = bytes(range(256)) * 4
+    frame = data[: max_data_size(qrcode.constants.ERROR_CORRECT_M, encoding=PayloadEncoding.base64)]
+
+    print(f"\nTimings of a {len(frame)} bytes frame, M level (ms)")
+    print(f"{'encoding':<10}{'encode':>10}{'decode':>10}{'render':>10}")
+
+    for encoding in PayloadEncoding:
+        encoded = encode_payload(frame, encoding)
+        encode_time = _timed(lambda: encode_payload(frame, encoding), repeats * 100)
+        decode_time = _timed(lambda: decode_payload(encoded), repeats * 100)
+        render_time = _timed(
+            lambda: creator.create(frame, error_correction_level=qrcode.constants.ERROR_CORRECT_M, encoding=encoding),
+            repeats,
+        )
+        print(f"{encoding.value:<10}{encode_time:>10.3f}{decode_time:>10.3f}{render_time:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the payload encodings of the data frames")
+    parser.add_argument("--repeats", help="Number of QR codes rendered per encoding", type=int, default=5)
+
+    arguments = parser.parse_args()
+
+    print_capacities()
+    print_timings(arguments.repeats)
@@ -0,0 +1,45 @@
+# Render time of the QR images, drawn from the module matrix or through the PIL -> PNG -> imdecode round trip.
+# Run from src: python -m benchmarks.render
+import argparse
+import time
+from unittest.mock import patch
+
+import qr_creator
+from protocol import HEADER_LENGTH
+from qr_creator import QRCodeCreator
+
+FRAME_SIZES = [HEADER_LENGTH, HEADER_LENGTH + 150, 500, 900]
+
+
+def _timed(creator: QRCodeCreator, data: bytes, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        creator.create(data)
+
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def print_render_times(repeats: int):
+    # No frame cache, every repeat renders
+    creator = QRCodeCreator(cache_size=0)
+
+    print("Render time per frame (ms)")
+    print(f"{'frame bytes':<14}{'png':>10}{'matrix':>10}{'speedup':>10}")
+
+    for frame_size in FRAME_SIZES:
+        data = (bytes(range(256)) * 4)[:frame_size]
+
+        with patch.object(qr_creator, "LOSSLESS_IMAGE_TYPES", ()):
+            png_time = _timed(creator, data, repeats)
+        matrix_time = _timed(creator, data, repeats)
+
+        print(f"{frame_size:<14}{png_time:>10.2f}{matrix_time:>10.2f}{png_time / matrix_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the QR image render paths")
+    parser.add_argument("--repeats", help="Number of QR codes rendered per frame size and path", type=int, default=10)
+
+    arguments = parser.parse_args()
+
+    print_render_times(arguments.repeats)
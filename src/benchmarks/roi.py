@@ -0,0 +1,74 @@
+# Decode time per frame of a frame sequence, scanning the full frames or tracking the region of the QR codes.
+# Run from src: python -m benchmarks.roi [--frames "recording/*.png"]
+import argparse
+import glob
+import random
+import time
+
+import numpy
+from cv2 import cv2
+
+from protocol import RequestHeader, RequestType
+from qr_creator import QRCodeCreator
+from tracking import RegionTracker
+from webcam import WebcamReader
+
+
+def recorded_frames(pattern: str) -> list:
+    return [cv2.imread(file) for file in sorted(glob.glob(pattern))]
+
+
+def synthetic_frames(count: int, seed: int = 0) -> list:
+    # A code held in front of the webcam: drifts slowly, shakes a little, sometimes hidden
+    generator = random.Random(seed)
+    creator = QRCodeCreator()
+
+    frames = []
+    left, top = 120.0, 80.0
+    for sequence in range(count):
+        header = RequestHeader(request_type=RequestType.send_data, sequence_number=sequence)
+        payload = bytes(generator.getrandbits(8) for _ in range(150))
+        header.add_payload(payload)
+        code = creator.create(header.build() + payload, box_size=3)
+
+        left = min(max(left + generator.uniform(-2, 3), 0), 640 - code.shape[1])
+        top = min(max(top + generator.uniform(-2, 2), 0), 480 - code.shape[0])
+
+        frame = numpy.random.default_rng(sequence).normal(180, 20, (480, 640)).clip(0, 255).astype(numpy.uint8)
+        if generator.random() > 0.05:
+            frame[int(top) : int(top) + code.shape[0], int(left) : int(left) + code.shape[1]] = code
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+
+    return frames
+
+
+def _run(frames: list, tracker) -> tuple[float, int]:
+    decoded = 0
+    start = time.perf_counter()
+    for frame in frames:
+        decoded += len(WebcamReader.parse_all_from_image(frame, cv2.COLOR_BGR2GRAY, tracker)) > 0
+
+    return (time.perf_counter() - start) / len(frames) * 1000, decoded
+
+
+def print_decode_times(frames: list):
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+    print(f"{'mode':<22}{'ms / frame':>12}{'decoded':>10}{'full scans':>12}")
+
+    full_time, full_decoded = _run(frames, None)
+    print(f"{'full frame':<22}{full_time:>12.2f}{full_decoded:>10}{len(frames):>12}")
+
+    for scale in [1.0, 0.5]:
+        tracker = RegionTracker(scale=scale)
+        tracked_time, tracked_decoded = _run(frames, tracker)
+        print(f"{f'region, scale {scale}':<22}{tracked_time:>12.2f}{tracked_decoded:>10}{tracker.full_scans:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare full frame scans with region tracking")
+    parser.add_argument("--frames", help="Glob of recorded webcam frames, a synthetic sequence when not given")
+    parser.add_argument("--count", help="Number of synthetic frames", type=int, default=200)
+
+    arguments = parser.parse_args()
+
+    print_decode_times(recorded_frames(arguments.frames) if arguments.frames else synthetic_frames(arguments.count))
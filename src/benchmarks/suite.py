@@ -0,0 +1,311 @@
+# Times the stages a frame goes through: QR render, QR decode, header build / parse, checksum and the protocol
+# handlers, across payload sizes and error correction levels. The results are written as JSON, and compared with the
+# results of an earlier run (another commit) when given.
+# Run from src: python -m benchmarks.suite --output results.json [--compare baseline.json]
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Optional
+from unittest.mock import patch
+
+import numpy
+import qrcode.constants
+from cv2 import cv2
+
+from degradation import Degradation, place_on_frame
+from main import QRCodeCommunication
+from protocol import LATEST_VERSION, SUPPORTED_VERSIONS, HEADER_LENGTH, RequestHeader, RequestType, calculate_hash
+from qr_creator import QRCodeCreator, max_data_size
+from webcam import WebcamReader
+
+ERROR_CORRECTION_LEVELS = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
+PAYLOAD_SIZES = [0, 150, 500, 900]
+DEGRADATIONS = [
+    Degradation(),
+    Degradation(noise=20),
+    Degradation(blur=5),
+    Degradation(perspective=0.1),
+    Degradation(perspective=0.1, blur=3, noise=10),
+]
+IMAGES_PATTERN = os.path.join(os.path.dirname(__file__), "..", "tests", "images", "*")
+
+# A benchmark slower than the compared one by more than this ratio is reported as a regression
+REGRESSION_RATIO = 1.2
+MEASURED_FIELDS = ("repeats", "decode_rate")
+# Calls per sample of the benchmarks that take microseconds
+FAST_CALLS = 100
+
+
+def measure(function: Callable[[int], object], repeats: int, number: int = 1) -> dict:
+    # Milliseconds per call, out of repeats samples of number calls. The function gets the index of the call
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        for j in range(i * number, (i + 1) * number):
+            function(j)
+        times.append((time.perf_counter() - start) * 1000 / number)
+
+    return {
+        "repeats": repeats,
+        "mean_ms": statistics.fmean(times),
+        "median_ms": statistics.median(times),
+        "min_ms": min(times),
+        "stdev_ms": statistics.stdev(times) if repeats > 1 else 0.0,
+    }
+
+
+def _frame(payload_size: int, sequence: int = 0, version: int = LATEST_VERSION) -> bytes:
+    payload = (bytes(range(256)) * 4)[:payload_size]
+    header = RequestHeader(RequestType.send_data, sequence, version=version)
+    header.add_payload(payload)
+
+    return header.build() + payload
+
+
+def bench_create(repeats: int) -> list[dict]:
+    # No frame cache, every call renders
+    creator = QRCodeCreator(cache_size=0)
+
+    results = []
+    for level_name, level in ERROR_CORRECTION_LEVELS.items():
+        for payload_size in PAYLOAD_SIZES:
+            frame = _frame(payload_size)
+            if len(frame) > max_data_size(level):
+                continue
+
+            result = measure(lambda _: creator.create(frame, error_correction_level=level), repeats)
+            results.append({"benchmark": "create", "ecc": level_name, "payload_bytes": payload_size, **result})
+
+    return results
+
+
+def _decode_result(name: str, params: dict, frames: list, repeats: int) -> dict:
+    decoded = sum(WebcamReader.parse_from_image(frame, cv2.COLOR_BGR2GRAY) is not None for frame in frames)
+    result = measure(lambda i: WebcamReader.parse_from_image(frames[i % len(frames)], cv2.COLOR_BGR2GRAY), repeats)
+
+    return {"benchmark": name, **params, "decode_rate": decoded / len(frames), **result}
+
+
+def bench_decode_corpus(repeats: int) -> list[dict]:
+    results = []
+    for path in sorted(glob.glob(IMAGES_PATTERN)):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+
+        results.append(_decode_result("decode_corpus", {"image": os.path.basename(path)}, [image], repeats))
+
+    return results
+
+
+def bench_decode_synthetic(repeats: int, frame_count: int = 10) -> list[dict]:
+    creator = QRCodeCreator()
+    rng = numpy.random.default_rng(0)
+
+    results = []
+    for level_name, level in ERROR_CORRECTION_LEVELS.items():
+        for payload_size in PAYLOAD_SIZES[1:]:
+            frame = _frame(payload_size)
+            if len(frame) > max_data_size(level):
+                continue
+
+            code = cv2.cvtColor(creator.create(frame, box_size=3, error_correction_level=level), cv2.COLOR_GRAY2BGR)
+            if max(code.shape) > 480:
+                continue
+
+            for degradation in DEGRADATIONS:
+                frames = [
+                    degradation.apply(place_on_frame(code, left=int(rng.integers(0, 640 - code.shape[1] + 1))), rng)
+                    for _ in range(frame_count)
+                ]
+                params = {"ecc": level_name, "payload_bytes": payload_size, "degradation": str(degradation)}
+                results.append(_decode_result("decode_synthetic", params, frames, repeats))
+
+    return results
+
+
+def bench_header(repeats: int) -> list[dict]:
+    results = []
+    for version in SUPPORTED_VERSIONS:
+        for payload_size in PAYLOAD_SIZES:
+            payload = (bytes(range(256)) * 4)[:payload_size]
+
+            def build(i: int):
+                header = RequestHeader(RequestType.send_data, i, version=version)
+                header.add_payload(payload)
+                header.build()
+
+            raw_header = _frame(payload_size, version=version)[:HEADER_LENGTH]
+
+            params = {"version": version, "payload_bytes": payload_size}
+            parse_result = measure(lambda _: RequestHeader.parse(raw_header), repeats, FAST_CALLS)
+            results.append({"benchmark": "header_build", **params, **measure(build, repeats, FAST_CALLS)})
+            results.append({"benchmark": "header_parse", **params, **parse_result})
+
+    return results
+
+
+def bench_checksum(repeats: int) -> list[dict]:
+    results = []
+    for version in SUPPORTED_VERSIONS:
+        for payload_size in PAYLOAD_SIZES:
+            payload = (bytes(range(256)) * 4)[:payload_size]
+            result = measure(lambda i: calculate_hash(version, RequestType.send_data, i, payload), repeats, FAST_CALLS)
+            results.append({"benchmark": "checksum", "version": version, "payload_bytes": payload_size, **result})
+
+    return results
+
+
+class _NoRenderCreator(QRCodeCreator):
+    # The handlers alone, rendering is measured by the create benchmark
+    def create(self, *args, **kwargs):
+        return numpy.zeros((1, 1), dtype=numpy.uint8)
+
+    def prerender(self, *args, **kwargs):
+        pass
+
+
+def _communication(folder: str) -> QRCodeCommunication:
+    communication = QRCodeCommunication(folder)
+    communication._qr_code_creator = _NoRenderCreator()
+    communication._print = lambda string: None
+
+    return communication
+
+
+def _message(request_type: RequestType, sequence: int, payload: bytes = b"") -> bytes:
+    header = RequestHeader(request_type, sequence)
+    header.add_payload(payload)
+
+    return header.build() + payload
+
+
+def bench_handlers(repeats: int) -> list[dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        # Receiver, a new data chunk per call
+        receiver = _communication(folder)
+        receiver._handle_message(_message(RequestType.start_connection, 0, b".bin"))
+        chunks = [_message(RequestType.send_data, i, _frame(150)[HEADER_LENGTH:]) for i in range(repeats)]
+        result = measure(lambda i: receiver._handle_message(chunks[i]), repeats)
+        results.append({"benchmark": "handler_receive_data", "payload_bytes": 150, **result})
+        receiver._reset_and_close()
+
+        # Sender, the acknowledgement of the shown chunk per call
+        sender = _communication(folder)
+        content = memoryview(bytes(150 * (repeats + 1)))
+        with patch.object(sender, "_get_file_to_send", return_value="file.bin"), patch.object(
+            sender, "_open_file", return_value=content
+        ):
+            sender._handle_message(None)
+        sender._handle_message(_message(RequestType.confirm_connection, 0))
+        acks = [_message(RequestType.confirm_data, i) for i in range(repeats)]
+        result = measure(lambda i: sender._handle_message(acks[i]), repeats)
+        results.append({"benchmark": "handler_confirm_data", "payload_bytes": 150, **result})
+
+        # Idle peer, a frame without any code
+        idle = _communication(folder)
+        with patch.object(idle, "_get_file_to_send", return_value=None):
+            results.append({"benchmark": "handler_idle", **measure(lambda _: idle._handle_message(None), repeats)})
+
+    return results
+
+
+BENCHMARKS = {
+    "create": bench_create,
+    "decode_corpus": bench_decode_corpus,
+    "decode_synthetic": bench_decode_synthetic,
+    "header": bench_header,
+    "checksum": bench_checksum,
+    "handlers": bench_handlers,
+}
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names: list[str], repeats: int) -> dict:
+    results = []
+    for name in names:
+        start = time.perf_counter()
+        results += BENCHMARKS[name](repeats)
+        print(f"{name}: {time.perf_counter() - start:.1f}s")
+
+    return {
+        "commit": _commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def _params(result: dict) -> tuple:
+    # What identifies a result between runs
+    return tuple(
+        (key, value)
+        for key, value in result.items()
+        if key != "benchmark" and key not in MEASURED_FIELDS and not key.endswith("_ms")
+    )
+
+
+def compare(report: dict, baseline: dict) -> int:
+    # Median times against the baseline, returns the number of regressions
+    baseline_results = {(result["benchmark"], _params(result)): result for result in baseline["results"]}
+
+    print(f"Compared with {baseline.get('commit')} ({baseline.get('date')})")
+    regressions = 0
+    for result in report["results"]:
+        baseline_result = baseline_results.get((result["benchmark"], _params(result)))
+        if baseline_result is None or baseline_result["median_ms"] == 0:
+            continue
+
+        ratio = result["median_ms"] / baseline_result["median_ms"]
+        if ratio > REGRESSION_RATIO:
+            regressions += 1
+
+        if ratio > REGRESSION_RATIO or ratio < 1 / REGRESSION_RATIO:
+            params = ", ".join(f"{key}={value}" for key, value in _params(result))
+            print(f"{'slower' if ratio > 1 else 'faster':<8}{ratio:>6.2f}x  {result['benchmark']} {params}")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the frame stages and the protocol handlers")
+    parser.add_argument("--output", help="JSON file the results are written to", default="benchmark-results.json")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--repeats", help="Number of calls timed per benchmark", type=int, default=20)
+    parser.add_argument(
+        "--only", help="Benchmarks to run", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS)
+    )
+
+    arguments = parser.parse_args()
+
+    report = run(arguments.only, arguments.repeats)
+
+    with open(arguments.output, "w") as fp:
+        json.dump(report, fp, indent=2)
+    print(f"{len(report['results'])} results written to {arguments.output}")
+
+    if arguments.compare:
+        with open(arguments.compare) as fp:
+            print(f"{compare(report, json.load(fp))} regressions")
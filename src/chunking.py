@@ -0,0 +1,83 @@
+import io
+import math
+import mmap
+from bisect import bisect_right
+from typing import BinaryIO, Optional, Union
+
+DEFAULT_CHUNK_SIZE = 150
+
+
+# The content split into consecutive chunks, chunk N starts right after chunk N - 1.
+# The chunk size can be changed from a given sequence onward, the chunks before it keep their bounds so that they can
+# still be repeated.
+class ContentChunks:
+    def __init__(self, content: Union[bytes, memoryview], chunk_size: int):
+        self._content = content
+        # (first sequence, first offset, chunk size) of every run of equal sized chunks
+        self._segments: list[tuple[int, int, int]] = [(0, 0, chunk_size)]
+
+    @property
+    def content_length(self) -> int:
+        return len(self._content)
+
+    @property
+    def chunk_size(self) -> int:
+        return self._segments[-1][2]
+
+    def __len__(self) -> int:
+        first_sequence, first_offset, chunk_size = self._segments[-1]
+
+        # An empty content is sent as one empty chunk
+        return max(1, first_sequence + math.ceil((len(self._content) - first_offset) / chunk_size))
+
+    def offset(self, sequence: int) -> int:
+        if not 0 <= sequence <= len(self):
+            raise IndexError("Chunk sequence out of range")
+
+        first_sequence, first_offset, chunk_size = self._segments[bisect_right(self._segments, (sequence, 1 << 63)) - 1]
+
+        return min(first_offset + (sequence - first_sequence) * chunk_size, len(self._content))
+
+    def __getitem__(self, sequence: int) -> bytes:
+        if not 0 <= sequence < len(self):
+            raise IndexError("Chunk sequence out of range")
+
+        # Only the chunk is copied out of a memoryview
+        return bytes(self._content[self.offset(sequence) : self.offset(sequence + 1)])
+
+    def resize_from(self, sequence: int, chunk_size: int) -> None:
+        if sequence >= len(self) or chunk_size == self.chunk_size:
+            return
+
+        offset = self.offset(sequence)
+        self._segments = [segment for segment in self._segments if segment[0] < sequence]
+        self._segments.append((sequence, offset, chunk_size))
+
+
+# The content of a file mapped in memory, its pages are read when a chunk is sent and can be dropped by the OS again,
+# so the memory use does not grow with the file size. Files that can't be mapped (empty ones, streams) are read instead.
+class MappedFile:
+    def __init__(self, fp: BinaryIO):
+        self._map: Optional[mmap.mmap] = None
+        self.content: Union[bytes, memoryview] = b""
+
+        if isinstance(fp, io.IOBase):
+            try:
+                self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                self.content = memoryview(self._map)
+            except (ValueError, OSError):
+                pass
+
+        if self._map is None:
+            self.content = fp.read()
+
+    def __len__(self) -> int:
+        return len(self.content)
+
+    def close(self) -> None:
+        if self._map is None:
+            return
+
+        self.content.release()
+        self._map.close()
+        self._map = None
@@ -0,0 +1,119 @@
+import itertools
+from typing import Optional
+
+import numpy
+from numpy import ndarray
+
+"""
+Colour multiplexed frames: a QR code in each of the blue, green and red planes of the displayed image, three chunks
+per code position. A webcam mixes the planes (the screen primaries and the camera filters overlap) and scales them
+(exposure, white balance), what it sees is modelled as observed = mixing @ displayed + offset, per pixel, and the
+receiver inverts the model before decoding every plane as a grayscale image.
+Calibration: every pixel of a colour multiplexed code shows one of the 8 combinations of dark and light planes. The
+colours of a frame are clustered around the 8 colours the current model expects (a few k-means steps), and the model
+is fitted to the cluster centres by least squares. The clusters also start from models of uniform crosstalk, the fit
+closest to the colours of the frame is kept.
+"""
+
+COLORS = 3
+CALIBRATION_SAMPLES = 4096
+CALIBRATION_ITERATIONS = 4
+# Of the sampled pixels, a smaller cluster is not one of the 8 colours
+MIN_CLUSTER_RATIO = 0.01
+MAX_CONDITION_NUMBER = 100.0
+# Fractions of every plane seen in the others the calibration also starts from
+CROSSTALK_GUESSES = (0.0, 0.3, 0.6)
+
+# The displayed levels of the planes (0 = dark, 1 = light) of the 8 colours, in (blue, green, red) order
+_COMBINATIONS = numpy.array(list(itertools.product([0, 1], repeat=COLORS)), dtype=numpy.float32)
+
+
+class ColorCalibration:
+    def __init__(self, mixing: Optional[ndarray] = None, offset: Optional[ndarray] = None):
+        # No mixing at all, a light plane is seen as 255 and a dark one as 0
+        self.mixing = mixing if mixing is not None else numpy.eye(COLORS, dtype=numpy.float32) * 255
+        self.offset = offset if offset is not None else numpy.zeros(COLORS, dtype=numpy.float32)
+        self._unmixing = numpy.linalg.inv(self.mixing).astype(numpy.float32)
+
+    def expected_colors(self) -> ndarray:
+        # The (8, 3) colours of the combinations of planes
+        return _COMBINATIONS @ self.mixing.T + self.offset
+
+    def correct(self, frame: ndarray) -> ndarray:
+        # The displayed planes of a BGR frame, light = 255
+        pixels = frame.reshape(-1, COLORS).astype(numpy.float32)
+        displayed = (pixels - self.offset) @ (self._unmixing.T * 255)
+
+        return displayed.clip(0, 255).astype(numpy.uint8).reshape(frame.shape)
+
+    @classmethod
+    def uniform(cls, samples: ndarray, crosstalk: float) -> "ColorCalibration":
+        # Every plane leaking the same fraction into the others, between the darkest and lightest colours seen
+        dark = numpy.percentile(samples, 1, axis=0)
+        light = numpy.percentile(samples, 99, axis=0)
+        leaks = numpy.full((COLORS, COLORS), crosstalk / (COLORS - 1), dtype=numpy.float32)
+        numpy.fill_diagonal(leaks, 1 - crosstalk)
+
+        return cls((numpy.maximum(light - dark, 1)[:, None] * leaks).astype(numpy.float32), dark.astype(numpy.float32))
+
+    def refined(self, frame: ndarray) -> Optional["ColorCalibration"]:
+        # A model fitted to the colours of the frame, None when it doesn't show enough of the 8 of them. The clusters
+        # start from the current model and from a few guesses, in case the camera changed a lot
+        pixels = frame.reshape(-1, COLORS)
+        samples = pixels[:: max(1, len(pixels) // CALIBRATION_SAMPLES)].astype(numpy.float32)
+
+        fits = [self._fit(samples)] + [
+            ColorCalibration.uniform(samples, crosstalk)._fit(samples) for crosstalk in CROSSTALK_GUESSES
+        ]
+        fits = [fit for fit in fits if fit is not None]
+        if not fits:
+            return None
+
+        return min(fits, key=lambda fit: fit[1])[0]
+
+    def _fit(self, samples: ndarray) -> Optional[tuple["ColorCalibration", float]]:
+        # The fitted model and the mean squared distance of the samples to its colours
+        centres = self.expected_colors()
+        for _ in range(CALIBRATION_ITERATIONS):
+            labels = _distances(samples, centres).argmin(axis=1)
+            counts = numpy.bincount(labels, minlength=len(centres))
+            for i in numpy.nonzero(counts)[0]:
+                centres[i] = samples[labels == i].mean(axis=0)
+
+        found = counts >= MIN_CLUSTER_RATIO * len(samples)
+        # The 12 unknowns of the model take 4 colours that don't lie on a plane
+        design = numpy.concatenate([_COMBINATIONS[found], numpy.ones((found.sum(), 1), dtype=numpy.float32)], axis=1)
+        if numpy.linalg.matrix_rank(design) < COLORS + 1:
+            return None
+
+        solution, *_ = numpy.linalg.lstsq(design, centres[found], rcond=None)
+        mixing = solution[:COLORS].T
+        if numpy.linalg.cond(mixing) > MAX_CONDITION_NUMBER:
+            return None
+
+        fitted = ColorCalibration(mixing.astype(numpy.float32), solution[COLORS].astype(numpy.float32))
+
+        return fitted, float(_distances(samples, fitted.expected_colors()).min(axis=1).mean())
+
+
+def _distances(samples: ndarray, colors: ndarray) -> ndarray:
+    # Squared, of every sample to every colour
+    return ((samples[:, None, :] - colors[None, :, :]) ** 2).sum(axis=2)
+
+
+def merge_planes(images: list[ndarray]) -> ndarray:
+    # Up to 3 grayscale codes into the planes of a BGR image, the planes without a code are light
+    height = max(image.shape[0] for image in images)
+    width = max(image.shape[1] for image in images)
+
+    merged = numpy.full((height, width, COLORS), 255, dtype=numpy.uint8)
+    for i, image in enumerate(images):
+        merged[: image.shape[0], : image.shape[1], i] = image
+
+    return merged
+
+
+def split_planes(frame: ndarray, calibration: ColorCalibration) -> list[ndarray]:
+    corrected = calibration.correct(frame)
+
+    return [numpy.ascontiguousarray(corrected[:, :, i]) for i in range(COLORS)]
@@ -0,0 +1,84 @@
+import bz2
+import lzma
+import tempfile
+import zlib
+from enum import Enum
+from typing import Optional, Union
+
+from chunking import MappedFile
+
+BLOCK_SIZE = 1 << 20
+SAMPLE_SIZE = 64 * 1024
+# Compressed sample size over the sample size above which the content is sent as is (png, zip, jpg...)
+MAX_COMPRESSION_RATIO = 0.9
+
+
+class Compression(Enum):
+    none = "none"
+    zlib = "zlib"
+    lzma = "lzma"
+    bz2 = "bz2"
+
+
+# The levels every compressor accepts, from the fastest to the smallest
+LEVELS = {Compression.zlib: range(0, 10), Compression.lzma: range(0, 10), Compression.bz2: range(1, 10)}
+
+
+def validate_level(compression: Compression, level: Optional[int]) -> None:
+    if level is None or compression not in LEVELS or level in LEVELS[compression]:
+        return
+
+    levels = LEVELS[compression]
+    raise ValueError(f"The {compression.value} compression level must be between {levels[0]} and {levels[-1]}")
+
+
+def compressor(compression: Compression, level: Optional[int] = None):
+    if compression == Compression.zlib:
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+    elif compression == Compression.lzma:
+        return lzma.LZMACompressor(preset=level)
+    elif compression == Compression.bz2:
+        return bz2.BZ2Compressor(9 if level is None else level)
+
+    raise ValueError(f"No compressor for {compression.value}")
+
+
+def decompressor(compression: Compression):
+    if compression == Compression.zlib:
+        return zlib.decompressobj()
+    elif compression == Compression.lzma:
+        return lzma.LZMADecompressor()
+    elif compression == Compression.bz2:
+        return bz2.BZ2Decompressor()
+
+    raise ValueError(f"No decompressor for {compression.value}")
+
+
+def compresses(content, compression: Compression, level: Optional[int] = None) -> bool:
+    # Whether a sample of the content gets any smaller, already compressed formats don't
+    sample = bytes(content[:SAMPLE_SIZE])
+    if len(sample) == 0:
+        return False
+
+    sample_compressor = compressor(compression, level)
+    compressed_length = len(sample_compressor.compress(sample)) + len(sample_compressor.flush())
+
+    return compressed_length <= len(sample) * MAX_COMPRESSION_RATIO
+
+
+def compress_to_mapped_file(
+    content: Union[bytes, memoryview], compression: Compression, level: Optional[int] = None
+) -> MappedFile:
+    # Compressed block by block into a temporary file, which is then mapped like a file to send. Neither the content nor
+    # its compressed form is ever held in memory as a whole, and chunks can still be repeated in any order.
+    content_compressor = compressor(compression, level)
+
+    with tempfile.TemporaryFile() as spool:
+        for offset in range(0, len(content), BLOCK_SIZE):
+            spool.write(content_compressor.compress(bytes(content[offset : offset + BLOCK_SIZE])))
+        spool.write(content_compressor.flush())
+
+        spool.flush()
+        spool.seek(0)
+
+        return MappedFile(spool)
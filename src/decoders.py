@@ -0,0 +1,252 @@
+import argparse
+import threading
+import time
+from collections import namedtuple
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, Optional
+
+from cv2 import cv2
+from numpy import ndarray
+
+try:
+    import pyzbar.pyzbar as pyzbar
+except ImportError:  # pyzbar, or the zbar library it loads, is not installed
+    pyzbar = None
+
+"""
+Backends finding and reading the QR codes of a grayscale image.
+pyzbar: the zbar library, the historical one.
+opencv: cv2.QRCodeDetectorAruco, or cv2.QRCodeDetector before OpenCV 4.8, without any other dependency. Older OpenCV
+    versions return the codes as text only, the binary payload encoding needs detectAndDecodeBytesMulti.
+Every backend returns the codes as pyzbar does, objects with the data (bytes) and the polygon of the code (points with
+x and y).
+The backends differ in speed and in robustness to blurry or angled frames. A calibration decodes the same frames with
+all of them: the backends reading at least min_decode_rate of the codes any of them read qualify, and the fastest one
+is picked. The one reading the most codes of the others can be tried on the frames the picked one finds no code in.
+Run from src to benchmark the backends on images: python decoders.py tests/images/*.png
+"""
+
+
+class DecoderBackend(Enum):
+    pyzbar = "pyzbar"
+    opencv = "opencv"
+
+
+# Picks the backend from the first frames with codes
+AUTO_DECODER = "auto"
+CALIBRATION_FRAMES = 10
+MIN_DECODE_RATE = 0.9
+
+DecodedCode = namedtuple("DecodedCode", ["data", "polygon"])
+Point = namedtuple("Point", ["x", "y"])
+
+# A QRCodeDetector per thread, the decode workers of the pipeline run at the same time
+_opencv = threading.local()
+
+
+def decode_pyzbar(image: ndarray) -> list:
+    return pyzbar.decode(image)
+
+
+def decode_opencv(image: ndarray) -> list:
+    if not hasattr(_opencv, "detector"):
+        # The detector finding the codes by their ArUco-like finder patterns (OpenCV 4.8) misses fewer of them
+        _opencv.detector = cv2.QRCodeDetectorAruco() if hasattr(cv2, "QRCodeDetectorAruco") else cv2.QRCodeDetector()
+
+    detector = _opencv.detector
+    with_bytes = hasattr(detector, "detectAndDecodeBytesMulti")
+    if with_bytes:
+        found, texts, points, _ = detector.detectAndDecodeBytesMulti(image)
+    else:
+        found, texts, points, _ = detector.detectAndDecodeMulti(image)
+        texts = [text.encode() for text in texts]
+
+    if not found or points is None or not any(texts):
+        # The multi code detector misses some single codes the single code one reads
+        text, points, _ = detector.detectAndDecodeBytes(image) if with_bytes else detector.detectAndDecode(image)
+        if not text or points is None:
+            return []
+
+        texts, points = [text if with_bytes else text.encode()], points.reshape(1, -1, 2)
+
+    return [
+        DecodedCode(bytes(text), [Point(int(x), int(y)) for x, y in corners])
+        for text, corners in zip(texts, points)
+        if text
+    ]
+
+
+DECODERS: dict[DecoderBackend, Callable[[ndarray], list]] = {
+    DecoderBackend.pyzbar: decode_pyzbar,
+    DecoderBackend.opencv: decode_opencv,
+}
+
+
+def available_backends() -> list[DecoderBackend]:
+    return [backend for backend in DecoderBackend if backend != DecoderBackend.pyzbar or pyzbar is not None]
+
+
+# A backend, and the one tried on the frames it finds no code in
+class QRDecoder:
+    def __init__(self, backend: DecoderBackend = DecoderBackend.pyzbar, fallback: Optional[DecoderBackend] = None):
+        for decoder_backend in [backend, fallback]:
+            if decoder_backend is not None and decoder_backend not in available_backends():
+                raise ValueError(f"The {decoder_backend.value} decoder is not available")
+
+        self.backend = backend
+        self.fallback = fallback if fallback != backend else None
+
+        self.fallback_decodes = 0
+        self.fallback_hits = 0
+
+    def decode(self, image: ndarray) -> list:
+        decoded_objects = DECODERS[self.backend](image)
+        if decoded_objects or self.fallback is None:
+            return decoded_objects
+
+        self.fallback_decodes += 1
+        decoded_objects = DECODERS[self.fallback](image)
+        if decoded_objects:
+            self.fallback_hits += 1
+
+        return decoded_objects
+
+    def __str__(self) -> str:
+        fallback = f", {self.fallback.value} on misses" if self.fallback is not None else ""
+
+        return f"{self.backend.value} decoder{fallback}"
+
+
+@dataclass
+class BackendBenchmark:
+    backend: DecoderBackend
+    frames: int = 0
+    # Distinct codes read, of the codes read by any backend
+    codes: int = 0
+    reference_codes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def decode_rate(self) -> float:
+        return self.codes / self.reference_codes if self.reference_codes else 0.0
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.seconds / self.frames if self.frames else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.backend.value}: {self.codes}/{self.reference_codes} codes ({self.decode_rate:.0%}), "
+            f"{self.mean_seconds * 1000:.1f} ms per frame"
+        )
+
+
+def choose_decoder(
+    benchmarks: list[BackendBenchmark], min_decode_rate: float = MIN_DECODE_RATE, fallback: bool = False
+) -> Optional[QRDecoder]:
+    # None when no backend read any code
+    readers = [benchmark for benchmark in benchmarks if benchmark.codes > 0]
+    if not readers:
+        return None
+
+    best_rate = max(benchmark.decode_rate for benchmark in readers)
+    qualified = [benchmark for benchmark in readers if benchmark.decode_rate >= min(min_decode_rate, best_rate)]
+    chosen = min(qualified, key=lambda benchmark: benchmark.mean_seconds)
+
+    others = sorted(
+        (benchmark for benchmark in readers if benchmark is not chosen),
+        key=lambda benchmark: (-benchmark.codes, benchmark.mean_seconds),
+    )
+
+    return QRDecoder(chosen.backend, others[0].backend if fallback and others else None)
+
+
+# Decodes the first frames with codes with every backend, and returns what any of them read. Once enough of them were
+# seen, decodes like the decoder chosen from them
+class CalibratingDecoder:
+    def __init__(
+        self,
+        frames: int = CALIBRATION_FRAMES,
+        min_decode_rate: float = MIN_DECODE_RATE,
+        fallback: bool = False,
+        backends: Optional[list[DecoderBackend]] = None,
+    ):
+        self._frames = frames
+        self._min_decode_rate = min_decode_rate
+        self._fallback = fallback
+        self._lock = threading.Lock()
+
+        self.benchmarks = [BackendBenchmark(backend) for backend in backends or available_backends()]
+        self.decoder: Optional[QRDecoder] = None
+
+    def decode(self, image: ndarray) -> list:
+        if self.decoder is not None:
+            return self.decoder.decode(image)
+
+        results = []
+        for benchmark in self.benchmarks:
+            started = time.perf_counter()
+            decoded_objects = DECODERS[benchmark.backend](image)
+            results.append((benchmark, decoded_objects, time.perf_counter() - started))
+
+        codes = {}
+        for _, decoded_objects, _ in results:
+            for decoded_object in decoded_objects:
+                codes.setdefault(decoded_object.data, decoded_object)
+
+        if not codes:
+            # Frames without codes tell nothing about the backends
+            return []
+
+        with self._lock:
+            for benchmark, decoded_objects, seconds in results:
+                benchmark.frames += 1
+                benchmark.codes += len({decoded_object.data for decoded_object in decoded_objects})
+                benchmark.reference_codes += len(codes)
+                benchmark.seconds += seconds
+
+            if self.decoder is None and self.benchmarks[0].frames >= self._frames:
+                self.decoder = choose_decoder(self.benchmarks, self._min_decode_rate, self._fallback)
+                print(f"Decoder calibrated: {self.decoder} | {' | '.join(map(str, self.benchmarks))}")
+
+        return list(codes.values())
+
+
+def calibrate(
+    images: list[ndarray], min_decode_rate: float = MIN_DECODE_RATE, fallback: bool = False
+) -> tuple[Optional[QRDecoder], list[BackendBenchmark]]:
+    # The decoder chosen on grayscale images, like the sample images of the tests
+    calibrating_decoder = CalibratingDecoder(len(images) + 1, min_decode_rate, fallback)
+    for image in images:
+        calibrating_decoder.decode(image)
+
+    benchmarks = calibrating_decoder.benchmarks
+
+    return choose_decoder(benchmarks, min_decode_rate, fallback), benchmarks
+
+
+def create_decoder(name: str = DecoderBackend.pyzbar.value, fallback: bool = False):
+    # The decoder of a --decoder option
+    if name == AUTO_DECODER:
+        return CalibratingDecoder(fallback=fallback)
+
+    backend = DecoderBackend(name)
+    others = [other for other in available_backends() if other != backend]
+
+    return QRDecoder(backend, others[0] if fallback and others else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the QR decoder backends on images")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--min-decode-rate", type=float, default=MIN_DECODE_RATE)
+
+    arguments = parser.parse_args()
+
+    chosen, backend_benchmarks = calibrate(
+        [cv2.imread(path, cv2.IMREAD_GRAYSCALE) for path in arguments.images], arguments.min_decode_rate, True
+    )
+    for backend_benchmark in backend_benchmarks:
+        print(backend_benchmark)
+    print(f"Chosen: {chosen or 'none, no code was read'}")
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+
+import numpy
+from cv2 import cv2
+from numpy import ndarray
+
+"""
+What happens to a displayed QR image on its way to the peer's webcam, to test and benchmark the decoding without one:
+perspective: the screen is not parallel to the webcam, every corner moves by up to this fraction of the image size.
+blur: out of focus or moving, the size of the Gaussian kernel (0 = sharp).
+noise: sensor noise, the standard deviation of the gray levels added to every pixel.
+crosstalk: the screen primaries and the webcam filters overlap, the fraction of every colour plane seen in the others.
+"""
+
+# Of the top left, top right, bottom right and bottom left corners
+_INWARDS = numpy.float32([[1, 1], [-1, 1], [-1, -1], [1, -1]])
+
+
+@dataclass(frozen=True)
+class Degradation:
+    perspective: float = 0.0
+    blur: int = 0
+    noise: float = 0.0
+    crosstalk: float = 0.0
+
+    def apply(self, image: ndarray, rng: numpy.random.Generator) -> ndarray:
+        if self.crosstalk > 0:
+            image = mix_colors(image, self.crosstalk)
+        if self.perspective > 0:
+            image = warp_perspective(image, self.perspective, rng)
+        if self.blur > 0:
+            image = blur(image, self.blur)
+        if self.noise > 0:
+            image = add_noise(image, self.noise, rng)
+
+        return image
+
+    def __str__(self) -> str:
+        # Without crosstalk as the grayscale degradations always were, the benchmark results keep their keys
+        crosstalk = f", crosstalk={self.crosstalk}" if self.crosstalk > 0 else ""
+
+        return f"perspective={self.perspective}, blur={self.blur}, noise={self.noise}{crosstalk}"
+
+
+def warp_perspective(image: ndarray, strength: float, rng: numpy.random.Generator) -> ndarray:
+    height, width = image.shape[:2]
+    corners = numpy.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    # The corners only move inwards, the code stays in the image
+    moves = rng.uniform(0, strength, (4, 2)) * numpy.float32([width, height]) * _INWARDS
+
+    matrix = cv2.getPerspectiveTransform(corners, (corners + moves).astype(numpy.float32))
+
+    return cv2.warpPerspective(image, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE)
+
+
+def blur(image: ndarray, kernel_size: int) -> ndarray:
+    # Gaussian kernels have an odd size
+    kernel_size = kernel_size | 1
+
+    return cv2.GaussianBlur(image, (kernel_size, kernel_size), 0)
+
+
+def mix_colors(image: ndarray, crosstalk: float) -> ndarray:
+    if image.ndim == 2:
+        return image
+
+    # Half of the leaked fraction into each of the other planes, gray stays gray
+    mixing = numpy.full((3, 3), crosstalk / 2, dtype=numpy.float32)
+    numpy.fill_diagonal(mixing, 1 - crosstalk)
+
+    return (image.astype(numpy.float32) @ mixing.T).clip(0, 255).astype(numpy.uint8)
+
+
+def add_noise(image: ndarray, sigma: float, rng: numpy.random.Generator) -> ndarray:
+    noisy = image.astype(numpy.float32) + rng.normal(0, sigma, image.shape)
+
+    return noisy.clip(0, 255).astype(numpy.uint8)
+
+
+def place_on_frame(
+    image: ndarray, frame_size: tuple[int, int] = (480, 640), left: int = 0, top: int = 0, background: int = 180
+) -> ndarray:
+    # The code displayed on a screen filling part of a webcam frame of (height, width)
+    frame = numpy.full(frame_size + image.shape[2:], background, dtype=numpy.uint8)
+    height = min(image.shape[0], frame_size[0] - top)
+    width = min(image.shape[1], frame_size[1] - left)
+    frame[top : top + height, left : left + width] = image[:height, :width]
+
+    return frame
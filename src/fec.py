@@ -0,0 +1,266 @@
+import math
+import struct
+from typing import Optional
+
+import numpy
+
+from chunking import ContentChunks
+
+"""
+Forward error correction of the window chunks: every block of K data chunks gets M parity chunks, and any K of the
+K + M chunks of a block rebuild it, so the receiver repairs up to M lost or corrupted chunks per block by itself.
+The code is a systematic Reed-Solomon code over GF(256) with a Cauchy generator matrix (any K rows of the identity
+stacked on it are invertible), computed with NumPy on whole chunks at once.
+
+Parity payload (RequestType.parity_data, the header sequence number is block * M + parity index):
+Block length: 4 bytes, the bytes of content in the block. The data chunks of the last block are fewer than K and
+    the last one is shorter, the missing bytes count as zeros
+Parity: chunk size bytes
+"""
+
+GF_POLYNOMIAL = 0x11D
+MAX_FEC_SYMBOLS = 255
+PARITY_HEADER_FORMAT = "<I"
+PARITY_HEADER_LENGTH = struct.calcsize(PARITY_HEADER_FORMAT)
+# Blocks whose parity is kept by the sender, the window only spans a few
+PARITY_CACHE_SIZE = 4
+
+
+def _gf_tables() -> tuple[numpy.ndarray, numpy.ndarray]:
+    exp = numpy.zeros(512, dtype=numpy.uint8)
+    log = numpy.zeros(256, dtype=numpy.int32)
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= GF_POLYNOMIAL
+    exp[255:510] = exp[:255]
+
+    # The product of every pair of elements, multiplying a chunk is a lookup
+    a, b = numpy.meshgrid(numpy.arange(256), numpy.arange(256), indexing="ij")
+    mul = exp[(log[a] + log[b]) % 255]
+    mul[(a == 0) | (b == 0)] = 0
+
+    return exp, mul.astype(numpy.uint8)
+
+
+_EXP, _MUL = _gf_tables()
+
+
+def gf_inverse(a: int) -> int:
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+
+    return int(numpy.nonzero(_MUL[a] == 1)[0][0])
+
+
+def gf_matrix_inverse(matrix: numpy.ndarray) -> numpy.ndarray:
+    # Gauss-Jordan elimination, the matrices are at most M x M
+    size = len(matrix)
+    work = numpy.concatenate([matrix.astype(numpy.uint8), numpy.eye(size, dtype=numpy.uint8)], axis=1)
+    for column in range(size):
+        pivot = next((row for row in range(column, size) if work[row, column]), None)
+        if pivot is None:
+            raise ValueError("Singular matrix")
+
+        work[[column, pivot]] = work[[pivot, column]]
+        work[column] = _MUL[gf_inverse(int(work[column, column])), work[column]]
+        for row in range(size):
+            if row != column and work[row, column]:
+                work[row] ^= _MUL[work[row, column], work[column]]
+
+    return work[:, size:]
+
+
+def _multiply(matrix: numpy.ndarray, vectors: numpy.ndarray) -> numpy.ndarray:
+    # (rows, n) matrix times (n, length) vectors over GF(256)
+    return numpy.bitwise_xor.reduce(_MUL[matrix[:, :, None], vectors[None, :, :]], axis=1)
+
+
+class BlockCode:
+    def __init__(self, data_chunks: int, parity_chunks: int):
+        if data_chunks < 1 or parity_chunks < 1 or data_chunks + parity_chunks > MAX_FEC_SYMBOLS:
+            raise ValueError("Bad number of FEC chunks")
+
+        self.data_chunks = data_chunks
+        self.parity_chunks = parity_chunks
+
+        # 1 / (x_j + y_i) with x_j = K + j and y_i = i, all of them distinct
+        x = numpy.arange(data_chunks, data_chunks + parity_chunks)[:, None]
+        y = numpy.arange(data_chunks)[None, :]
+        self._generator = numpy.vectorize(gf_inverse)(x ^ y).astype(numpy.uint8)
+
+    def encode(self, data: numpy.ndarray) -> numpy.ndarray:
+        # (K, length) data chunks to (M, length) parity chunks
+        return _multiply(self._generator, data)
+
+    def decode(self, data: numpy.ndarray, missing: list[int], parity: dict[int, bytes]) -> numpy.ndarray:
+        # The missing rows of the (K, length) data chunks (their content is ignored), from as many parity chunks
+        if len(parity) < len(missing):
+            raise ValueError("Not enough parity chunks")
+
+        rows = sorted(parity)[: len(missing)]
+        known = data.copy()
+        known[missing] = 0
+
+        # What the missing chunks add to the parity chunks, once the known ones are taken out
+        parity_chunks = numpy.stack([numpy.frombuffer(parity[row], dtype=numpy.uint8) for row in rows])
+        syndromes = parity_chunks ^ _multiply(self._generator[rows], known)
+
+        inverse = gf_matrix_inverse(self._generator[numpy.ix_(rows, missing)])
+
+        return _multiply(inverse, syndromes)
+
+
+def build_parity_payload(block_length: int, parity: bytes) -> bytes:
+    return struct.pack(PARITY_HEADER_FORMAT, block_length) + parity
+
+
+def parse_parity_payload(payload: bytes) -> tuple[int, bytes]:
+    if len(payload) <= PARITY_HEADER_LENGTH:
+        raise ValueError("Bad parity payload")
+
+    (block_length,) = struct.unpack(PARITY_HEADER_FORMAT, payload[:PARITY_HEADER_LENGTH])
+
+    return block_length, payload[PARITY_HEADER_LENGTH:]
+
+
+def _chunk_row(chunk: bytes, chunk_size: int) -> numpy.ndarray:
+    row = numpy.zeros(chunk_size, dtype=numpy.uint8)
+    row[: len(chunk)] = numpy.frombuffer(chunk, dtype=numpy.uint8)
+
+    return row
+
+
+# The parity chunks of the content chunks, computed a block at a time when first shown
+class FecChunks:
+    def __init__(self, chunks: ContentChunks, data_chunks: int, parity_chunks: int):
+        self._chunks = chunks
+        self._code = BlockCode(data_chunks, parity_chunks)
+        self._parity: dict[int, list[bytes]] = {}
+
+    @property
+    def data_chunks(self) -> int:
+        return self._code.data_chunks
+
+    @property
+    def parity_chunks(self) -> int:
+        return self._code.parity_chunks
+
+    def block(self, sequence: int) -> int:
+        return sequence // self.data_chunks
+
+    def parity_ids(self, block: int) -> range:
+        return range(block * self.parity_chunks, (block + 1) * self.parity_chunks)
+
+    def window_symbols(self, pending: list[int], window_end: int) -> list[int]:
+        # The pending data chunks, every block followed by its parity chunks (as -1 - parity id) once the window spans
+        # all of its data chunks
+        symbols = []
+        for i, sequence in enumerate(pending):
+            symbols.append(sequence)
+
+            block = self.block(sequence)
+            block_end = min((block + 1) * self.data_chunks, len(self._chunks))
+            if (i + 1 == len(pending) or self.block(pending[i + 1]) != block) and block_end <= window_end:
+                symbols += [-1 - parity_id for parity_id in self.parity_ids(block)]
+
+        return symbols
+
+    def order(self, symbol: int) -> int:
+        # The position of a data or parity symbol in the blocks, each one its data chunks and then its parity chunks
+        if symbol >= 0:
+            return symbol + self.block(symbol) * self.parity_chunks
+
+        block, index = divmod(-1 - symbol, self.parity_chunks)
+
+        return block * (self.data_chunks + self.parity_chunks) + self.data_chunks + index
+
+    def payload(self, parity_id: int) -> bytes:
+        block, index = divmod(parity_id, self.parity_chunks)
+        if block not in self._parity:
+            if len(self._parity) >= PARITY_CACHE_SIZE:
+                self._parity.pop(next(iter(self._parity)))
+            self._parity[block] = self._encode(block)
+
+        return self._parity[block][index]
+
+    def _encode(self, block: int) -> list[bytes]:
+        first = block * self.data_chunks
+        last = min(first + self.data_chunks, len(self._chunks))
+        chunk_size = self._chunks.chunk_size
+
+        data = numpy.zeros((self.data_chunks, chunk_size), dtype=numpy.uint8)
+        for sequence in range(first, last):
+            data[sequence - first] = _chunk_row(self._chunks[sequence], chunk_size)
+
+        block_length = self._chunks.offset(last) - self._chunks.offset(first)
+
+        return [build_parity_payload(block_length, parity.tobytes()) for parity in self._code.encode(data)]
+
+
+# The parity chunks received for the blocks that miss data chunks. A block is rebuilt into the received file as soon
+# as its data and parity chunks add up to K
+class FecReception:
+    def __init__(self, data_chunks: int, parity_chunks: int, chunk_size: int):
+        self._code = BlockCode(data_chunks, parity_chunks)
+        self._chunk_size = chunk_size
+        # block -> (block length, parity index -> parity)
+        self._parity: dict[int, tuple[int, dict[int, bytes]]] = {}
+        self._completed: set[int] = set()
+
+    def block(self, sequence: int) -> int:
+        return sequence // self._code.data_chunks
+
+    def add_parity(self, parity_id: int, payload: bytes) -> Optional[int]:
+        # The block of the parity chunk, None when it is of no use
+        block, index = divmod(parity_id, self._code.parity_chunks)
+        block_length, parity = parse_parity_payload(payload)
+        if block in self._completed or len(parity) != self._chunk_size or block_length <= 0:
+            return None
+
+        known_length, parities = self._parity.setdefault(block, (block_length, {}))
+        if known_length != block_length:
+            return None
+
+        parities[index] = parity
+
+        return block
+
+    def recover(self, block: int, received_file) -> list[int]:
+        # The sequences rebuilt into the received file
+        if block not in self._parity:
+            return []
+
+        block_length, parities = self._parity[block]
+        first = block * self._code.data_chunks
+        count = min(self._code.data_chunks, math.ceil(block_length / self._chunk_size))
+
+        missing = [i for i in range(count) if first + i not in received_file]
+        if not missing:
+            self._complete(block)
+            return []
+
+        if len(missing) > len(parities):
+            return []
+
+        data = numpy.zeros((self._code.data_chunks, self._chunk_size), dtype=numpy.uint8)
+        for i in range(count):
+            if i not in missing:
+                data[i] = _chunk_row(received_file.read_chunk(first + i), self._chunk_size)
+
+        recovered = self._code.decode(data, missing, parities)
+
+        for i, chunk in zip(missing, recovered):
+            length = min(self._chunk_size, block_length - i * self._chunk_size)
+            received_file.add(first + i, chunk[:length].tobytes())
+
+        self._complete(block)
+
+        return [first + i for i in missing]
+
+    def _complete(self, block: int):
+        del self._parity[block]
+        self._completed.add(block)
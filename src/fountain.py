@@ -0,0 +1,234 @@
+import math
+import struct
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Optional
+
+from chunking import ContentChunks
+from protocol import MAX_SUFFIX_LENGTH
+
+"""
+Fountain symbol payload (RequestType.fountain_data, the header sequence number is the symbol id):
+Session id: 4 bytes
+Content length: 8 bytes
+Chunk size: 2 bytes
+Suffix length: 1 byte
+Suffix: up to 10 bytes
+Symbol: chunk size bytes
+
+Symbols with an id below the number of chunks are the chunks themselves (systematic part), the rest are
+LT encoded: the XOR of a pseudo random set of chunks whose size follows the robust soliton distribution.
+Both sides derive the set from the symbol id, so any K + a few symbols rebuild the content.
+"""
+
+SYMBOL_HEADER_FORMAT = "<IQHB"
+SYMBOL_HEADER_LENGTH = struct.calcsize(SYMBOL_HEADER_FORMAT)
+
+MAX_CONTENT_LENGTH = 2**64 - 1
+# The symbol id is the sequence number of the header, a signed 4 bytes integer
+MAX_SYMBOLS = 2**31
+
+ROBUST_SOLITON_C = 0.1
+ROBUST_SOLITON_DELTA = 0.5
+
+
+@dataclass(frozen=True)
+class BroadcastInfo:
+    session_id: int
+    content_length: int
+    chunk_size: int
+    suffix: Optional[str]
+
+    def __post_init__(self):
+        if not 0 <= self.content_length <= MAX_CONTENT_LENGTH or self.chunk_size <= 0:
+            raise ValueError(f"Bad broadcast content length {self.content_length} or chunk size {self.chunk_size}")
+        if self.num_chunks > MAX_SYMBOLS:
+            raise ValueError(f"Content of {self.content_length} bytes has more chunks than symbol ids")
+
+    @property
+    def num_chunks(self) -> int:
+        return max(1, math.ceil(self.content_length / self.chunk_size))
+
+
+class _SymbolRandom:
+    # xorshift32, so that both peers derive the same chunk sets regardless of the Python version
+    def __init__(self, seed: int):
+        self._state = (seed * 2654435761 + 0x9E3779B9) & 0xFFFFFFFF or 1
+
+    def next(self) -> int:
+        x = self._state
+        x ^= (x << 13) & 0xFFFFFFFF
+        x ^= x >> 17
+        x ^= (x << 5) & 0xFFFFFFFF
+        self._state = x
+
+        return x
+
+    def uniform(self) -> float:
+        return self.next() / 0x100000000
+
+
+def _robust_soliton_cdf(num_chunks: int) -> list[float]:
+    k = num_chunks
+    r = ROBUST_SOLITON_C * math.log(k / ROBUST_SOLITON_DELTA) * math.sqrt(k)
+    pivot = max(1, min(k, int(k / r))) if r > 0 else k
+
+    weights = [0.0] * (k + 1)
+    for d in range(1, k + 1):
+        weights[d] = 1 / k if d == 1 else 1 / (d * (d - 1))
+        if d < pivot:
+            weights[d] += r / (d * k)
+        elif d == pivot:
+            weights[d] += r * math.log(r / ROBUST_SOLITON_DELTA) / k if r > ROBUST_SOLITON_DELTA else 0
+
+    total = sum(weights)
+    cdf = []
+    accumulated = 0.0
+    for weight in weights[1:]:
+        accumulated += weight / total
+        cdf.append(accumulated)
+
+    return cdf
+
+
+def symbol_chunks(symbol_id: int, num_chunks: int, cdf: list[float]) -> list[int]:
+    if symbol_id < num_chunks:
+        return [symbol_id]
+
+    rng = _SymbolRandom(symbol_id)
+    degree = min(num_chunks, bisect_left(cdf, rng.uniform()) + 1)
+
+    chunks = set()
+    while len(chunks) < degree:
+        chunks.add(rng.next() % num_chunks)
+
+    return sorted(chunks)
+
+
+def build_symbol_payload(info: BroadcastInfo, symbol: bytes) -> bytes:
+    suffix = (info.suffix or "").encode()[:MAX_SUFFIX_LENGTH]
+
+    return (
+        struct.pack(SYMBOL_HEADER_FORMAT, info.session_id, info.content_length, info.chunk_size, len(suffix))
+        + suffix
+        + symbol
+    )
+
+
+def parse_symbol_payload(payload: bytes) -> tuple[BroadcastInfo, bytes]:
+    if len(payload) < SYMBOL_HEADER_LENGTH:
+        raise ValueError("Bad fountain symbol length")
+
+    session_id, content_length, chunk_size, suffix_length = struct.unpack(
+        SYMBOL_HEADER_FORMAT, payload[:SYMBOL_HEADER_LENGTH]
+    )
+    symbol = payload[SYMBOL_HEADER_LENGTH + suffix_length :]
+
+    if chunk_size == 0 or suffix_length > MAX_SUFFIX_LENGTH or len(symbol) != chunk_size:
+        raise ValueError("Bad fountain symbol header")
+
+    try:
+        suffix = payload[SYMBOL_HEADER_LENGTH : SYMBOL_HEADER_LENGTH + suffix_length].decode()
+    except UnicodeDecodeError:
+        suffix = None
+
+    return BroadcastInfo(session_id, content_length, chunk_size, suffix), symbol
+
+
+class FountainEncoder:
+    def __init__(self, chunks: ContentChunks, info: BroadcastInfo):
+        self._info = info
+        self._chunks = chunks
+        self._cdf = _robust_soliton_cdf(info.num_chunks)
+
+    @property
+    def num_chunks(self) -> int:
+        return self._info.num_chunks
+
+    def symbol(self, symbol_id: int) -> bytes:
+        value = 0
+        for index in symbol_chunks(symbol_id, self.num_chunks, self._cdf):
+            # An empty content still has one (empty) chunk
+            chunk = self._chunks[index] if index < len(self._chunks) else b""
+            value ^= int.from_bytes(chunk.ljust(self._info.chunk_size, b"\0"), "little")
+
+        return value.to_bytes(self._info.chunk_size, "little")
+
+    def payload(self, symbol_id: int) -> bytes:
+        return build_symbol_payload(self._info, self.symbol(symbol_id))
+
+
+class FountainDecoder:
+    def __init__(self, info: BroadcastInfo):
+        self._info = info
+        self._num_chunks = info.num_chunks
+        self._cdf = _robust_soliton_cdf(self._num_chunks)
+
+        self._decoded: dict[int, int] = {}
+        self._seen: set[int] = set()
+        # Symbols that still depend on more than one unknown chunk, and an index from chunk to them
+        self._pending: dict[int, tuple[set[int], int]] = {}
+        self._waiting_on: dict[int, set[int]] = {}
+
+    @property
+    def info(self) -> BroadcastInfo:
+        return self._info
+
+    @property
+    def received_symbols(self) -> int:
+        return len(self._seen)
+
+    def is_complete(self) -> bool:
+        return len(self._decoded) == self._num_chunks
+
+    def add_symbol(self, symbol_id: int, symbol: bytes) -> bool:
+        if symbol_id in self._seen or self.is_complete():
+            return self.is_complete()
+        self._seen.add(symbol_id)
+
+        value = int.from_bytes(symbol, "little")
+        unknown = set()
+        for index in symbol_chunks(symbol_id, self._num_chunks, self._cdf):
+            if index in self._decoded:
+                value ^= self._decoded[index]
+            else:
+                unknown.add(index)
+
+        if len(unknown) == 1:
+            self._peel(unknown.pop(), value)
+        elif len(unknown) > 1:
+            self._pending[symbol_id] = (unknown, value)
+            for index in unknown:
+                self._waiting_on.setdefault(index, set()).add(symbol_id)
+
+        return self.is_complete()
+
+    def _peel(self, index: int, value: int):
+        ripple = [(index, value)]
+        while ripple:
+            index, value = ripple.pop()
+            if index in self._decoded:
+                continue
+            self._decoded[index] = value
+
+            for symbol_id in self._waiting_on.pop(index, ()):
+                unknown, symbol_value = self._pending[symbol_id]
+                unknown.discard(index)
+                symbol_value ^= value
+
+                if len(unknown) == 1:
+                    del self._pending[symbol_id]
+                    remaining = unknown.pop()
+                    self._waiting_on[remaining].discard(symbol_id)
+                    ripple.append((remaining, symbol_value))
+                else:
+                    self._pending[symbol_id] = (unknown, symbol_value)
+
+    def content(self) -> bytes:
+        if not self.is_complete():
+            raise ValueError("Content is not decoded yet")
+
+        chunk_size = self._info.chunk_size
+        content = b"".join(self._decoded[i].to_bytes(chunk_size, "little") for i in range(self._num_chunks))
+
+        return content[: self._info.content_length]
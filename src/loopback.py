@@ -0,0 +1,416 @@
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy
+from cv2 import cv2
+from numpy import ndarray
+
+from compression import Compression
+from decoders import AUTO_DECODER, DecoderBackend
+from degradation import Degradation
+from main import QRCodeCommunication
+from payload_encoding import PayloadEncoding
+from protocol import RequestHeader, RequestType
+from rtt import MAX_RETRANSMISSIONS
+from webcam import WebcamReader
+
+"""
+Two peers exchanging their QR images through an in-memory optical link, without webcams nor windows.
+Every peer shows its images on a Screen, and reads the other peer's screen through a LoopbackCapture, which stands in
+for its cv2.VideoCapture: it delivers frames at the frame rate, as the screen was latency seconds earlier, drops some
+of them, scales them down to the camera resolution and degrades them. Decoding, the protocol and the files are the
+real ones, so a transfer measures the whole path.
+Run from src: python loopback.py --size 4000 --latency 0.1 --drop 0.1 --window 4
+"""
+
+BLANK_FRAME = numpy.full((64, 64, 3), 255, dtype=numpy.uint8)
+DUPLEX_ACK_LENGTH = 4
+# The history of a screen is kept this long past the latency
+SCREEN_HISTORY_SECONDS = 1.0
+
+
+@dataclass(frozen=True)
+class LinkOptions:
+    # Seconds between showing an image and the camera seeing it
+    latency: float = 0.1
+    frame_rate: float = 30.0
+    drop_probability: float = 0.0
+    # Of the camera frames, larger images are scaled down to fit
+    frame_height: int = 480
+    degradation: Degradation = Degradation()
+    seed: int = 0
+
+
+# What a peer displays, along with what it displayed during the last moments
+class Screen:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shown: deque[tuple[float, Optional[ndarray]]] = deque([(0.0, None)])
+
+    def show(self, image: Optional[ndarray]) -> None:
+        with self._lock:
+            if image is self._shown[-1][1]:
+                return
+
+            now = time.monotonic()
+            self._shown.append((now, image))
+            while len(self._shown) > 1 and self._shown[1][0] < now - SCREEN_HISTORY_SECONDS:
+                self._shown.popleft()
+
+    def seen_at(self, moment: float) -> Optional[ndarray]:
+        with self._lock:
+            image = self._shown[0][1]
+            for shown_at, shown_image in self._shown:
+                if shown_at > moment:
+                    break
+                image = shown_image
+
+            return image
+
+
+# The camera of a peer pointed at the other peer's screen, with the interface of cv2.VideoCapture
+class LoopbackCapture:
+    def __init__(self, screen: Screen, options: LinkOptions, seed: int):
+        self._screen = screen
+        self._options = options
+        self._random = random.Random(seed)
+        self._rng = numpy.random.default_rng(seed)
+
+        self._opened = True
+        self._next_frame = time.monotonic()
+
+        self.frames = 0
+        self.dropped_frames = 0
+
+    def isOpened(self) -> bool:
+        return self._opened
+
+    def set(self, property_id: int, value: float) -> bool:
+        return True
+
+    def release(self) -> None:
+        self._opened = False
+
+    def read(self) -> tuple[bool, ndarray]:
+        # Frames come at the frame rate, however fast they are read
+        now = time.monotonic()
+        if now < self._next_frame:
+            time.sleep(self._next_frame - now)
+        self._next_frame = max(now, self._next_frame) + 1 / self._options.frame_rate
+
+        self.frames += 1
+        image = self._screen.seen_at(time.monotonic() - self._options.latency)
+        if image is None:
+            return True, BLANK_FRAME
+
+        if self._random.random() < self._options.drop_probability:
+            self.dropped_frames += 1
+
+            return True, BLANK_FRAME
+
+        if image.shape[0] > self._options.frame_height:
+            size = self._options.frame_height * image.shape[1] // image.shape[0], self._options.frame_height
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+        frame = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if image.ndim == 2 else image
+
+        return True, self._options.degradation.apply(frame, self._rng)
+
+
+# A peer that shows its images on a Screen, and counts the frames it builds
+class LoopbackPeer(QRCodeCommunication):
+    def __init__(self, screen: Screen, verbose: bool = False, **options):
+        super().__init__(**options)
+
+        self._screen = screen
+        self._verbose = verbose
+
+        self.frames = 0
+        self.data_frames = 0
+        self.retransmitted_frames = 0
+        self.sent_sequences: set[int] = set()
+
+    def show_image(self):
+        self._screen.show(self._current_image)
+
+    def close_windows(self):
+        self._current_image = None
+        self._screen.show(None)
+
+    def _print(self, string: str):
+        if self._verbose:
+            super()._print(string)
+
+    def _build_image(self, header: RequestHeader, payload: Optional[bytes] = None, keep_alive: bool = True):
+        self._count_frame([header])
+        super()._build_image(header, payload, keep_alive)
+
+    def _build_tiled_image(self, frames: list[tuple[RequestHeader, bytes]], keep_alive: bool = True):
+        self._count_frame([header for header, _ in frames])
+        super()._build_tiled_image(frames, keep_alive)
+
+    def _count_frame(self, headers: list[RequestHeader]):
+        self.frames += 1
+        for header in headers:
+            if header.request_type == RequestType.duplex_data:
+                # The same chunk is shown again whenever the acknowledgement it carries changes, that is no repeat
+                if header.payload_length > DUPLEX_ACK_LENGTH and header.sequence_number not in self.sent_sequences:
+                    self.data_frames += 1
+                    self.sent_sequences.add(header.sequence_number)
+                continue
+
+            if header.request_type == RequestType.parity_data:
+                # Parity chunks are data frames, their sequences are parity ids
+                self.data_frames += 1
+                continue
+
+            if header.request_type not in (RequestType.send_data, RequestType.fountain_data):
+                continue
+
+            self.data_frames += 1
+            if header.sequence_number in self.sent_sequences:
+                self.retransmitted_frames += 1
+            self.sent_sequences.add(header.sequence_number)
+
+
+@dataclass
+class LinkReport:
+    content_length: int
+    seconds: float
+    completed: bool
+    intact: bool
+    # Distinct data chunks (or fountain symbols) sent, both ways
+    chunks: int
+    data_frames: int
+    retransmitted_frames: int
+    sender_frames: int
+    receiver_frames: int
+    camera_frames: int
+    dropped_frames: int
+    errors: list[str] = field(default_factory=list)
+
+    @property
+    def goodput(self) -> float:
+        # Bytes of the file per second, end to end
+        return self.content_length / self.seconds if self.completed and self.seconds > 0 else 0.0
+
+    @property
+    def round_trips_per_chunk(self) -> float:
+        # Every image of the receiver answers one of the sender
+        return self.receiver_frames / self.chunks if self.chunks else 0.0
+
+    @property
+    def retransmit_ratio(self) -> float:
+        return self.retransmitted_frames / self.data_frames if self.data_frames else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{'completed' if self.completed else 'not completed'}, {'intact' if self.intact else 'not intact'}: "
+            f"{self.content_length} bytes in {self.seconds:.2f}s, goodput {self.goodput:.0f} B/s, "
+            f"{self.chunks} chunks, {self.round_trips_per_chunk:.2f} round trips per chunk, "
+            f"retransmit ratio {self.retransmit_ratio:.2f}, "
+            f"{self.sender_frames} sender / {self.receiver_frames} receiver images, "
+            f"{self.dropped_frames} / {self.camera_frames} camera frames dropped"
+        )
+
+
+def _run_peer(peer: LoopbackPeer, capture: LoopbackCapture, errors: list[str], event_loop: bool = False):
+    try:
+        webcam_reader = WebcamReader(capture_webcam=capture, metrics=peer._metrics, decoder=peer._create_decoder())
+        if event_loop:
+            asyncio.run(peer.run(webcam_reader))
+        else:
+            peer.start(webcam_reader)
+    except Exception as e:
+        errors.append(f"{type(e).__name__}: {e}")
+        capture.release()
+
+
+def _received_contents(folder: str) -> list[bytes]:
+    contents = []
+    for file_name in os.listdir(folder):
+        with open(os.path.join(folder, file_name), "rb") as fp:
+            contents.append(fp.read())
+
+    return contents
+
+
+def run_transfer(
+    content: bytes,
+    suffix: str = ".bin",
+    link: LinkOptions = LinkOptions(),
+    timeout: float = 120.0,
+    verbose: bool = False,
+    metrics_folder: Optional[str] = None,
+    reverse_content: Optional[bytes] = None,
+    event_loop: bool = False,
+    **peer_options,
+) -> LinkReport:
+    # Sends the content from one peer to the other, and the reverse content back when given, until the peers removed
+    # the sent files or the timeout. The peers write their metrics to the sender and receiver sub folders of the
+    # metrics folder when it is given, and run on asyncio event loops with event_loop
+    metrics_folders = {"sender": None, "receiver": None}
+    if metrics_folder is not None:
+        metrics_folders = {name: os.path.join(metrics_folder, name) for name in metrics_folders}
+
+    with tempfile.TemporaryDirectory() as folder:
+        folders = {name: os.path.join(folder, name) for name in ["send", "received", "peer-send", "peer-received"]}
+        for path in folders.values():
+            os.mkdir(path)
+
+        file_paths = [os.path.join(folders["send"], f"file{suffix}")]
+        with open(file_paths[0], "wb") as fp:
+            fp.write(content)
+
+        if reverse_content is not None:
+            file_paths.append(os.path.join(folders["peer-send"], f"reverse{suffix}"))
+            with open(file_paths[1], "wb") as fp:
+                fp.write(reverse_content)
+
+        sender_screen, receiver_screen = Screen(), Screen()
+        sender = LoopbackPeer(
+            sender_screen,
+            verbose,
+            received_files_folder=folders["peer-received"],
+            files_to_send_folder=folders["send"],
+            metrics_folder=metrics_folders["sender"],
+            **peer_options,
+        )
+        receiver = LoopbackPeer(
+            receiver_screen,
+            verbose,
+            received_files_folder=folders["received"],
+            files_to_send_folder=folders["peer-send"],
+            metrics_folder=metrics_folders["receiver"],
+            **peer_options,
+        )
+        sender_capture = LoopbackCapture(receiver_screen, link, link.seed)
+        receiver_capture = LoopbackCapture(sender_screen, link, link.seed + 1)
+
+        errors = []
+        threads = [
+            threading.Thread(target=_run_peer, args=(sender, sender_capture, errors, event_loop), daemon=True),
+            threading.Thread(target=_run_peer, args=(receiver, receiver_capture, errors, event_loop), daemon=True),
+        ]
+
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+
+        while any(map(os.path.exists, file_paths)) and not errors and time.monotonic() - start < timeout:
+            time.sleep(0.01)
+
+        seconds = time.monotonic() - start
+        completed = not any(map(os.path.exists, file_paths))
+
+        for capture in [sender_capture, receiver_capture]:
+            capture.release()
+        for thread in threads:
+            thread.join()
+
+        intact = _received_contents(folders["received"]) == [content]
+        if reverse_content is not None:
+            intact = intact and _received_contents(folders["peer-received"]) == [reverse_content]
+
+        return LinkReport(
+            content_length=len(content) + len(reverse_content or b""),
+            seconds=seconds,
+            completed=completed,
+            intact=intact,
+            chunks=len(sender.sent_sequences) + len(receiver.sent_sequences),
+            data_frames=sender.data_frames + receiver.data_frames,
+            retransmitted_frames=sender.retransmitted_frames + receiver.retransmitted_frames,
+            sender_frames=sender.frames,
+            receiver_frames=receiver.frames,
+            camera_frames=sender_capture.frames + receiver_capture.frames,
+            dropped_frames=sender_capture.dropped_frames + receiver_capture.dropped_frames,
+            errors=errors,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transfer a file between two peers over a simulated optical link")
+    parser.add_argument("--file", help="The file to send, random bytes when not given")
+    parser.add_argument("--size", help="Number of random bytes to send", type=int, default=4000)
+    parser.add_argument("--reverse-size", help="Number of random bytes the receiver sends back", type=int, default=0)
+    parser.add_argument("--latency", help="Seconds between showing an image and seeing it", type=float, default=0.1)
+    parser.add_argument("--frame-rate", help="Camera frames per second", type=float, default=30.0)
+    parser.add_argument("--drop", help="Probability that a camera frame is lost", type=float, default=0.0)
+    parser.add_argument("--perspective", help="Perspective distortion of the frames", type=float, default=0.0)
+    parser.add_argument("--blur", help="Gaussian blur kernel size of the frames", type=int, default=0)
+    parser.add_argument("--noise", help="Standard deviation of the noise added to the frames", type=float, default=0.0)
+    parser.add_argument(
+        "--crosstalk", help="Fraction of every colour plane seen in the others", type=float, default=0.0
+    )
+    parser.add_argument("--timeout", help="Seconds before the transfer is given up", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--window-size", type=int, default=1)
+    parser.add_argument("--tiles", type=int, default=1)
+    parser.add_argument("--adaptive", action="store_true")
+    parser.add_argument("--broadcast", action="store_true")
+    parser.add_argument("--duplex", action="store_true")
+    parser.add_argument("--fec", type=int, nargs=2, metavar=("K", "M"))
+    parser.add_argument("--colors", action="store_true")
+    parser.add_argument("--asyncio", help="Run the peers on asyncio event loops", action="store_true")
+    parser.add_argument("--max-retransmissions", type=int, default=MAX_RETRANSMISSIONS)
+    parser.add_argument(
+        "--decoder", choices=[backend.value for backend in DecoderBackend] + [AUTO_DECODER], default="pyzbar"
+    )
+    parser.add_argument("--decoder-fallback", action="store_true")
+    parser.add_argument("--protocol-version", type=int, default=1)
+    parser.add_argument("--encoding", choices=[encoding.value for encoding in PayloadEncoding], default="base64")
+    parser.add_argument("--compression", choices=[compression.value for compression in Compression], default="none")
+    parser.add_argument("--metrics-folder", help="Folder the metrics of the sender and the receiver are written to")
+    parser.add_argument("--verbose", action="store_true")
+
+    arguments = parser.parse_args()
+
+    if arguments.file:
+        with open(arguments.file, "rb") as f:
+            file_content = f.read()
+        file_suffix = os.path.splitext(arguments.file)[1]
+    else:
+        file_content = random.Random(arguments.seed).randbytes(arguments.size)
+        file_suffix = ".bin"
+
+    report = run_transfer(
+        file_content,
+        file_suffix,
+        LinkOptions(
+            latency=arguments.latency,
+            frame_rate=arguments.frame_rate,
+            drop_probability=arguments.drop,
+            degradation=Degradation(arguments.perspective, arguments.blur, arguments.noise, arguments.crosstalk),
+            seed=arguments.seed,
+        ),
+        arguments.timeout,
+        arguments.verbose,
+        arguments.metrics_folder,
+        random.Random(arguments.seed + 1).randbytes(arguments.reverse_size) if arguments.reverse_size else None,
+        arguments.asyncio,
+        window_size=arguments.window_size,
+        tiles=arguments.tiles,
+        adaptive=arguments.adaptive,
+        broadcast=arguments.broadcast,
+        duplex=arguments.duplex,
+        fec=arguments.fec,
+        colors=arguments.colors,
+        max_retransmissions=arguments.max_retransmissions,
+        decoder=arguments.decoder,
+        decoder_fallback=arguments.decoder_fallback,
+        protocol_version=arguments.protocol_version,
+        encoding=PayloadEncoding(arguments.encoding),
+        compression=Compression(arguments.compression),
+    )
+
+    print(report)
+    for error in report.errors:
+        print(error)
@@ -1,20 +1,64 @@
 # Main
 import argparse
-import glob
+import asyncio
+import math
 import os.path
+import random
 import time
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Optional
+from typing import Callable, Optional, Union
 
 import cv2.cv2 as cv
-
-from protocol import RequestHeader, RequestType, HEADER_LENGTH, calculate_hash, VERSION
-from qr_creator import QRCodeCreator
+import numpy
+
+from protocol import (
+    RequestHeader,
+    RequestType,
+    HEADER_LENGTH,
+    MAX_SUFFIX_LENGTH,
+    calculate_hash,
+    SUPPORTED_VERSIONS,
+    VERSION,
+    build_connection_payload,
+    parse_connection_payload,
+    encode_options,
+    decode_options,
+    build_ack_payload,
+    parse_ack_payload,
+    build_duplex_payload,
+    parse_duplex_payload,
+    build_nack_payload,
+    parse_nack_payload,
+)
+from adaptive import ERROR_CORRECTION_LEVELS, AdaptiveController
+from batch import MAX_BATCH_FILES, BatchContent, BatchFile, BatchReception, build_manifest
+from chunking import DEFAULT_CHUNK_SIZE, ContentChunks, MappedFile
+from color_planes import COLORS
+from compression import Compression, compress_to_mapped_file, compresses, validate_level
+from decoders import AUTO_DECODER, DecoderBackend, create_decoder
+from fec import FecChunks, FecReception
+from fountain import BroadcastInfo, FountainDecoder, FountainEncoder, parse_symbol_payload
+from metrics import METRICS_INTERVAL, Metrics, timed
+from outbox import POLL_INTERVAL, Outbox
+from payload_encoding import PayloadEncoding
+from pipeline import PipelinedWebcamReader
+from qr_creator import TILE_ERROR_CORRECTION_LEVEL, QRCodeCreator
+from reception import ReceivedFile
+from rtt import MAX_RETRANSMISSIONS, RttEstimator
+from tracking import RegionTracker
+from session import MAX_TILES, MAX_WINDOW_SIZE, SessionOptions
 from webcam import WebcamReader
 
 WAITING_TIMEOUT_SECONDS = 10
+# After a timeout, so that the peer times out as well
+TIMEOUT_PAUSE_SECONDS = 5
+# Of the event loop timer of the periodic frames, in a state without any
+IDLE_TIMER_INTERVAL = 0.1  # in seconds
+# The shown frame moves by as many pixels when it is shown again, so that a camera that missed it gets a new image
+NUDGE_PIXELS = 4
 
 
 class Status(Enum):
@@ -25,84 +69,460 @@ class Status(Enum):
 
     receiving_data = 4
 
+    broadcasting = 5
+
+    duplex = 6
+
 
-NUM_BYTES_PER_MESSAGE = 150
+NUM_BYTES_PER_MESSAGE = DEFAULT_CHUNK_SIZE
 PRINT_INTERVAL = 5  # in seconds
 
+WINDOW_FRAME_INTERVAL = timedelta(milliseconds=200)
+
+ADAPTIVE_IMAGE_SIZE = 560  # in pixels
+
+RENDER_AHEAD_FRAMES = 2
+
+BROADCAST_FRAME_INTERVAL = timedelta(milliseconds=200)
+MAX_BROADCAST_DECODERS = 4
+
 
 class QRCodeCommunication:
-    def __init__(self, received_files_folder: str):
+    def __init__(
+        self,
+        received_files_folder: str,
+        window_size: int = 1,
+        broadcast: bool = False,
+        broadcast_overhead: float = 2.0,
+        tiles: int = 1,
+        adaptive: bool = False,
+        encoding: PayloadEncoding = PayloadEncoding.base64,
+        render_ahead: int = RENDER_AHEAD_FRAMES,
+        decode_workers: int = 0,
+        track_region: bool = False,
+        protocol_version: int = VERSION,
+        outbox_poll_interval: float = POLL_INTERVAL,
+        batch: bool = False,
+        compression: Compression = Compression.none,
+        compression_level: Optional[int] = None,
+        files_to_send_folder: Optional[str] = None,
+        metrics_folder: Optional[str] = None,
+        metrics_interval: float = METRICS_INTERVAL,
+        trace_memory: bool = False,
+        duplex: bool = False,
+        fec: Optional[tuple[int, int]] = None,
+        colors: bool = False,
+        max_retransmissions: int = MAX_RETRANSMISSIONS,
+        decoder: str = DecoderBackend.pyzbar.value,
+        decoder_fallback: bool = False,
+    ):
         self._qr_code_creator = QRCodeCreator()
+        # Number of data frames rendered in the background while the current one is shown
+        self._render_ahead_frames = max(0, render_ahead)
 
         self._received_files_folder = received_files_folder or "received-files"
-        self._files_to_send_folder = "send-files"
+        self._files_to_send_folder = files_to_send_folder or "send-files"
+        self._outbox = Outbox(self._files_to_send_folder, outbox_poll_interval)
 
         self._status = Status.waiting
 
         self._sequence = 0
 
-        self._file_array: dict[int, bytes] = defaultdict(bytes)
+        # What this peer offers when sending, and what was agreed in the handshake of the current transfer
+        window = max(1, min(window_size, MAX_WINDOW_SIZE))
+        fec_data, fec_parity = fec or (0, 0)
+        self._options = SessionOptions(
+            window,
+            max(1, min(tiles, MAX_TILES)) if window > 1 else 1,
+            encoding,
+            protocol_version,
+            NUM_BYTES_PER_MESSAGE,
+            compression=compression,
+            fec_data=fec_data,
+            fec_parity=fec_parity,
+            colors=COLORS if colors and window > 1 else 1,
+        )
+        # Rejected here rather than when the first file is compressed
+        validate_level(compression, compression_level)
+        self._compression_level = compression_level
+        self._session = SessionOptions()
+        self._offered = self._options
+
+        # Selective repeat
+        self._acknowledged: set[int] = set()
+        self._shown_sequences: list[int] = []
+        # Of an adaptive session, displayed when the retransmission timer expired. Shown alone until acknowledged
+        self._timed_out: set[int] = set()
+        # Asked for by the receiver after the finish, repeated until they are acknowledged
+        self._repeats: list[int] = []
+        self._pending_acks: list[int] = []
+        self._last_ack: Optional[tuple[int, list[int]]] = None
+        # Forward error correction of the window. Parity chunks are shown along with the data chunks of their block,
+        # and the receiver rebuilds the lost data chunks of a block from them
+        self._fec: Optional[FecChunks] = None
+        self._fec_reception: Optional[FecReception] = None
+
+        # Round trip time of the data frames, kept across the sessions with the same peer. A frame that isn't answered
+        # within the retransmission timeout is shown again, the session is given up after max_retransmissions of them
+        self._rtt = RttEstimator()
+        self._max_retransmissions = max_retransmissions
+        # When the chunks were shown, the ones shown again are not sampled
+        self._sent_at: dict[int, float] = {}
+        self._retransmitted: set[int] = set()
+        self._rto_deadline: Optional[float] = None
+        self._rto_expiries = 0
+        self._last_answer: Optional[tuple] = None
+        self._nudge_direction = 1
+
+        # Fountain coded broadcast. The sender emits num_chunks * overhead symbols and never waits for the peer
+        self._broadcast = broadcast
+        self._broadcast_overhead = broadcast_overhead
+        self._fountain_encoder: Optional[FountainEncoder] = None
+        self._symbol_id = 0
+        self._fountain_decoders: dict[int, FountainDecoder] = {}
+        self._completed_broadcasts: set[int] = set()
+
+        # Adapts the chunk size and the QR error correction level of the data frames to the link quality
+        self._adaptive_enabled = adaptive
+        self._adaptive: Optional[AdaptiveController] = None
+        # The error correction level every chunk was first shown with, the one it is sized for
+        self._shown_levels: dict[int, int] = {}
+
+        self._received_file: Optional[ReceivedFile] = None
+        self._batch_enabled = batch
+        # The last transfer was received and confirmed, its finish is confirmed again until another one starts
+        self._confirmed_finish = False
+        self._batch: Optional[BatchReception] = None
+        self._file_chunks: Optional[ContentChunks] = None
+        # The content as is, sent instead of the compressed one when the receiver doesn't support the compression
+        self._content: Optional[Union[memoryview, BatchContent]] = None
+        self._mapped_files: list[MappedFile] = []
+        self._next_unsent = 0
         self._file_path: Optional[str] = None
+        # Removed once the receiver confirmed the finish
+        self._sent_paths: list[str] = []
         self._file_suffix: Optional[str] = None
 
+        # Both peers send a file in the same session, the acknowledgements ride on the data frames. The initiator (the
+        # peer that sent start_connection) ends the session with finish once both files were acknowledged
+        self._duplex_enabled = duplex
+        self._duplex_initiator = False
+        self._peer_done = False
+        # (sequence, acknowledgement) of the shown duplex frame
+        self._duplex_frame: Optional[tuple[int, int]] = None
+
         self._current_image = None
         self._last_build = None
+        self._last_frame = None
+
+        # Capture and decode on their own threads when set, on the state machine thread otherwise
+        self._decode_workers = decode_workers
+        # Scan only around the last decoded QR codes
+        self._track_region = track_region
+        # A decoder backend, or the fastest one on the first frames with codes (auto), and another one on misses
+        self._decoder = decoder
+        self._decoder_fallback = decoder_fallback
+
+        # Stage timings, counters and the transfer progress, exported to the folder every interval when it is given
+        self._metrics_folder = metrics_folder
+        self._metrics_interval = metrics_interval
+        self._metrics: Optional[Metrics] = Metrics(trace_memory) if metrics_folder else None
+        self._last_metrics_export = time.monotonic()
 
         self._prints: dict[str, datetime] = {}
 
-    def start(self):
-        with WebcamReader() as webcam:
+        # Event loop runtime, the frames are ignored until the pause after a timeout is over
+        self._timeout_timer: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+
+    def _create_decoder(self):
+        return create_decoder(self._decoder, self._decoder_fallback)
+
+    def _create_webcam_reader(self):
+        reader_options = {"tracker": RegionTracker()} if self._track_region else {}
+        if self._decoder != DecoderBackend.pyzbar.value or self._decoder_fallback:
+            reader_options["decoder"] = self._create_decoder()
+        if self._metrics is not None:
+            reader_options["metrics"] = self._metrics
+        if self._decode_workers > 0:
+            return PipelinedWebcamReader(self._decode_workers, **reader_options)
+
+        return WebcamReader(**reader_options)
+
+    def start(self, webcam_reader=None):
+        # Frames come from any reader with the WebcamReader interface, the webcam when none is given
+        if webcam_reader is None:
+            webcam_reader = self._create_webcam_reader()
+
+        with webcam_reader as webcam:
             while webcam.is_capturing():
                 self.show_image()
 
                 # If we are waiting too long for something, reset and continue
-                if (
-                    self._status != Status.waiting
-                    and self._last_build is not None
-                    and datetime.now() - self._last_build > timedelta(seconds=WAITING_TIMEOUT_SECONDS)
-                ):
-                    print("Took too much waiting and nothing happened")
-                    self._reset_and_close()
+                if self._waiting_too_long():
+                    self._time_out()
 
-                    time.sleep(5)
+                    time.sleep(TIMEOUT_PAUSE_SECONDS)
 
-                data = webcam.capture()
+                self._send_periodic_frames()
 
-                data_valid, header, payload = self._parse_data(data)
+                self._handle_frame(self._capture_function(webcam)())
 
-                if not data_valid:
-                    continue
+        self._export_metrics(force=True)
 
-                if header is None and self._status != Status.waiting:
-                    continue
+    async def run(self, webcam_reader=None):
+        # Event driven, the frames are captured and decoded on a thread and handled on the event loop as they come.
+        # The waiting timeout and the periodic frames are timers of the loop, a timeout doesn't stop the capture
+        if webcam_reader is None:
+            webcam_reader = self._create_webcam_reader()
 
-                if header is not None:
-                    self._print(
-                        f"Received message. Request Type: {header.request_type.name}. Sequence: {header.sequence_number}"
-                    )
+        loop = asyncio.get_running_loop()
+        with webcam_reader as webcam, ThreadPoolExecutor(max_workers=1, thread_name_prefix="qr-capture") as executor:
+            periodic_frames = asyncio.create_task(self._periodic_frames())
+            try:
+                while webcam.is_capturing():
+                    self.show_image()
+
+                    messages = await loop.run_in_executor(executor, self._capture_function(webcam))
+                    if time.monotonic() < self._paused_until:
+                        continue
+
+                    self._handle_frame(messages)
+                    self._schedule_timeout()
+            finally:
+                periodic_frames.cancel()
+                if self._timeout_timer is not None:
+                    self._timeout_timer.cancel()
+                    self._timeout_timer = None
+
+        self._export_metrics(force=True)
+
+    def _capture_function(self, webcam) -> Callable[[], list[Optional[bytes]]]:
+        # The messages of the next frame, [None] without any. Decided by the current session, called on any thread
+        if self._session.colors > 1 and self._status == Status.receiving_data:
+            colors = self._session.colors
+
+            return lambda: webcam.capture_all(colors=colors) or [None]
+        elif self._session.tiles > 1:
+            return lambda: webcam.capture_all() or [None]
+
+        return lambda: [webcam.capture()]
+
+    def _handle_frame(self, messages: list[Optional[bytes]]):
+        self._count("frames")
+        if messages == [None]:
+            self._count("empty_frames")
+
+        for data in messages:
+            self._handle_message(data)
+
+        if self._pending_acks:
+            self._flush_acks()
+
+        self._export_metrics()
+
+    def _send_periodic_frames(self):
+        if self._rto_deadline is not None and time.monotonic() >= self._rto_deadline:
+            self._retransmission_timeout()
+
+        if self._status == Status.sent_data and self._session.window > 1:
+            self._rotate_window()
+        elif self._status == Status.broadcasting:
+            self._broadcast_next_symbol()
+
+    async def _periodic_frames(self):
+        while True:
+            await asyncio.sleep(self._periodic_frame_delay())
+
+            self._send_periodic_frames()
+            self.show_image()
+            # The retransmission timeouts are counted here, the sender gives up between two frames
+            if not self._time_out_if_stalled():
+                self._schedule_timeout()
+
+    def _periodic_frame_delay(self) -> float:
+        # Until the next window rotation, broadcast symbol or retransmission timeout is due
+        delays = []
+        if self._status == Status.sent_data and self._session.window > 1 and self._last_frame is not None:
+            delays.append((self._last_frame + WINDOW_FRAME_INTERVAL - self._now()).total_seconds())
+        elif self._status == Status.broadcasting and self._last_build is not None:
+            delays.append((self._last_build + BROADCAST_FRAME_INTERVAL - self._now()).total_seconds())
+        if self._rto_deadline is not None:
+            delays.append(self._rto_deadline - time.monotonic())
+
+        return max(0.0, min(delays)) if delays else IDLE_TIMER_INTERVAL
+
+    def _waiting_too_long(self) -> bool:
+        if self._status == Status.waiting:
+            return False
+
+        # A sender gives up sooner on a fast link, after the retransmission timeouts in a row
+        return self._rto_expiries > self._max_retransmissions or (
+            self._last_build is not None
+            and datetime.now() - self._last_build > timedelta(seconds=WAITING_TIMEOUT_SECONDS)
+        )
 
-                if self._status == Status.waiting:
-                    self._handle_waiting_status(header, payload)
-                elif self._status == Status.waiting_to_send_file:
-                    self._handle_waiting_to_send_file_status(header)
-                elif self._status == Status.sent_data:
-                    self._handle_sent_data_status(header)
-                elif self._status == Status.finished:
-                    self._handle_finished_status(header)
-                elif self._status == Status.receiving_data:
-                    self._handle_receiving_data_status(header, payload)
+    def _time_out(self):
+        print("Took too much waiting and nothing happened")
+        self._count("timeouts")
+        self._reset_and_close()
+
+    def _schedule_timeout(self):
+        # At the deadline of the last built frame. A frame built meanwhile moves the deadline, the timer then
+        # schedules itself again instead of being rescheduled on every frame
+        if self._timeout_timer is not None or self._status == Status.waiting or self._last_build is None:
+            return
+
+        deadline = self._last_build + timedelta(seconds=WAITING_TIMEOUT_SECONDS)
+        self._timeout_timer = asyncio.get_running_loop().call_later(
+            max(0.0, (deadline - datetime.now()).total_seconds()), self._on_timeout
+        )
+
+    def _on_timeout(self):
+        self._timeout_timer = None
+
+        if not self._time_out_if_stalled():
+            self._schedule_timeout()
+
+    def _time_out_if_stalled(self) -> bool:
+        if not self._waiting_too_long():
+            return False
+
+        self._time_out()
+        self._paused_until = time.monotonic() + TIMEOUT_PAUSE_SECONDS
+
+        return True
+
+    def _handle_message(self, data: Optional[bytes]):
+        with timed(self._metrics, "parse"):
+            data_valid, header, payload = self._parse_data(data)
+
+        if not data_valid:
+            return
+
+        if header is None and self._status != Status.waiting:
+            return
+
+        if header is not None:
+            self._print(
+                f"Received message. Request Type: {header.request_type.name}. Sequence: {header.sequence_number}"
+            )
+
+            if header.request_type == RequestType.repeat_data:
+                self._count("repeats_received")
+
+        if self._status == Status.waiting:
+            self._handle_waiting_status(header, payload)
+        elif self._status == Status.waiting_to_send_file:
+            self._handle_waiting_to_send_file_status(header, payload)
+        elif self._status == Status.sent_data:
+            self._handle_sent_data_status(header, payload)
+        elif self._status == Status.finished:
+            self._handle_finished_status(header, payload)
+        elif self._status == Status.receiving_data:
+            self._handle_receiving_data_status(header, payload)
+        elif self._status == Status.duplex:
+            self._handle_duplex_status(header, payload)
+
+        if self._status in (Status.sent_data, Status.finished) and header.request_type in (
+            RequestType.confirm_connection,
+            RequestType.confirm_data,
+            RequestType.repeat_data,
+        ):
+            self._on_answer(header)
+
+        self._update_progress()
 
     def _reset_and_close(self):
         self._sequence = 0
-        self._file_array = defaultdict(bytes)
+        self._reset_session()
+        self._fountain_encoder = None
+        self._adaptive = None
+        self._file_chunks = None
+        self._content = None
+        self._close_files()
+        self._discard_received_file()
         self._update_status(Status.waiting)
         self._file_path = None
+        self._sent_paths = []
         self._last_build = None
         self.close_windows()
 
-    def _send_data(self, header: RequestHeader, payload: Optional[bytes] = None):
+    def _reset_session(self):
+        self._session = SessionOptions()
+        self._acknowledged = set()
+        self._shown_sequences = []
+        self._timed_out = set()
+        self._repeats = []
+        self._pending_acks = []
+        self._last_ack = None
+        self._fec = None
+        self._fec_reception = None
+        self._batch = None
+        self._duplex_initiator = False
+        self._peer_done = False
+        self._duplex_frame = None
+        self._sent_at = {}
+        self._shown_levels = {}
+        self._retransmitted = set()
+        self._rto_deadline = None
+        self._rto_expiries = 0
+        self._last_answer = None
+
+    def _header(self, request_type: RequestType, sequence: int) -> RequestHeader:
+        # Frames follow the agreed protocol version, start_connection is sent before anything was agreed
+        return RequestHeader(request_type, sequence, version=self._session.version)
+
+    def _send_data(self, header: RequestHeader, payload: Optional[bytes] = None, keep_alive: bool = True):
+        if header.request_type == RequestType.repeat_data:
+            self._count("repeats_requested")
+
         header.add_payload(payload)
-        self._build_image(header, payload)
+        self._build_image(header, payload, keep_alive)
+
+    def _checksum_failed(self, header: RequestHeader, payload: bytes) -> bool:
+        with timed(self._metrics, "checksum"):
+            failed = header.checksum != calculate_hash(
+                header.version, header.request_type, header.sequence_number, payload
+            )
+
+        if failed:
+            self._count("checksum_failures")
+
+        return failed
+
+    def _count(self, counter: str, amount: int = 1):
+        if self._metrics is not None:
+            self._metrics.count(counter, amount)
+
+    def _update_progress(self):
+        if self._metrics is None:
+            return
+
+        if self._status in (Status.sent_data, Status.finished, Status.duplex) and self._file_chunks is not None:
+            # The chunks before the sequence were acknowledged
+            self._metrics.update_transfer(self._file_chunks.offset(min(self._sequence, len(self._file_chunks))))
+        elif self._status == Status.receiving_data and self._received_file is not None:
+            self._metrics.update_transfer(self._received_file.received_length)
+
+    def _update_rtt_metrics(self):
+        if self._metrics is None:
+            return
+
+        for gauge, value in self._rtt.snapshot().items():
+            self._metrics.set_gauge(gauge, value)
+
+    def _export_metrics(self, force: bool = False):
+        if self._metrics is None or (
+            not force and time.monotonic() - self._last_metrics_export < self._metrics_interval
+        ):
+            return
+
+        self._last_metrics_export = time.monotonic()
+        self._metrics.export(self._metrics_folder)
+
+        if self._metrics.transfer is not None:
+            self._print(str(self._metrics.transfer))
 
     def _print(self, string: str):
         # Reset after 100 lines
@@ -118,96 +538,718 @@ class QRCodeCommunication:
 
     def _handle_receiving_data_status(self, header: RequestHeader, payload: bytes):
         if header.request_type == RequestType.send_data:
-            if header.checksum != calculate_hash(header.version, header.request_type, header.sequence_number, payload):
+            if self._checksum_failed(header, payload):
                 self._print("Checksum failed")
-                self._send_data(RequestHeader(RequestType.repeat_data, header.sequence_number))
-            elif header.sequence_number not in self._file_array:
+                if self._fec_reception is None:
+                    self._send_data(self._header(RequestType.repeat_data, header.sequence_number))
+            elif self._session.window > 1:
+                self._receive_window_data(header, payload)
+            elif self._received_file.add(header.sequence_number, payload):
                 self._print(f"Received data for sequence {header.sequence_number}")
-                self._file_array[header.sequence_number] = payload
-                self._send_data(RequestHeader(RequestType.confirm_data, header.sequence_number))
+                self._save_completed_batch_files()
+                self._send_data(self._header(RequestType.confirm_data, header.sequence_number))
+
+        elif header.request_type == RequestType.parity_data and self._fec_reception is not None:
+            self._receive_parity(header, payload)
 
         elif header.request_type == RequestType.finish:
-            file_content = [c for i, c in sorted(list(self._file_array.items()), key=lambda s: s[0])]
-            if len(file_content) > 0:
-                max_sequence = max(self._file_array.keys())
-                missing = set(range(max_sequence + 1)) - set(self._file_array.keys())
+            if self._received_file.received_count > 0:
+                # All the gaps at once, the sender repeats exactly these chunks
+                missing_runs = self._received_file.missing_runs()
 
-                if len(missing) > 0:
-                    self._send_data(RequestHeader(RequestType.repeat_data, min(missing)))
+                if missing_runs:
+                    self._send_data(
+                        self._header(RequestType.repeat_data, missing_runs[0][0]), build_nack_payload(missing_runs)
+                    )
 
                     return
 
-                file_name = f"File-{time.mktime(datetime.now().timetuple())}{self._file_suffix}"
+                self._save_received_file()
+
+            self._confirm_finish(header)
+
+    def _save_received_file(self):
+        if self._batch is not None:
+            self._save_completed_batch_files()
+            self._print(f"Batch transfer done! {len(self._batch.saved)} files were successfully saved.")
+        else:
+            file_name = self._received_file_name(self._file_suffix)
+            self._received_file.save(os.path.join(self._received_files_folder, file_name))
+            self._received_file = None
+            self._print(f"File transfer done! file {file_name} was successfully saved.")
+
+    def _confirm_finish(self, header: RequestHeader):
+        self._send_data(self._header(RequestType.confirm_finish, header.sequence_number))
+        self._confirmed_finish = True
+
+        self._discard_received_file()
+        self._reset_session()
+        self._update_status(Status.waiting)
+
+    def _create_received_files_folder(self):
+        if os.path.exists(self._received_files_folder) is False:
+            os.mkdir(self._received_files_folder)
+
+    @staticmethod
+    def _received_file_name(suffix: Optional[str]) -> str:
+        return f"File-{time.mktime(datetime.now().timetuple())}{suffix or ''}"
+
+    def _save_file(self, content: bytes, suffix: Optional[str]):
+        file_name = self._received_file_name(suffix)
+
+        self._create_received_files_folder()
+
+        open(os.path.join(self._received_files_folder, file_name), "wb").write(content)
+
+        self._print(f"File transfer done! file {file_name} was successfully saved.")
+
+    def _save_completed_batch_files(self):
+        if self._batch is None:
+            return
 
-                if os.path.exists(self._received_files_folder) is False:
-                    os.mkdir(self._received_files_folder)
+        for file_name in self._batch.save_completed(self._received_file, self._received_files_folder):
+            self._print(f"Batch file {file_name} was successfully saved.")
 
-                open(os.path.join(self._received_files_folder, file_name), "wb").write(b"".join(file_content))
+    def _discard_received_file(self):
+        if self._received_file is not None:
+            self._received_file.discard()
+            self._received_file = None
 
-                self._print(f"File transfer done! file {file_name} was successfully saved.")
+    def _receive_window_data(self, header: RequestHeader, payload: bytes):
+        if self._received_file.add(header.sequence_number, payload):
+            self._print(f"Received data for sequence {header.sequence_number}")
+            self._save_completed_batch_files()
 
-            self._send_data(RequestHeader(RequestType.confirm_finish, header.sequence_number))
+        # Acknowledged once for all the chunks of the captured frame
+        self._pending_acks.append(header.sequence_number)
 
-            self._file_array = defaultdict(bytes)
-            self._update_status(Status.waiting)
+        if self._fec_reception is not None:
+            self._recover_block(self._fec_reception.block(header.sequence_number))
 
-    def _handle_finished_status(self, header: RequestHeader):
+    def _receive_parity(self, header: RequestHeader, payload: bytes):
+        if self._checksum_failed(header, payload):
+            self._print("Checksum failed")
+
+            return
+
+        try:
+            block = self._fec_reception.add_parity(header.sequence_number, payload)
+        except ValueError as e:
+            self._print(f"Received bad data: {e}")
+            self._count("bad_data")
+
+            return
+
+        if block is not None:
+            self._recover_block(block)
+
+    def _recover_block(self, block: int):
+        # Once the data and parity chunks of the block add up to its size
+        recovered = self._fec_reception.recover(block, self._received_file)
+        if not recovered:
+            return
+
+        self._print(f"Recovered data for sequences {recovered}")
+        self._count("fec_recovered", len(recovered))
+        self._save_completed_batch_files()
+        self._pending_acks += recovered
+
+    def _flush_acks(self):
+        sequences, self._pending_acks = self._pending_acks, []
+
+        # Duplicates are acknowledged again only if the displayed acknowledgement does not cover them yet
+        ack = (self._received_file.next_missing, sequences)
+        if ack == self._last_ack:
+            return
+
+        self._last_ack = ack
+        self._send_data(self._header(RequestType.confirm_data, sequences[-1]), build_ack_payload(*ack))
+
+    def _handle_finished_status(self, header: RequestHeader, payload: bytes):
         if header.request_type == RequestType.repeat_data:
-            if header.sequence_number < len(self._file_array):
-                self._send_data(
-                    RequestHeader(RequestType.send_data, header.sequence_number),
-                    self._file_array[header.sequence_number],
-                )
+            self._repeats = self._missing_sequences(header, payload)
+            if self._repeats:
+                self._adapt(success=False)
+                self._show_chunks(self._repeats[: self._frame_chunks])
         elif header.request_type == RequestType.confirm_finish:
-            os.remove(self._file_path)
+            self._print(f"Transfer confirmed. {self._rtt}")
+            self._close_files()
+            self._remove_sent_files()
             self._reset_and_close()
         elif header.request_type == RequestType.confirm_data:
-            self._send_data(RequestHeader(RequestType.finish, 0))
+            if not self._repeats:
+                self._send_data(self._header(RequestType.finish, 0))
+
+                return
+
+            next_missing, sequences = 0, [header.sequence_number]
+            if self._session.window > 1:
+                try:
+                    next_missing, acknowledged = parse_ack_payload(payload)
+                    sequences += acknowledged
+                except ValueError:
+                    pass
+
+            repeats = [s for s in self._repeats if s >= next_missing and s not in sequences]
+            if repeats == self._repeats:
+                return
+
+            self._repeats = repeats
+            if self._repeats:
+                self._show_chunks(self._repeats[: self._frame_chunks])
+            else:
+                self._send_data(self._header(RequestType.finish, 0))
 
-    def _handle_sent_data_status(self, header: RequestHeader):
-        if header.request_type == RequestType.confirm_data and header.sequence_number == self._sequence:
+    def _missing_sequences(self, header: RequestHeader, payload: bytes) -> list[int]:
+        # Older receivers only ask for the first missing chunk
+        missing_runs = [(header.sequence_number, 1)]
+        if payload:
+            try:
+                missing_runs = parse_nack_payload(header.sequence_number, payload)
+            except ValueError as e:
+                self._print(f"Received bad data: {e}")
+                self._count("bad_data")
+
+        return [
+            sequence
+            for start, length in missing_runs
+            for sequence in range(max(0, start), min(start + length, len(self._file_chunks)))
+        ]
+
+    def _handle_sent_data_status(self, header: RequestHeader, payload: bytes):
+        if self._session.window > 1:
+            self._handle_window_status(header, payload)
+        elif header.request_type == RequestType.confirm_data and header.sequence_number == self._sequence:
             self._sequence += 1
+            self._adapt(success=True, chunk_size=self._acknowledged_chunk_size([header.sequence_number]))
 
-            if self._sequence == len(self._file_array):
-                self._send_data(RequestHeader(RequestType.finish, 0))
+            if self._sequence == len(self._file_chunks):
+                self._send_data(self._header(RequestType.finish, 0))
                 self._update_status(Status.finished)
             else:
-                self._send_data(RequestHeader(RequestType.send_data, self._sequence), self._file_array[self._sequence])
-        elif header.request_type == RequestType.repeat_data and 0 <= header.sequence_number < len(self._file_array):
+                self._send_chunk(self._sequence)
+        elif header.request_type == RequestType.repeat_data and 0 <= header.sequence_number < len(self._file_chunks):
             self._sequence = header.sequence_number
-            self._send_data(RequestHeader(RequestType.send_data, self._sequence), self._file_array[self._sequence])
+            self._adapt(success=False)
+            self._send_chunk(self._sequence)
+
+    def _handle_window_status(self, header: RequestHeader, payload: bytes):
+        if header.request_type == RequestType.confirm_data:
+            try:
+                next_missing, sequences = parse_ack_payload(payload)
+            except ValueError:
+                next_missing, sequences = self._sequence, []
+
+            # The acknowledgement stays displayed, only the chunks it acknowledges for the first time are progress
+            acknowledged = {header.sequence_number, *sequences, *range(self._sequence, next_missing)}
+            new = [
+                s for s in acknowledged if self._sequence <= s < len(self._file_chunks) and s not in self._acknowledged
+            ]
+
+            self._acknowledged.add(header.sequence_number)
+            self._acknowledged.update(sequences)
+            self._sequence = max(self._sequence, next_missing)
+            while self._sequence in self._acknowledged:
+                self._sequence += 1
+            self._acknowledged = {s for s in self._acknowledged if s > self._sequence}
+
+            if new:
+                # The rotated frames don't keep the session alive, most chunks are acknowledged while not displayed
+                self._last_build = self._now()
+                self._adapt(success=True, chunk_size=self._acknowledged_chunk_size(new))
+
+            if self._sequence >= len(self._file_chunks):
+                self._send_data(self._header(RequestType.finish, 0))
+                self._update_status(Status.finished)
+            else:
+                symbols = self._window_symbols()
+                if any(s not in symbols for s in self._shown_sequences):
+                    self._show_chunks(self._next_in_window(self._frame_chunks))
+        elif header.request_type == RequestType.repeat_data and self._sequence <= header.sequence_number < len(
+            self._file_chunks
+        ):
+            self._adapt(success=False)
+            others = [s for s in self._next_in_window(self._frame_chunks) if s != header.sequence_number]
+            self._show_chunks([header.sequence_number] + others[: self._frame_chunks - 1])
+
+    @property
+    def _frame_chunks(self) -> int:
+        # Shown at once, in tiles and colour planes
+        if self._timed_out and any(s in self._timed_out for s in self._window_symbols() + self._repeats):
+            return 1
+
+        return self._session.tiles * self._session.colors
+
+    def _window_symbols(self) -> list[int]:
+        window_end = min(self._sequence + self._session.window, len(self._file_chunks))
+        pending = [s for s in range(self._sequence, window_end) if s not in self._acknowledged]
+        if self._fec is None:
+            return pending
+
+        return self._fec.window_symbols(pending, window_end)
+
+    def _next_in_window(self, count: int) -> list[int]:
+        symbols = self._window_symbols()
+        order = self._fec.order if self._fec is not None else int
+
+        # Round robin over the unacknowledged chunks, continuing after the ones that are displayed
+        last_shown = order(self._shown_sequences[-1]) if self._shown_sequences else -1
+        start = next((i for i, s in enumerate(symbols) if order(s) > last_shown), 0)
+
+        return (symbols[start:] + symbols[:start])[:count]
+
+    def _rotate_window(self):
+        if self._last_frame is None or self._now() - self._last_frame < WINDOW_FRAME_INTERVAL:
+            return
+
+        self._show_chunks(self._next_in_window(self._frame_chunks), keep_alive=False)
+
+    def _show_chunks(self, sequences: list[int], keep_alive: bool = True):
+        self._shown_sequences = sequences
+        if len(sequences) == 1 and sequences[0] >= 0:
+            self._send_chunk(sequences[0], keep_alive)
+
+            return
+
+        self._track_sent(sequences)
+        frames = [self._window_frame(sequence) for sequence in sequences]
+        self._next_unsent = max([self._next_unsent] + [sequence + 1 for sequence in sequences])
+
+        if len(frames) == 1:
+            self._build_image(*frames[0], keep_alive)
+        else:
+            self._build_tiled_image(frames, keep_alive)
+        self._render_ahead()
+
+    def _window_frame(self, sequence: int) -> tuple[RequestHeader, bytes]:
+        # Parity chunks are -1 - parity id
+        if sequence < 0:
+            header = self._header(RequestType.parity_data, -1 - sequence)
+            payload = self._fec.payload(-1 - sequence)
+        else:
+            header = self._header(RequestType.send_data, sequence)
+            payload = self._file_chunks[sequence]
+        header.add_payload(payload)
+
+        return header, payload
+
+    def _send_chunk(self, sequence: int, keep_alive: bool = True):
+        self._shown_sequences = [sequence]
+        self._track_sent([sequence])
+        self._next_unsent = max(self._next_unsent, sequence + 1)
+        self._send_data(self._header(RequestType.send_data, sequence), self._file_chunks[sequence], keep_alive)
+        self._render_ahead()
+
+    def _track_sent(self, sequences: list[int]):
+        # From the first show, a chunk shown again (rotated in or repeated) is ambiguous to sample
+        now = time.monotonic()
+        for sequence in sequences:
+            if sequence in self._sent_at:
+                self._retransmitted.add(sequence)
+            else:
+                self._sent_at[sequence] = now
+            if self._adaptive is not None:
+                self._shown_levels.setdefault(sequence, self._adaptive.error_correction_level)
+
+    def _on_answer(self, header: RequestHeader):
+        # A new answer of the receiver restarts the retransmission timer, an acknowledged chunk shown once is sampled.
+        # The receiver keeps displaying its last answer, seeing it again tells nothing
+        answer = (header.request_type, header.sequence_number, header.checksum)
+        if answer == self._last_answer:
+            return
+        self._last_answer = answer
+
+        if header.request_type == RequestType.confirm_data:
+            sent_at = self._sent_at.get(header.sequence_number)
+            if sent_at is not None and header.sequence_number not in self._retransmitted:
+                self._rtt.sample(time.monotonic() - sent_at)
+                self._update_rtt_metrics()
+            self._retransmitted.add(header.sequence_number)
+
+        self._rto_expiries = 0
+        self._rto_deadline = time.monotonic() + self._rtt.rto
+
+    def _retransmission_timeout(self):
+        self._rto_expiries += 1
+        self._count("retransmission_timeouts")
+        self._rtt.back_off()
+        self._update_rtt_metrics()
+        self._rto_deadline = time.monotonic() + self._rtt.rto
+        self._print(f"No answer within the retransmission timeout ({self._rto_expiries}). {self._rtt}")
+
+        if self._rto_expiries > self._max_retransmissions or self._current_image is None:
+            return
+
+        # Whatever is in flight now was shown more than once
+        self._retransmitted.update(self._sent_at)
+        self._adapt(success=False)
+        if self._ease_shown_chunks():
+            self._show_chunks(self._shown_sequences[: self._frame_chunks], keep_alive=False)
+        else:
+            self._nudge_image()
+
+    def _acknowledged_chunk_size(self, sequences: list[int]) -> int:
+        # Only the chunks read as they were first shown tell what the data frames carry
+        return max((len(self._file_chunks[s]) for s in sequences if s not in self._timed_out), default=0)
+
+    def _ease_shown_chunks(self) -> bool:
+        # The displayed chunks can't be split, the receiver places them by sequence. They are shown alone and at the
+        # next level with more capacity instead, as codes of fewer and bigger modules
+        if self._adaptive is None or not (self._status == Status.sent_data or self._repeats):
+            return False
+
+        self._timed_out.update(self._shown_sequences)
+        lowered = len(self._shown_sequences) > 1
+        for sequence in self._shown_sequences:
+            level_index = ERROR_CORRECTION_LEVELS.index(self._frame_level([sequence]))
+            if level_index < len(ERROR_CORRECTION_LEVELS) - 1:
+                self._shown_levels[sequence] = ERROR_CORRECTION_LEVELS[level_index + 1]
+                lowered = True
+
+        return lowered
+
+    def _nudge_image(self):
+        # The same frame, moved a few pixels back and forth, doesn't look like the frame the webcam already saw
+        self._current_image = numpy.roll(self._current_image, NUDGE_PIXELS * self._nudge_direction, axis=1)
+        self._nudge_direction = -self._nudge_direction
+        self._mark_built(keep_alive=False)
+
+    def _render_ahead(self):
+        last_sequence = min(self._next_unsent + self._render_ahead_frames, len(self._file_chunks))
+
+        frames = []
+        for sequence in range(self._next_unsent, last_sequence):
+            header = self._header(RequestType.send_data, sequence)
+            header.add_payload(self._file_chunks[sequence])
+            frames.append(header.build() + self._file_chunks[sequence])
+
+        if not frames:
+            return
 
-    def _handle_waiting_to_send_file_status(self, header: RequestHeader):
+        if self._frame_chunks > 1:
+            self._qr_code_creator.prerender(
+                frames, tiled=self._session.tiles > 1, colors=self._session.colors, **self._tile_options()
+            )
+        else:
+            self._qr_code_creator.prerender(frames, **self._data_frame_options())
+
+    def _adapt(self, success: bool, chunk_size: Optional[int] = None):
+        if self._adaptive is None:
+            return
+
+        if success:
+            self._adaptive.on_success(chunk_size)
+        else:
+            self._adaptive.on_failure()
+
+        # Chunks that were already shown keep their bounds and level, they might still be repeated
+        if self._adaptive.chunk_size != self._file_chunks.chunk_size:
+            self._file_chunks.resize_from(self._next_unsent, self._adaptive.chunk_size)
+            self._print(f"Adapted the data frames. {self._adaptive}")
+
+    def _handle_waiting_to_send_file_status(self, header: RequestHeader, payload: bytes):
         if header.request_type == RequestType.confirm_connection:
-            self._send_data(RequestHeader(RequestType.send_data, self._sequence), self._file_array[self._sequence])
-            self._update_status(Status.sent_data)
+            options = decode_options(payload)
+            self._session = self._offered.agreed(SessionOptions.parse(options))
+
+            if self._session.batch != self._offered.batch:
+                # The receiver would save the whole batch as a single file. The session is finished without data and
+                # the files are sent one by one instead
+                self._print("The receiver doesn't support batches, sending the files one by one")
+                self._batch_enabled = False
+                self._sent_paths = []
+                self._send_data(self._header(RequestType.finish, 0))
+                self._update_status(Status.finished)
 
-    def _handle_waiting_status(self, header: RequestHeader, payload: bytes) -> None:
-        file_content_to_send, file_path = self._get_file_to_send()
+                return
 
-        if header is not None and header.request_type == RequestType.start_connection:
-            self._file_suffix = payload.decode()
-            if len(payload) > 10:
-                self._file_suffix = None
+            if self._session.compression != self._offered.compression:
+                self._file_chunks = self._split_content_to_byte_array(self._content)
 
-            self._update_status(Status.receiving_data)
-            self._print(f"Received a file to save! file suffix: {self._file_suffix}")
+            if self._session.duplex:
+                suffix = options.get("suffix")
+                self._file_suffix = suffix if suffix is not None and len(suffix) <= MAX_SUFFIX_LENGTH else None
+                self._create_received_files_folder()
+                self._received_file = ReceivedFile(self._received_files_folder, NUM_BYTES_PER_MESSAGE)
+                self._print(f"The receiver sends a file back! file suffix: {self._file_suffix}")
 
-            self._send_data(RequestHeader(RequestType.confirm_connection, 0))
-        elif file_content_to_send is not None:
-            self._sequence = 0
-            self._file_array = self._split_content_to_byte_array(file_content_to_send)
+                self._start_duplex(initiator=True)
+                self._show_duplex_frame()
+
+                return
+
+            if self._session.fec_data:
+                self._fec = FecChunks(self._file_chunks, self._session.fec_data, self._session.fec_parity)
+            if self._adaptive_enabled:
+                adaptive_options = {"encoding": self._session.encoding}
+                if self._session.tiles > 1:
+                    # The tiled frames start from the level they have without adaptation, every tile holds a chunk
+                    adaptive_options["error_correction_level"] = TILE_ERROR_CORRECTION_LEVEL
+                    adaptive_options["max_version"] = self._qr_code_creator.max_tile_version(self._session.tiles)
+                self._adaptive = AdaptiveController(HEADER_LENGTH, self._file_chunks.chunk_size, **adaptive_options)
+            self._shown_sequences = []
+
+            self._show_chunks(self._next_in_window(self._frame_chunks))
+            self._update_status(Status.sent_data)
+        elif header.request_type == RequestType.start_connection and self._offered.duplex:
+            # Both peers offered at once, the offer with the lower token gives way and answers the other one
+            _, options = parse_connection_payload(payload)
+            if SessionOptions.parse(options).duplex > self._offered.duplex:
+                file_path = self._file_path
+                self._close_files()
+                self._content = None
+                self._accept_connection(payload, file_path)
+
+    def _handle_waiting_status(self, header: RequestHeader, payload: bytes) -> None:
+        file_path = self._get_file_to_send()
+
+        if header is not None and header.request_type == RequestType.fountain_data:
+            self._receive_fountain_symbol(header, payload)
+        elif header is not None and header.request_type == RequestType.finish and self._confirmed_finish:
+            # The sender missed the confirmation, which is cleared as soon as a frame without a request comes
+            self._send_data(RequestHeader(RequestType.confirm_finish, header.sequence_number, version=header.version))
+        elif header is not None and header.request_type == RequestType.start_connection:
+            self._accept_connection(payload, file_path)
+        elif file_path is not None and self._broadcast:
+            self._start_broadcast(self._open_file(file_path), file_path)
+        elif file_path is not None and self._batch_enabled:
+            self._start_batch(self._outbox.files()[:MAX_BATCH_FILES])
+        elif file_path is not None:
             self._file_path = file_path
+            self._sent_paths = [file_path]
             _, self._file_suffix = os.path.splitext(file_path)
 
             self._print(f"We found a file to send! file: {file_path}")
 
-            self._send_data(RequestHeader(RequestType.start_connection, 0), self._file_suffix.encode())
-            self._update_status(Status.waiting_to_send_file)
+            self._start_transfer(self._open_file(file_path), self._file_suffix, self._offered_options())
         else:
             self._current_image = None
             self.close_windows()
 
+    def _accept_connection(self, payload: bytes, file_path: Optional[str]):
+        # A file waiting to be sent is sent back in the same session when the sender offered duplex
+        self._confirmed_finish = False
+        self._file_suffix, options = parse_connection_payload(payload)
+
+        offer = SessionOptions.parse(options)
+        self._session = offer.accepted()
+        duplex = self._duplex_enabled and offer.duplex and file_path is not None and not self._session.batch
+        if duplex:
+            # Stop-and-wait both ways, every frame carries a chunk and the acknowledgement of the other file
+            self._session = replace(self._session, window=1, tiles=1, duplex=1, fec_data=0, fec_parity=0, colors=1)
+        accepted_options = self._session.encode()
+
+        self._create_received_files_folder()
+        self._received_file = ReceivedFile(
+            self._received_files_folder, self._session.chunk_size, self._session.compression
+        )
+        if self._session.batch:
+            self._batch = BatchReception(self._session.batch)
+        if self._session.fec_data:
+            self._fec_reception = FecReception(
+                self._session.fec_data, self._session.fec_parity, self._session.chunk_size
+            )
+
+        if duplex:
+            self._file_path = file_path
+            self._sent_paths = [file_path]
+            self._sequence = 0
+            self._file_chunks = self._split_content_to_byte_array(self._open_file(file_path))
+
+            _, suffix = os.path.splitext(file_path)
+            if len(suffix) <= MAX_SUFFIX_LENGTH and "&" not in suffix and "=" not in suffix:
+                accepted_options["suffix"] = suffix
+
+            self._start_duplex(initiator=False)
+            self._print(f"Received a file to save, sending {file_path} back! file suffix: {self._file_suffix}")
+        else:
+            self._update_status(Status.receiving_data)
+            if self._batch is not None:
+                self._print("Received a batch of files to save!")
+            else:
+                self._print(f"Received a file to save! file suffix: {self._file_suffix}")
+
+        self._send_data(
+            self._header(RequestType.confirm_connection, 0),
+            encode_options(accepted_options) if accepted_options else None,
+        )
+
+    def _start_duplex(self, initiator: bool):
+        self._duplex_initiator = initiator
+        self._peer_done = False
+        self._duplex_frame = None
+        self._update_status(Status.duplex)
+
+    def _handle_duplex_status(self, header: RequestHeader, payload: bytes):
+        if header.request_type == RequestType.finish and not self._duplex_initiator:
+            # Sent once both files were acknowledged
+            if self._received_file.received_count > 0:
+                self._save_received_file()
+
+            self._close_files()
+            self._remove_sent_files()
+            self._file_chunks = None
+            self._file_path = None
+            self._sent_paths = []
+            self._sequence = 0
+            self._confirm_finish(header)
+
+            return
+
+        if header.request_type != RequestType.duplex_data:
+            return
+
+        if self._checksum_failed(header, payload):
+            self._print("Checksum failed")
+            return
+
+        try:
+            next_missing, chunk = parse_duplex_payload(payload)
+        except ValueError as e:
+            self._print(f"Received bad data: {e}")
+            self._count("bad_data")
+            return
+
+        if self._sequence < next_missing <= len(self._file_chunks):
+            self._sequence = next_missing
+
+        if not chunk:
+            # The peer sends an empty chunk once all of its chunks were acknowledged
+            self._peer_done = True
+        elif header.sequence_number >= 0 and self._received_file.add(header.sequence_number, chunk):
+            self._print(f"Received data for sequence {header.sequence_number}")
+
+        if self._duplex_initiator and self._peer_done and self._sequence == len(self._file_chunks):
+            if self._received_file.received_count > 0:
+                self._save_received_file()
+
+            self._send_data(self._header(RequestType.finish, 0))
+            self._update_status(Status.finished)
+
+            return
+
+        self._show_duplex_frame()
+
+    def _show_duplex_frame(self):
+        # Built again only when the chunk or the acknowledgement changed
+        frame = (self._sequence, self._received_file.next_missing)
+        if frame == self._duplex_frame:
+            return
+
+        self._duplex_frame = frame
+        chunk = self._file_chunks[self._sequence] if self._sequence < len(self._file_chunks) else b""
+        self._send_data(self._header(RequestType.duplex_data, self._sequence), build_duplex_payload(frame[1], chunk))
+
+    def _start_batch(self, file_paths: list[str]):
+        contents = [self._open_file(file_path) for file_path in file_paths]
+        manifest = build_manifest(
+            [BatchFile(os.path.basename(file_path), len(content)) for file_path, content in zip(file_paths, contents)]
+        )
+
+        self._file_path = file_paths[0]
+        self._sent_paths = file_paths
+        self._file_suffix = None
+
+        self._print(f"We found {len(file_paths)} files to send in a batch!")
+
+        self._start_transfer(BatchContent([manifest, *contents]), "", self._offered_options(len(manifest)))
+
+    def _start_transfer(self, content: Union[memoryview, BatchContent], suffix: str, options: SessionOptions):
+        self._sequence = 0
+        self._next_unsent = 0
+        self._content = content
+        self._file_chunks = self._split_content_to_byte_array(content)
+
+        if options.compression != Compression.none:
+            if compresses(content, options.compression, self._compression_level):
+                compressed = compress_to_mapped_file(content, options.compression, self._compression_level)
+                self._mapped_files.append(compressed)
+                self._file_chunks = self._split_content_to_byte_array(compressed.content)
+
+                self._print(f"Compressed with {options.compression.value}: {len(content)} -> {len(compressed)} bytes")
+            else:
+                options = replace(options, compression=Compression.none)
+
+        self._offered = options
+
+        self._send_data(
+            self._header(RequestType.start_connection, 0), build_connection_payload(suffix, options.encode())
+        )
+        self._update_status(Status.waiting_to_send_file)
+
+    def _offered_options(self, batch: int = 0) -> SessionOptions:
+        options = replace(self._options, batch=batch)
+        if self._duplex_enabled and not batch:
+            options = replace(options, duplex=random.getrandbits(31) | 1)
+        if self._adaptive_enabled:
+            # The chunk sizes vary, the receiver can't tell the offset of a chunk from its sequence
+            options = replace(options, chunk_size=0)
+
+        return options
+
+    def _start_broadcast(self, content: memoryview, file_path: str):
+        self._file_path = file_path
+        self._sent_paths = [file_path]
+        _, suffix = os.path.splitext(file_path)
+
+        info = BroadcastInfo(random.getrandbits(32), len(content), NUM_BYTES_PER_MESSAGE, suffix)
+        self._fountain_encoder = FountainEncoder(self._split_content_to_byte_array(content), info)
+        self._symbol_id = 0
+
+        self._print(f"We found a file to broadcast! file: {file_path}, chunks: {self._fountain_encoder.num_chunks}")
+
+        self._send_fountain_symbol()
+        self._update_status(Status.broadcasting)
+
+    def _broadcast_next_symbol(self):
+        if self._now() - self._last_build < BROADCAST_FRAME_INTERVAL:
+            return
+
+        self._symbol_id += 1
+        if self._symbol_id >= math.ceil(self._fountain_encoder.num_chunks * self._broadcast_overhead):
+            self._print(f"Broadcast done! file: {self._file_path}")
+            self._close_files()
+            self._remove_sent_files()
+            self._reset_and_close()
+
+            return
+
+        self._send_fountain_symbol()
+
+    def _send_fountain_symbol(self):
+        self._send_data(
+            self._header(RequestType.fountain_data, self._symbol_id), self._fountain_encoder.payload(self._symbol_id)
+        )
+
+    def _receive_fountain_symbol(self, header: RequestHeader, payload: bytes):
+        if self._checksum_failed(header, payload):
+            self._print("Checksum failed")
+            return
+
+        try:
+            info, symbol = parse_symbol_payload(payload)
+        except ValueError as e:
+            self._print(f"Received bad data: {e}")
+            self._count("bad_data")
+            return
+
+        if info.session_id in self._completed_broadcasts:
+            return
+
+        decoder = self._fountain_decoders.get(info.session_id)
+        if decoder is None or decoder.info != info:
+            # Keep only the most recent broadcasts, a stale one will never complete
+            if len(self._fountain_decoders) >= MAX_BROADCAST_DECODERS:
+                self._fountain_decoders.pop(next(iter(self._fountain_decoders)))
+            decoder = self._fountain_decoders[info.session_id] = FountainDecoder(info)
+
+        if decoder.add_symbol(header.sequence_number, symbol):
+            self._print(f"Broadcast decoded from {decoder.received_symbols} symbols of {info.num_chunks} chunks")
+            self._save_file(decoder.content(), info.suffix)
+
+            del self._fountain_decoders[info.session_id]
+            self._completed_broadcasts.add(info.session_id)
+
     def _parse_data(self, data: bytes) -> tuple[bool, Optional[RequestHeader], Optional[bytes]]:
         header = None
         payload = None
@@ -219,16 +1261,17 @@ class QRCodeCommunication:
                 if len(payload) != header.payload_length:
                     raise ValueError("Bad payload length")
 
-                if header.version != VERSION:
+                if header.version not in SUPPORTED_VERSIONS:
                     raise ValueError("Bad header length")
             except ValueError as e:
                 self._print(f"Received bad data: {e}")
+                self._count("bad_data")
 
                 return False, None, None
 
         return True, header, payload
 
-    def _build_image(self, header: RequestHeader, payload: Optional[bytes] = None):
+    def _build_image(self, header: RequestHeader, payload: Optional[bytes] = None, keep_alive: bool = True):
         self._print(
             f"Building image for (request={header.request_type.name}, "
             f"sequence={header.sequence_number}, payload_length={header.payload_length}), "
@@ -240,37 +1283,115 @@ class QRCodeCommunication:
 
         image_payload = header.build() + payload_data
 
-        self._current_image = self._qr_code_creator.create(image_payload)
-        self._last_build = self._now()
+        with timed(self._metrics, "render"):
+            if header.request_type in (RequestType.send_data, RequestType.duplex_data, RequestType.parity_data):
+                self._current_image = self._qr_code_creator.create(
+                    image_payload, **self._data_frame_options([self._frame_sequence(header)])
+                )
+            else:
+                self._current_image = self._qr_code_creator.create(image_payload)
+        self._mark_built(keep_alive)
+
+    def _build_tiled_image(self, frames: list[tuple[RequestHeader, bytes]], keep_alive: bool = True):
+        self._print(
+            f"Building tiled image for (request={frames[0][0].request_type.name}, "
+            f"sequences={[header.sequence_number for header, _ in frames]})"
+        )
+
+        with timed(self._metrics, "render"):
+            self._current_image = self._qr_code_creator.create_tiled(
+                [header.build() + payload for header, payload in frames],
+                colors=self._session.colors,
+                **self._tile_options([self._frame_sequence(header) for header, _ in frames]),
+            )
+        self._mark_built(keep_alive)
+
+    @staticmethod
+    def _frame_sequence(header: RequestHeader) -> int:
+        # Parity chunks are -1 - parity id
+        if header.request_type == RequestType.parity_data:
+            return -1 - header.sequence_number
+
+        return header.sequence_number
+
+    def _frame_level(self, sequences: list[int]) -> int:
+        # A chunk shown again keeps the level it was first shown with, a more robust one might not fit it. The codes
+        # of a frame share the level with the most capacity
+        levels = [self._shown_levels.get(sequence, self._adaptive.error_correction_level) for sequence in sequences]
+
+        return max(levels, key=ERROR_CORRECTION_LEVELS.index, default=self._adaptive.error_correction_level)
+
+    def _tile_options(self, sequences: Optional[list[int]] = None) -> dict:
+        return {
+            "error_correction_level": self._frame_level(sequences or []) if self._adaptive is not None else None,
+            "encoding": self._session.encoding,
+        }
+
+    def _data_frame_options(self, sequences: Optional[list[int]] = None) -> dict:
+        # Only the data frames follow the session, the handshake frames must be readable by any peer
+        options = {}
+        if self._session.encoding != PayloadEncoding.base64:
+            options["encoding"] = self._session.encoding
+        if self._adaptive is not None:
+            options["error_correction_level"] = self._frame_level(sequences or [])
+            options["image_size"] = ADAPTIVE_IMAGE_SIZE
+
+        return options
+
+    def _mark_built(self, keep_alive: bool):
+        self._last_frame = self._now()
+        if keep_alive:
+            self._last_build = self._last_frame
 
     @staticmethod
     def _now():
         return datetime.now()
 
     @staticmethod
-    def _split_content_to_byte_array(content: bytes):
-        byte_array = defaultdict(bytes)
-        for y, i in enumerate(range(0, len(content), NUM_BYTES_PER_MESSAGE)):
-            byte_array[y] = content[i : i + NUM_BYTES_PER_MESSAGE]
-
-        return byte_array
+    def _split_content_to_byte_array(content: memoryview) -> ContentChunks:
+        return ContentChunks(content, NUM_BYTES_PER_MESSAGE)
 
     def _update_status(self, status: Status):
+        if self._metrics is not None and status != self._status:
+            if status in (Status.sent_data, Status.duplex):
+                self._metrics.start_transfer("sent", self._file_chunks.content_length)
+            elif status == Status.receiving_data:
+                self._metrics.start_transfer("received")
+            elif status == Status.waiting:
+                self._metrics.end_transfer()
+
         self._status = status
 
-    def _get_file_to_send(self) -> tuple[Optional[bytes], Optional[str]]:
-        for file in glob.glob(self._files_to_send_folder + "/*"):
-            with open(file, "rb") as fp:
-                return fp.read(), file
+    def _get_file_to_send(self) -> Optional[str]:
+        return self._outbox.next_file()
+
+    def _remove_sent_files(self):
+        for file_path in self._sent_paths:
+            os.remove(file_path)
+            self._outbox.remove(file_path)
 
-        return None, None
+    def _open_file(self, file_path: str) -> memoryview:
+        # The chunks are read from the mapped file when they are sent, the file is never loaded as a whole
+        with open(file_path, "rb") as fp:
+            mapped_file = MappedFile(fp)
+
+        self._mapped_files.append(mapped_file)
+
+        return mapped_file.content
+
+    def _close_files(self):
+        for mapped_file in self._mapped_files:
+            mapped_file.close()
+
+        self._mapped_files = []
 
     def show_image(self):
         if self._current_image is None:
             return
 
-        cv.imshow("QR Code", self._current_image)
-        cv.waitKey(1)
+        with timed(self._metrics, "display"):
+            cv.imshow("QR Code", self._current_image)
+            cv.waitKey(1)
 
     def close_windows(self):
         self._current_image = None
@@ -295,8 +1416,180 @@ if __name__ == "__main__":
     parser.add_argument(
         "--received-files-folder", help="The folder where the received files will be saved", default="received-files"
     )
+    parser.add_argument(
+        "--broadcast",
+        help="Send files one way with a fountain code, without waiting for the receiver to answer",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--broadcast-overhead",
+        help="Number of fountain symbols to broadcast per data chunk before the file is considered sent",
+        type=float,
+        default=2.0,
+    )
+    parser.add_argument(
+        "--window-size",
+        help="Number of data chunks kept in flight when the peer supports selective repeat (1 = stop-and-wait)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--adaptive",
+        help="Adapt the chunk size, QR version and error correction level to repeats and acknowledgements",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--tiles",
+        help="Number of window chunks tiled as separate QR codes into one displayed frame",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--render-ahead",
+        help="Number of data frames rendered in the background while the current one is shown",
+        type=int,
+        default=RENDER_AHEAD_FRAMES,
+    )
+    parser.add_argument(
+        "--decode-workers",
+        help="Capture and decode the webcam frames on separate threads with this many decoders (0 = no pipeline)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--track-region",
+        help="Scan only the region of the frame where the QR codes were last seen, the full frame after misses",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--protocol-version",
+        help="Highest protocol version offered when sending (2 = fast binary checksum)",
+        type=int,
+        choices=SUPPORTED_VERSIONS,
+        default=VERSION,
+    )
+    parser.add_argument(
+        "--outbox-poll-interval",
+        help="Seconds between checks of the send folder for new files",
+        type=float,
+        default=POLL_INTERVAL,
+    )
+    parser.add_argument(
+        "--batch",
+        help="Send all the files waiting in the send folder in one session, after a single handshake",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--compression",
+        help="Compress the files before sending them when the peer supports it, unless they don't compress",
+        choices=[compression.value for compression in Compression],
+        default=Compression.none.value,
+    )
+    parser.add_argument(
+        "--compression-level",
+        help="Level of the compression, 0 (fastest) to 9 (smallest), 1 to 9 with bz2 (its library default when not "
+        "given)",
+        type=int,
+        choices=range(0, 10),
+    )
+    parser.add_argument(
+        "--encoding",
+        help="How data frames are written into the QR codes when the peer supports it",
+        choices=[encoding.value for encoding in PayloadEncoding],
+        default=PayloadEncoding.base64.value,
+    )
+
+    parser.add_argument(
+        "--duplex",
+        help="Send a waiting file back while receiving one, when the peer supports it",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--colors",
+        help="Draw 3 window chunks into the colour planes of every code when the peer supports it (needs a colour "
+        "webcam and screen)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-retransmissions",
+        help="Retransmission timeouts in a row (derived from the measured round trip time) before a sender gives up",
+        type=int,
+        default=MAX_RETRANSMISSIONS,
+    )
+    parser.add_argument(
+        "--decoder",
+        help="QR decoder backend, auto picks the fastest one reading the codes of the first frames",
+        choices=[backend.value for backend in DecoderBackend] + [AUTO_DECODER],
+        default=DecoderBackend.pyzbar.value,
+    )
+    parser.add_argument(
+        "--decoder-fallback",
+        help="Try another decoder backend on the frames the chosen one finds no code in",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--asyncio",
+        help="Run on an asyncio event loop, the capture on a thread and the timeouts as timers instead of polling",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fec",
+        help="Add M parity chunks to every K window chunks, the receiver rebuilds up to M lost chunks per block",
+        type=int,
+        nargs=2,
+        metavar=("K", "M"),
+    )
+    parser.add_argument(
+        "--metrics-folder",
+        help="Measure the stages, errors and transfers, and write them to metrics.json and metrics.prom in this folder",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        help="Seconds between writes of the metrics, along with a report of the current transfer",
+        type=float,
+        default=METRICS_INTERVAL,
+    )
+    parser.add_argument(
+        "--trace-memory",
+        help="Trace the memory allocations with tracemalloc to report the peak memory in the metrics (slower)",
+        action="store_true",
+    )
 
     arguments = parser.parse_args()
 
-    qr_code_communicator = QRCodeCommunication(arguments.received_files_folder)
-    qr_code_communicator.start()
+    try:
+        validate_level(Compression(arguments.compression), arguments.compression_level)
+    except ValueError as e:
+        parser.error(str(e))
+
+    qr_code_communicator = QRCodeCommunication(
+        arguments.received_files_folder,
+        arguments.window_size,
+        arguments.broadcast,
+        arguments.broadcast_overhead,
+        arguments.tiles,
+        arguments.adaptive,
+        PayloadEncoding(arguments.encoding),
+        arguments.render_ahead,
+        arguments.decode_workers,
+        arguments.track_region,
+        arguments.protocol_version,
+        arguments.outbox_poll_interval,
+        arguments.batch,
+        Compression(arguments.compression),
+        arguments.compression_level,
+        metrics_folder=arguments.metrics_folder,
+        metrics_interval=arguments.metrics_interval,
+        trace_memory=arguments.trace_memory,
+        duplex=arguments.duplex,
+        fec=arguments.fec,
+        colors=arguments.colors,
+        max_retransmissions=arguments.max_retransmissions,
+        decoder=arguments.decoder,
+        decoder_fallback=arguments.decoder_fallback,
+    )
+
+    if arguments.asyncio:
+        asyncio.run(qr_code_communicator.run())
+    else:
+        qr_code_communicator.start()
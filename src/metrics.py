@@ -0,0 +1,282 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Optional
+
+"""
+What a peer spends its time on and what goes wrong, to tell a camera bound transfer from a decode or protocol bound one.
+stages: a histogram of the seconds spent per call in capture (webcam read), color (cvtColor), decode (QR decoder), parse
+    (header and payload length), checksum (verification of received frames), render (QR image) and display (imshow).
+counters: frames, frames without codes, checksum failures, bad data, repeats requested and received, timeouts,
+    chunks recovered by the forward error correction, retransmission timeouts of a sender.
+gauges: the round trip time of the data frames, its deviation and the retransmission timeout of a sender.
+transfer: the bytes of the current session content sent (acknowledged) or received, its goodput and ETA.
+memory: the current and peak traced memory, when tracemalloc is enabled (it slows every allocation down).
+The metrics are written as a JSON snapshot and in the Prometheus text format.
+"""
+
+STAGES = ("capture", "color", "decode", "parse", "checksum", "render", "display")
+COUNTERS = (
+    "frames",
+    "empty_frames",
+    "checksum_failures",
+    "bad_data",
+    "repeats_requested",
+    "repeats_received",
+    "timeouts",
+    "fec_recovered",
+    "retransmission_timeouts",
+    "transfers",
+    "transferred_bytes",
+)
+
+# Upper bounds of the histogram buckets, in seconds
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+METRICS_INTERVAL = 5.0  # in seconds
+JSON_FILE_NAME = "metrics.json"
+PROMETHEUS_FILE_NAME = "metrics.prom"
+PROMETHEUS_PREFIX = "qr_communication"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = STAGE_BUCKETS):
+        self.buckets = buckets
+        # Per bucket, the last one counts what is above every bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        # (le, count) pairs, as Prometheus buckets are
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        totals = []
+        total = 0
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            totals.append((bound, total))
+
+        return totals
+
+    def quantile(self, q: float) -> float:
+        # The upper bound of the bucket the quantile falls into, the maximum for the last one
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        for (_, total), bound in zip(self.cumulative(), self.buckets + (self.max,)):
+            if total >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum_s": self.sum,
+            "mean_ms": self.sum * 1000 / self.count if self.count else 0.0,
+            "p50_ms": self.quantile(0.5) * 1000,
+            "p95_ms": self.quantile(0.95) * 1000,
+            "max_ms": self.max * 1000,
+            "buckets": dict(self.cumulative()),
+        }
+
+
+# The session content of the current transfer, total_bytes is unknown to a receiver
+class TransferProgress:
+    def __init__(self, direction: str, total_bytes: Optional[int]):
+        self.direction = direction
+        self.total_bytes = total_bytes
+        self.done_bytes = 0
+        self._started = time.monotonic()
+
+    @property
+    def seconds(self) -> float:
+        return time.monotonic() - self._started
+
+    @property
+    def goodput(self) -> float:
+        return self.done_bytes / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        if self.total_bytes is None or self.goodput == 0:
+            return None
+
+        return max(0, self.total_bytes - self.done_bytes) / self.goodput
+
+    def snapshot(self) -> dict:
+        return {
+            "direction": self.direction,
+            "done_bytes": self.done_bytes,
+            "total_bytes": self.total_bytes,
+            "seconds": self.seconds,
+            "goodput_bytes_per_second": self.goodput,
+            "eta_seconds": self.eta,
+        }
+
+    def __str__(self) -> str:
+        progress = f"{self.done_bytes}"
+        if self.total_bytes:
+            progress += f"/{self.total_bytes} bytes ({self.done_bytes * 100 // self.total_bytes}%)"
+        else:
+            progress += " bytes"
+
+        eta = f", ETA {self.eta:.0f}s" if self.eta is not None else ""
+
+        return f"{self.direction.capitalize()} {progress} in {self.seconds:.0f}s, {self.goodput:.0f} B/s{eta}"
+
+
+class Metrics:
+    def __init__(self, trace_memory: bool = False):
+        # Stages are observed by the decode threads of the pipeline too
+        self._lock = threading.Lock()
+        self.stages: dict[str, Histogram] = {stage: Histogram() for stage in STAGES}
+        self.counters: dict[str, int] = {counter: 0 for counter in COUNTERS}
+        self.gauges: dict[str, Optional[float]] = {}
+        self.transfer: Optional[TransferProgress] = None
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+
+            self.stages[stage].observe(seconds)
+
+    @contextmanager
+    def time(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def set_gauge(self, gauge: str, value: Optional[float]) -> None:
+        with self._lock:
+            self.gauges[gauge] = value
+
+    def start_transfer(self, direction: str, total_bytes: Optional[int] = None) -> None:
+        self.end_transfer()
+        self.transfer = TransferProgress(direction, total_bytes)
+
+    def update_transfer(self, done_bytes: int) -> None:
+        if self.transfer is not None:
+            self.transfer.done_bytes = done_bytes
+
+    def end_transfer(self) -> None:
+        if self.transfer is None:
+            return
+
+        self.count("transfers")
+        self.count("transferred_bytes", self.transfer.done_bytes)
+        self.transfer = None
+
+    @staticmethod
+    def memory() -> Optional[tuple[int, int]]:
+        # (current, peak) traced bytes
+        if not tracemalloc.is_tracing():
+            return None
+
+        return tracemalloc.get_traced_memory()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            snapshot = {
+                "time": time.time(),
+                "stages": {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "transfer": self.transfer.snapshot() if self.transfer is not None else None,
+            }
+
+        memory = self.memory()
+        snapshot["memory"] = {"current_bytes": memory[0], "peak_bytes": memory[1]} if memory is not None else None
+
+        return snapshot
+
+    def prometheus(self) -> str:
+        snapshot = self.snapshot()
+
+        lines = [
+            f"# HELP {PROMETHEUS_PREFIX}_stage_seconds Seconds spent per call in a stage of the frames",
+            f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds histogram",
+        ]
+        for stage, histogram in snapshot["stages"].items():
+            for bound, count in histogram["buckets"].items():
+                lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum_s"]}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+
+        for counter, value in snapshot["counters"].items():
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{counter}_total counter")
+            lines.append(f"{PROMETHEUS_PREFIX}_{counter}_total {value}")
+
+        gauges = dict(snapshot["gauges"])
+        if snapshot["transfer"] is not None:
+            transfer = snapshot["transfer"]
+            gauges["transfer_bytes"] = transfer["done_bytes"]
+            gauges["transfer_total_bytes"] = transfer["total_bytes"]
+            gauges["goodput_bytes_per_second"] = transfer["goodput_bytes_per_second"]
+            gauges["eta_seconds"] = transfer["eta_seconds"]
+        if snapshot["memory"] is not None:
+            gauges["memory_bytes"] = snapshot["memory"]["current_bytes"]
+            gauges["memory_peak_bytes"] = snapshot["memory"]["peak_bytes"]
+
+        for gauge, value in gauges.items():
+            if value is None:
+                continue
+
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{gauge} gauge")
+            lines.append(f"{PROMETHEUS_PREFIX}_{gauge} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, folder: str) -> None:
+        # Written aside and renamed, a reader (or the Prometheus textfile collector) never sees a partial file
+        os.makedirs(folder, exist_ok=True)
+
+        for file_name, text in [
+            (JSON_FILE_NAME, json.dumps(self.snapshot(), indent=2)),
+            (PROMETHEUS_FILE_NAME, self.prometheus()),
+        ]:
+            path = os.path.join(folder, file_name)
+            with open(f"{path}.tmp", "w") as fp:
+                fp.write(text)
+            os.replace(f"{path}.tmp", path)
+
+    def __str__(self) -> str:
+        with self._lock:
+            stages = ", ".join(
+                f"{stage} {histogram.sum * 1000 / histogram.count:.1f} ms"
+                for stage, histogram in self.stages.items()
+                if histogram.count
+            )
+            counters = ", ".join(f"{counter} {value}" for counter, value in self.counters.items() if value)
+
+        return f"Metrics: {stages or 'no stages'} | {counters or 'no counters'}"
+
+
+def timed(metrics: Optional[Metrics], stage: str) -> ContextManager:
+    # Nothing is measured without metrics
+    if metrics is None:
+        return nullcontext()
+
+    return metrics.time(stage)
@@ -0,0 +1,62 @@
+import glob
+import os
+import time
+from typing import Optional
+
+POLL_INTERVAL = 1.0  # in seconds
+# Coarsest directory mtime resolution of the common file systems (FAT), a change within it may keep the same mtime
+MTIME_RESOLUTION = 2.0  # in seconds
+
+
+# The files waiting in the send folder. The folder is listed again only when its mtime changed, and its mtime is
+# checked at most once per poll interval, so the idle loop costs no disk access on most frames.
+# The files themselves are only opened when a transfer starts.
+class Outbox:
+    def __init__(self, folder: str, poll_interval: float = POLL_INTERVAL):
+        self._folder = folder
+        self._poll_interval = poll_interval
+
+        self._files: Optional[list[str]] = None
+        self._mtime: Optional[float] = None
+        self._last_poll: Optional[float] = None
+
+        self.scans = 0
+
+    def next_file(self) -> Optional[str]:
+        files = self.files()
+
+        return files[0] if files else None
+
+    def files(self) -> list[str]:
+        now = time.monotonic()
+        if self._files is None or self._last_poll is None or now - self._last_poll >= self._poll_interval:
+            self._last_poll = now
+            self._poll()
+
+        return list(self._files)
+
+    def remove(self, file_path: str) -> None:
+        # The file was sent and deleted, the next one is known without listing the folder again
+        if self._files is not None and file_path in self._files:
+            self._files.remove(file_path)
+
+    def refresh(self) -> None:
+        self._files = None
+
+    def _poll(self) -> None:
+        try:
+            mtime = os.stat(self._folder).st_mtime
+        except OSError:
+            mtime = None
+
+        if (
+            self._files is not None
+            and mtime is not None
+            and mtime == self._mtime
+            and time.time() - mtime > MTIME_RESOLUTION
+        ):
+            return
+
+        self._mtime = mtime
+        self._files = sorted(glob.glob(os.path.join(self._folder, "*")))
+        self.scans += 1
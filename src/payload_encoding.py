@@ -0,0 +1,103 @@
+import base64
+import hashlib
+from enum import Enum
+
+"""
+How a frame is written into the QR code.
+base64: the historical encoding, the QR text is the base64 of the frame (byte mode).
+base45: RFC 9285 base45 (QR alphanumeric mode, 2 characters in 11 bits) prefixed with BASE45_MARKER.
+binary: the frame bytes as is (byte mode) prefixed with BINARY_MARKER.
+In both, the frame is first XORed with a fixed key stream. It keeps runs of zero bits out of the code, the qrcode
+library fails to compute the error correction of a block of zero bytes.
+
+The markers are not part of the base64 alphabet, so the reader tells the encodings apart without knowing the session.
+BINARY_MARKER is never valid UTF-8 nor Shift JIS, so a reader that converts byte mode data to text (like zbar does)
+always assumes ISO-8859-1, and the conversion can be reverted.
+"""
+
+
+class PayloadEncoding(Enum):
+    base64 = "base64"
+    base45 = "base45"
+    binary = "binary"
+
+
+BASE45_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+BASE45_MARKER = b"%"
+BINARY_MARKER = b"\xff"
+TEXT_BINARY_MARKER = BINARY_MARKER.decode("latin-1").encode()
+
+_BASE45_VALUES = {ord(character): value for value, character in enumerate(BASE45_ALPHABET)}
+
+# Longer than the byte mode capacity of a QR code
+_SCRAMBLE_KEY = b"".join(hashlib.sha256(b"QRCodeCommunication%d" % i).digest() for i in range(128))
+
+
+def b45encode(data: bytes) -> bytes:
+    encoded = []
+    for i in range(0, len(data) - 1, 2):
+        value = data[i] * 256 + data[i + 1]
+        value, c = divmod(value, 45)
+        e, d = divmod(value, 45)
+        encoded += [c, d, e]
+
+    if len(data) % 2:
+        d, c = divmod(data[-1], 45)
+        encoded += [c, d]
+
+    return "".join(BASE45_ALPHABET[value] for value in encoded).encode()
+
+
+def b45decode(text: bytes) -> bytes:
+    try:
+        values = [_BASE45_VALUES[character] for character in text]
+    except KeyError:
+        raise ValueError("Invalid base45 character")
+
+    if len(values) % 3 == 1:
+        raise ValueError("Invalid base45 length")
+
+    decoded = bytearray()
+    for i in range(0, len(values), 3):
+        group = values[i : i + 3]
+        value = sum(v * 45**power for power, v in enumerate(group))
+
+        if len(group) == 3:
+            if value > 0xFFFF:
+                raise ValueError("Invalid base45 group")
+            decoded += value.to_bytes(2, "big")
+        else:
+            if value > 0xFF:
+                raise ValueError("Invalid base45 group")
+            decoded.append(value)
+
+    return bytes(decoded)
+
+
+def scramble(data: bytes) -> bytes:
+    if len(data) > len(_SCRAMBLE_KEY):
+        raise ValueError("Data is too big")
+
+    key = _SCRAMBLE_KEY[: len(data)]
+
+    return (int.from_bytes(data, "big") ^ int.from_bytes(key, "big")).to_bytes(len(data), "big")
+
+
+def encode_payload(data: bytes, encoding: PayloadEncoding = PayloadEncoding.base64) -> bytes:
+    if encoding == PayloadEncoding.base45:
+        return BASE45_MARKER + b45encode(scramble(data))
+    elif encoding == PayloadEncoding.binary:
+        return BINARY_MARKER + scramble(data)
+
+    return base64.b64encode(data)
+
+
+def decode_payload(raw_data: bytes) -> bytes:
+    if raw_data.startswith(BASE45_MARKER):
+        return scramble(b45decode(raw_data[len(BASE45_MARKER) :]))
+    elif raw_data.startswith(BINARY_MARKER):
+        return scramble(raw_data[len(BINARY_MARKER) :])
+    elif raw_data.startswith(TEXT_BINARY_MARKER):
+        return scramble(raw_data.decode().encode("latin-1")[len(BINARY_MARKER) :])
+
+    return base64.b64decode(raw_data)
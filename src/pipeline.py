@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from cv2 import cv2
+
+from metrics import Metrics
+from tracking import RegionTracker
+from webcam import WebcamReader
+
+DECODE_WORKERS = 2
+RESULTS_QUEUE_SIZE = 4
+RESULT_TIMEOUT = 0.05  # in seconds
+
+"""
+Capture, decode and state machine run on their own threads.
+capture: a single thread reading the webcam. Only the newest frame waits for a decoder, a frame that was not taken
+    before the next one arrived is dropped as stale.
+decode: a pool of workers running the QR decoder on the frames (pyzbar and OpenCV release the GIL). Every worker has
+    its own region tracker and colour calibration.
+delivery: the decoded frames wait in a bounded queue for the state machine (and display) thread, in capture order.
+    A frame decoded after a newer one was already delivered is dropped.
+"""
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.dropped = 0
+
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, latency: float) -> None:
+        with self._lock:
+            self.count += 1
+            self._total_latency += latency
+            self._max_latency = max(self._max_latency, latency)
+
+    def drop(self) -> None:
+        with self._lock:
+            self.dropped += 1
+
+    @property
+    def throughput(self) -> float:
+        return self.count / max(time.perf_counter() - self._started, 1e-9)
+
+    @property
+    def mean_latency(self) -> float:
+        return self._total_latency / self.count if self.count else 0.0
+
+    @property
+    def max_latency(self) -> float:
+        return self._max_latency
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.count} frames ({self.throughput:.1f}/s), {self.dropped} dropped, "
+            f"latency {self.mean_latency * 1000:.1f} ms (max {self.max_latency * 1000:.1f} ms)"
+        )
+
+
+class PipelineStats:
+    def __init__(self):
+        # Time spent reading a frame, decoding it, and from its capture until the state machine got it
+        self.capture = StageStats("capture")
+        self.decode = StageStats("decode")
+        self.delivery = StageStats("delivery")
+
+    def __str__(self) -> str:
+        return " | ".join(str(stage) for stage in [self.capture, self.decode, self.delivery])
+
+
+class PipelinedWebcamReader:
+    def __init__(
+        self,
+        decode_workers: int = DECODE_WORKERS,
+        mode: int = cv2.COLOR_BGR2GRAY,
+        font: int = cv2.FONT_HERSHEY_SIMPLEX,
+        width: int = 640,
+        height: int = 480,
+        capture_webcam: Optional = None,
+        tracker: Optional[RegionTracker] = None,
+        metrics: Optional[Metrics] = None,
+        decoder=None,
+    ):
+        self._reader = WebcamReader(font, width, height, capture_webcam, tracker, metrics, decoder)
+        self._mode = mode
+        # Of the frames decoded from now on, set by the last capture
+        self._colors = 1
+
+        self.stats = PipelineStats()
+
+        self._condition = threading.Condition()
+        self._running = False
+        # (index, capture time, frame) of the newest frame no decoder took yet
+        self._frame: Optional[tuple] = None
+        # (index, capture time, messages) of the decoded frames
+        self._results: deque[tuple[int, float, list[bytes]]] = deque(maxlen=RESULTS_QUEUE_SIZE)
+        self._last_delivered = -1
+
+        self._threads = [threading.Thread(target=self._capture_loop, name="webcam-capture", daemon=True)] + [
+            threading.Thread(
+                target=self._decode_loop, args=(self._reader.decoding_copy(),), name=f"qr-decode-{i}", daemon=True
+            )
+            for i in range(max(1, decode_workers))
+        ]
+
+    def __enter__(self):
+        self._running = True
+        for thread in self._threads:
+            thread.start()
+
+        return self
+
+    def is_capturing(self) -> bool:
+        return self._reader.is_capturing()
+
+    def capture(self) -> Optional[bytes]:
+        messages = self.capture_all()
+        if len(messages) != 1:
+            # No QR code, or too many of them
+            return
+
+        return messages[0]
+
+    def capture_all(self, colors: int = 1) -> list[bytes]:
+        self._colors = colors
+
+        with self._condition:
+            if not self._results:
+                self._condition.wait(RESULT_TIMEOUT)
+
+            while self._results:
+                index, captured_at, messages = self._results.popleft()
+                if index < self._last_delivered:
+                    self.stats.delivery.drop()
+                    continue
+
+                self._last_delivered = index
+                self.stats.delivery.add(time.perf_counter() - captured_at)
+
+                return messages
+
+        return []
+
+    def _capture_loop(self):
+        index = 0
+        while self._running:
+            started = time.perf_counter()
+            frame = self._reader.read_frame()
+
+            if frame is None:
+                time.sleep(RESULT_TIMEOUT)
+                continue
+
+            captured_at = time.perf_counter()
+            self.stats.capture.add(captured_at - started)
+
+            with self._condition:
+                if self._frame is not None:
+                    self.stats.capture.drop()
+
+                self._frame = (index, captured_at, frame)
+                self._condition.notify_all()
+
+            index += 1
+
+    def _decode_loop(self, reader: WebcamReader):
+        while True:
+            with self._condition:
+                while self._running and self._frame is None:
+                    self._condition.wait()
+
+                if not self._running:
+                    return
+
+                index, captured_at, frame = self._frame
+                self._frame = None
+
+            started = time.perf_counter()
+            messages = reader.decode_frame(frame, self._mode, self._colors)
+            self.stats.decode.add(time.perf_counter() - started)
+
+            with self._condition:
+                if len(self._results) == self._results.maxlen:
+                    self.stats.delivery.drop()
+
+                self._results.append((index, captured_at, messages))
+                self._condition.notify_all()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join()
+
+        print(f"Pipeline stats: {self.stats}")
+        self._reader.__exit__(exc_type, exc_val, exc_tb)
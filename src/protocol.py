@@ -1,3 +1,4 @@
+import hashlib
 import struct
 from dataclasses import dataclass
 from enum import Enum
@@ -14,6 +15,10 @@ Payload Length: 4 bytes
 Header + Payload checksum: 8 bytes
 
 Total length: 18 bytes
+
+Checksum:
+Version 1: crc64 of the text of the (version, request type, sequence, payload) tuple
+Version 2: 8 bytes BLAKE2b of the packed version, request type, sequence, payload length and the payload
 """
 
 
@@ -25,11 +30,47 @@ class RequestType(Enum):
     repeat_data = 5
     finish = 6
     confirm_finish = 7
+    fountain_data = 8  # ONE-WAY BROADCAST, NEVER ANSWERED
+    duplex_data = 9  # DATA AND ACKNOWLEDGEMENT, BOTH WAYS AT ONCE
+    parity_data = 10  # FORWARD ERROR CORRECTION OF A BLOCK OF WINDOW CHUNKS
 
 
 VERSION = 1
+LATEST_VERSION = 2
+SUPPORTED_VERSIONS = (VERSION, LATEST_VERSION)
 HEADER_LENGTH = 18
 
+MAX_SUFFIX_LENGTH = 10
+MAX_NACK_LENGTH = 512
+OPTIONS_SEPARATOR = b"?"
+
+"""
+Connection options:
+The start_connection payload is the file suffix, optionally followed by OPTIONS_SEPARATOR and
+"key=value" pairs joined by "&" (e.g. b".txt?window=8"). A peer that understands the options answers
+confirm_connection with the subset it accepted, encoded the same way. A sender answered with an empty payload
+falls back to the defaults.
+The options need an updated receiver: a receiver from before them takes the whole payload as the suffix, so it saves
+the file without a suffix (payloads above MAX_SUFFIX_LENGTH bytes) or with the options in its name. They are only
+sent when one differs from its default, a sender left at the defaults talks to any receiver.
+The "version" option offers a protocol version above VERSION. The start_connection header is always VERSION,
+the accepted version is used from the confirm_connection header on.
+A receiver accepting the "duplex" option adds a "suffix" option, the suffix of the file it sends back.
+
+Window acknowledgement (confirm_data payload when a window was negotiated):
+Next missing sequence: 4 bytes
+Received sequences: 4 bytes each
+
+Missing sequences (repeat_data payload answering finish, empty from older peers):
+Runs of missing and received sequences alternately, from the header sequence (the first missing one) on, every run
+length as an unsigned LEB128 varint. The runs end with a missing one, gaps that don't fit MAX_NACK_LENGTH are asked
+for at the next finish.
+
+Duplex data (duplex_data payload when both peers send a file in the session):
+Next missing sequence of the received file: 4 bytes
+The chunk of the sent file at the header sequence, empty once all of them were acknowledged
+"""
+
 
 @dataclass
 class RequestHeader:
@@ -68,6 +109,138 @@ class RequestHeader:
 
 
 def calculate_hash(version: int, request_type: RequestType, sequence: int, payload: Optional[bytes]):
+    if version >= 2:
+        payload = payload or b""
+        digest = hashlib.blake2b(
+            struct.pack("<bbii", version, request_type.value, sequence, len(payload)), digest_size=8
+        )
+        digest.update(payload)
+
+        return digest.digest()
+
     hash_tuple = (version, request_type.value, sequence, payload)
 
     return bytes.fromhex(crc64(str(hash_tuple)))
+
+
+def is_protocol_message(data: bytes) -> bool:
+    # Cheap magic check on the version and request type bytes, used to ignore unrelated QR codes
+    return (
+        len(data) >= HEADER_LENGTH
+        and data[0] in SUPPORTED_VERSIONS
+        and data[1] in RequestType._value2member_map_  # noqa
+    )
+
+
+def encode_options(options: dict[str, object]) -> bytes:
+    return "&".join(f"{key}={value}" for key, value in options.items()).encode()
+
+
+def decode_options(raw_options: bytes) -> dict[str, str]:
+    options = {}
+    for raw_option in raw_options.decode(errors="ignore").split("&"):
+        key, separator, value = raw_option.partition("=")
+        if separator:
+            options[key] = value
+
+    return options
+
+
+def build_connection_payload(suffix: str, options: Optional[dict[str, object]] = None) -> bytes:
+    payload = suffix.encode()
+    if options:
+        payload += OPTIONS_SEPARATOR + encode_options(options)
+
+    return payload
+
+
+def parse_connection_payload(payload: bytes) -> tuple[Optional[str], dict[str, str]]:
+    raw_suffix, _, raw_options = payload.partition(OPTIONS_SEPARATOR)
+
+    try:
+        suffix = raw_suffix.decode()
+    except UnicodeDecodeError:
+        suffix = None
+
+    if len(raw_suffix) > MAX_SUFFIX_LENGTH:
+        suffix = None
+
+    return suffix, decode_options(raw_options)
+
+
+def build_ack_payload(next_missing: int, sequences: list[int]) -> bytes:
+    return struct.pack(f"<i{len(sequences)}i", next_missing, *sequences)
+
+
+def parse_ack_payload(payload: bytes) -> tuple[int, list[int]]:
+    if len(payload) < 4 or len(payload) % 4 != 0:
+        raise ValueError("Bad acknowledgement payload")
+
+    next_missing, *sequences = struct.unpack(f"<{len(payload) // 4}i", payload)
+
+    return next_missing, sequences
+
+
+def build_duplex_payload(next_missing: int, chunk: bytes) -> bytes:
+    return struct.pack("<i", next_missing) + chunk
+
+
+def parse_duplex_payload(payload: bytes) -> tuple[int, bytes]:
+    if len(payload) < 4:
+        raise ValueError("Bad duplex payload")
+
+    (next_missing,) = struct.unpack("<i", payload[:4])
+
+    return next_missing, payload[4:]
+
+
+def _encode_varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+
+    return bytes(encoded)
+
+
+def build_nack_payload(missing_runs: list[tuple[int, int]], max_length: int = MAX_NACK_LENGTH) -> bytes:
+    # The missing runs are (first sequence, length), in order and apart
+    payload = b""
+    end = missing_runs[0][0] if missing_runs else 0
+    for start, length in missing_runs:
+        runs = (_encode_varint(start - end) if payload else b"") + _encode_varint(length)
+        if len(payload) + len(runs) > max_length:
+            break
+
+        payload += runs
+        end = start + length
+
+    return payload
+
+
+def parse_nack_payload(first_missing: int, payload: bytes) -> list[tuple[int, int]]:
+    lengths = []
+    value = shift = 0
+    for byte in payload:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte & 0x80:
+            if shift > 28:
+                raise ValueError("Bad missing sequences payload")
+            continue
+
+        lengths.append(value)
+        value = shift = 0
+
+    if shift or len(lengths) % 2 == 0 or first_missing < 0:
+        raise ValueError("Bad missing sequences payload")
+
+    runs = []
+    start = first_missing
+    for i in range(0, len(lengths), 2):
+        start += lengths[i - 1] if i else 0
+        runs.append((start, lengths[i]))
+        start += lengths[i]
+
+    return runs
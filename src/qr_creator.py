@@ -1,15 +1,54 @@
-import base64
+import hashlib
+import math
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
+from typing import Optional, Union
 
 import numpy
 import qrcode as qrcode
+from PIL import Image, ImageColor
 from cv2 import cv2 as cv
 from numpy import ndarray
 from qrcode import QRCode
+from qrcode.util import BIT_LIMIT_TABLE, MODE_8BIT_BYTE, MODE_ALPHA_NUM, length_in_bits
 
+from color_planes import merge_planes
+from payload_encoding import PayloadEncoding, encode_payload, BASE45_MARKER, BINARY_MARKER
 from protocol import HEADER_LENGTH
 
 MAX_DATA_SIZE = 1024  # 1KB
+MAX_QR_VERSION = 40
+
+# Image types that keep the exact colors, the module matrix can be drawn without the codec round trip
+LOSSLESS_IMAGE_TYPES = ("png", "bmp")
+
+FRAME_CACHE_SIZE = 16
+# Light modules between the quiet zones of neighbouring tiles, decoders miss codes that touch another one
+TILE_GAP_MODULES = 4
+# Of the tiled frames, unless given. At level H, 4 codes of full chunks need more pixels than a 480p webcam has
+TILE_ERROR_CORRECTION_LEVEL = qrcode.constants.ERROR_CORRECT_M
+
+
+def max_data_size(
+    error_correction_level: int, version: int = MAX_QR_VERSION, encoding: PayloadEncoding = PayloadEncoding.base64
+) -> int:
+    # Below the historical MAX_DATA_SIZE at the default level, a version 40 code can't hold 1 KB of base64 at level H
+    bit_limit = BIT_LIMIT_TABLE[error_correction_level][version] - 4
+
+    if encoding == PayloadEncoding.base45:
+        # 2 characters in 11 bits, a single last one in 6. 3 characters carry 2 bytes
+        bits = bit_limit - length_in_bits(MODE_ALPHA_NUM, version)
+        characters = bits // 11 * 2 + (1 if bits % 11 >= 6 else 0) - len(BASE45_MARKER)
+
+        return characters // 3 * 2 + (1 if characters % 3 == 2 else 0)
+
+    capacity = (bit_limit - length_in_bits(MODE_8BIT_BYTE, version)) // 8
+
+    if encoding == PayloadEncoding.binary:
+        return capacity - len(BINARY_MARKER)
+
+    return capacity // 4 * 3
 
 
 class QRCodeCreator:
@@ -22,6 +61,8 @@ class QRCodeCreator:
         back_color: str = "white",
         color_profile: str = "RGB",
         image_type: str = "png",
+        tile_box_size: int = 4,
+        cache_size: int = FRAME_CACHE_SIZE,
     ):
         self._error_correction_level = error_correction_level
         self._box_size = box_size
@@ -30,10 +71,18 @@ class QRCodeCreator:
         self._back_color = back_color
         self._color_profile = color_profile
         self._image_type = image_type
+        self._tile_box_size = tile_box_size
+
+        self._gray_levels: Optional[tuple[int, int]] = None
+
+        # Rendered (or being rendered ahead) frames by digest of the frame and render options, least recent first
+        self._cache_size = cache_size
+        self._frames: OrderedDict[tuple, Union[ndarray, Future]] = OrderedDict()
+        self._render_executor: Optional[ThreadPoolExecutor] = None
 
     @staticmethod
-    def _validate_size(data: bytes) -> None:
-        if len(data) > MAX_DATA_SIZE:
+    def _validate_size(data: bytes, error_correction_level: int, encoding: PayloadEncoding) -> None:
+        if len(data) > max_data_size(error_correction_level, encoding=encoding):
             raise ValueError("Data is too big")
 
     @staticmethod
@@ -43,23 +92,118 @@ class QRCodeCreator:
         img_array = numpy.asarray(bytearray(image_stream.read()), dtype=numpy.uint8)
         return cv.imdecode(img_array, cv2_image_flag)
 
-    def create(self, data: bytes) -> ndarray:
-        if len(data) < HEADER_LENGTH + 10:
-            box_size = 20
-        else:
-            box_size = self._box_size
+    def create(
+        self,
+        data: bytes,
+        box_size: Optional[int] = None,
+        error_correction_level: Optional[int] = None,
+        image_size: Optional[int] = None,
+        encoding: PayloadEncoding = PayloadEncoding.base64,
+    ) -> ndarray:
+        if error_correction_level is None:
+            error_correction_level = self._error_correction_level
+
+        box_size = self._frame_box_size(data, box_size)
 
-        self._validate_size(data)
+        key = self._frame_key(data, box_size, error_correction_level, image_size, encoding)
+        frame = self._frames.pop(key, None)
+
+        if frame is None:
+            frame = self._create(data, box_size, error_correction_level, image_size, encoding)
+        elif isinstance(frame, Future):
+            frame = frame.result()
+
+        self._cache_frame(key, frame)
+
+        return frame
+
+    def prerender(
+        self,
+        data_list: list[bytes],
+        tiled: bool = False,
+        error_correction_level: Optional[int] = None,
+        image_size: Optional[int] = None,
+        encoding: PayloadEncoding = PayloadEncoding.base64,
+        colors: int = 1,
+    ) -> None:
+        # Renders the frames in the background, a later create of the same frame waits for its result. The codes of
+        # create_tiled frames are rendered as it does: tiled, several tiles per frame, or several colours per tile
+        if error_correction_level is None:
+            tiled_frame = tiled or colors > 1
+            error_correction_level = TILE_ERROR_CORRECTION_LEVEL if tiled_frame else self._error_correction_level
+
+        for data in data_list:
+            box_size = self._frame_box_size(data, self._tile_box_size if tiled else None)
+            key = self._frame_key(data, box_size, error_correction_level, image_size, encoding)
+            if key in self._frames:
+                continue
+
+            if self._render_executor is None:
+                self._render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qr-render-ahead")
+
+            self._cache_frame(
+                key,
+                self._render_executor.submit(
+                    self._create, data, box_size, error_correction_level, image_size, encoding
+                ),
+            )
+
+    def max_tile_version(self, tiles: int) -> int:
+        # The highest version whose tiles, side by side with the gaps between them, are no wider than one code of the
+        # highest version: a tiled frame is then no denser than a single code frame
+        columns = math.ceil(math.sqrt(tiles))
+        frame_modules = 17 + 4 * MAX_QR_VERSION + 2 * self._border
+        tile_modules = (frame_modules + TILE_GAP_MODULES) // columns - TILE_GAP_MODULES - 2 * self._border
+
+        return max(1, min(MAX_QR_VERSION, (tile_modules - 17) // 4))
+
+    def _frame_box_size(self, data: bytes, box_size: Optional[int]) -> int:
+        if box_size is not None:
+            return box_size
+
+        return 20 if len(data) < HEADER_LENGTH + 10 else self._box_size
+
+    @staticmethod
+    def _frame_key(
+        data: bytes, box_size: int, error_correction_level: int, image_size: Optional[int], encoding: PayloadEncoding
+    ) -> tuple:
+        # The frame holds the header, so the digest covers the request type and sequence along with the payload
+        return hashlib.blake2b(data, digest_size=16).digest(), box_size, error_correction_level, image_size, encoding
 
-        data = base64.b64encode(data)
+    def _cache_frame(self, key: tuple, frame: Union[ndarray, Future]) -> None:
+        self._frames[key] = frame
+        while len(self._frames) > self._cache_size:
+            self._frames.popitem(last=False)
+
+    def _create(
+        self,
+        data: bytes,
+        box_size: int,
+        error_correction_level: int,
+        image_size: Optional[int],
+        encoding: PayloadEncoding,
+    ) -> ndarray:
+        self._validate_size(data, error_correction_level, encoding)
+
+        data = encode_payload(data, encoding)
 
         image_stream = BytesIO()
 
-        qr_code = QRCode(
-            version=1, error_correction=self._error_correction_level, box_size=box_size, border=self._border
-        )
+        qr_code = QRCode(version=1, error_correction=error_correction_level, box_size=box_size, border=self._border)
+
+        if encoding == PayloadEncoding.binary:
+            # A single byte mode segment, so that a reader converts all the data the same way
+            qr_code.add_data(data, optimize=0)
+        else:
+            qr_code.add_data(data)
+
+        if image_size is not None:
+            # Keep the displayed size constant whatever QR version the data needs
+            qr_code.make(fit=True)
+            qr_code.box_size = max(1, image_size // (qr_code.modules_count + 2 * self._border))
 
-        qr_code.add_data(data)
+        if self._image_type.lower() in LOSSLESS_IMAGE_TYPES:
+            return self._render(qr_code)
 
         temp_image = qr_code.make_image(fill_color=self._fill_color, back_color=self._back_color).convert(
             self._color_profile
@@ -70,3 +214,85 @@ class QRCodeCreator:
         qr_code_image = self._create_opencv_image(image_stream)
 
         return qr_code_image
+
+    def _render(self, qr_code: QRCode) -> ndarray:
+        # The same pixels as the PIL image decoded back as grayscale, every module scaled to a box_size square
+        modules = numpy.asarray(qr_code.get_matrix(), dtype=bool)
+        fill_level, back_level = self._get_gray_levels()
+        box_size = qr_code.box_size
+
+        qr_code_image = numpy.empty((modules.shape[0], box_size, modules.shape[1], box_size), dtype=numpy.uint8)
+        qr_code_image[...] = numpy.where(modules, numpy.uint8(fill_level), numpy.uint8(back_level))[:, None, :, None]
+
+        return qr_code_image.reshape(modules.shape[0] * box_size, modules.shape[1] * box_size)
+
+    def _get_gray_levels(self) -> tuple[int, int]:
+        if self._gray_levels is None:
+            # Let the codec convert the colors once, so that they match the images it would have decoded
+            image = Image.new("RGB", (2, 1))
+            image.putpixel((0, 0), ImageColor.getrgb(self._fill_color))
+            image.putpixel((1, 0), ImageColor.getrgb(self._back_color))
+
+            image_stream = BytesIO()
+            image.convert(self._color_profile).save(image_stream, self._image_type)
+
+            fill_level, back_level = self._create_opencv_image(image_stream)[0]
+            self._gray_levels = int(fill_level), int(back_level)
+
+        return self._gray_levels
+
+    def create_colored(
+        self,
+        data_list: list[bytes],
+        box_size: Optional[int] = None,
+        error_correction_level: Optional[int] = None,
+        encoding: PayloadEncoding = PayloadEncoding.base64,
+    ) -> ndarray:
+        # A code per colour plane of a BGR image
+        return merge_planes(
+            [self.create(data, box_size, error_correction_level, encoding=encoding) for data in data_list]
+        )
+
+    def create_tiled(
+        self,
+        data_list: list[bytes],
+        columns: Optional[int] = None,
+        error_correction_level: Optional[int] = None,
+        encoding: PayloadEncoding = PayloadEncoding.base64,
+        colors: int = 1,
+    ) -> ndarray:
+        if len(data_list) == 1:
+            return self.create(data_list[0], error_correction_level=error_correction_level, encoding=encoding)
+
+        if error_correction_level is None:
+            error_correction_level = TILE_ERROR_CORRECTION_LEVEL
+
+        if colors > 1:
+            # Every tile holds as many codes as colour planes
+            if len(data_list) <= colors:
+                return self.create_colored(data_list, error_correction_level=error_correction_level, encoding=encoding)
+
+            images = [
+                self.create_colored(data_list[i : i + colors], self._tile_box_size, error_correction_level, encoding)
+                for i in range(0, len(data_list), colors)
+            ]
+        else:
+            images = [
+                self.create(data, self._tile_box_size, error_correction_level, encoding=encoding) for data in data_list
+            ]
+
+        columns = columns or math.ceil(math.sqrt(len(images)))
+        rows = math.ceil(len(images) / columns)
+        tile_size = max(max(image.shape[:2]) for image in images)
+        gap = TILE_GAP_MODULES * self._tile_box_size
+        step = tile_size + gap
+
+        tiled_image = numpy.full(
+            (rows * step - gap, columns * step - gap) + images[0].shape[2:], 255, dtype=numpy.uint8
+        )
+        for i, image in enumerate(images):
+            top = (i // columns) * step
+            left = (i % columns) * step
+            tiled_image[top : top + image.shape[0], left : left + image.shape[1]] = image
+
+        return tiled_image
@@ -0,0 +1,231 @@
+import os
+import uuid
+from typing import BinaryIO, Optional
+
+from compression import Compression, decompressor
+
+COPY_BLOCK_SIZE = 1 << 20
+
+
+# Which chunks were received, one bit per sequence. The first missing sequence only moves forward, so finding it is
+# amortized O(1) per received chunk.
+class ChunkBitmap:
+    def __init__(self):
+        self._bits = bytearray()
+        self._next_missing = 0
+        self._last_sequence = -1
+        self._count = 0
+
+    def __contains__(self, sequence: int) -> bool:
+        return 0 <= sequence < len(self._bits) * 8 and bool(self._bits[sequence >> 3] & (1 << (sequence & 7)))
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def next_missing(self) -> int:
+        return self._next_missing
+
+    @property
+    def last_sequence(self) -> int:
+        return self._last_sequence
+
+    def add(self, sequence: int) -> bool:
+        if sequence < 0:
+            raise IndexError("Chunk sequence out of range")
+
+        if sequence in self:
+            return False
+
+        if sequence >> 3 >= len(self._bits):
+            # Grow geometrically, the chunks mostly arrive in order
+            self._bits.extend(bytes(max(len(self._bits), (sequence >> 3) + 1 - len(self._bits))))
+
+        self._bits[sequence >> 3] |= 1 << (sequence & 7)
+        self._count += 1
+        self._last_sequence = max(self._last_sequence, sequence)
+
+        while self._next_missing in self:
+            self._next_missing += 1
+
+        return True
+
+    def missing_runs(self) -> list[tuple[int, int]]:
+        # (first sequence, length) of the gaps before the last received sequence
+        runs = []
+        sequence = self._next_missing
+        while sequence < self._last_sequence:
+            if sequence & 7 == 0 and self._bits[sequence >> 3] == 0xFF:
+                sequence += 8
+            elif sequence in self:
+                sequence += 1
+            else:
+                start = sequence
+                while sequence not in self:
+                    sequence += 1
+                runs.append((start, sequence - start))
+
+        return runs
+
+
+# A file being received, every chunk is written to a temporary file in the destination folder as soon as it arrives.
+# With a known chunk size a chunk is written at sequence * chunk_size. When the sizes vary (chunk_size 0) its offset is
+# only known once the chunks before it arrived, so the chunks after a gap wait in memory, at most a window of them.
+# Compressed content is decompressed into a second temporary file as the chunks without a gap grow, the content is
+# then read from it. The temporary file is renamed to its name only when complete.
+class ReceivedFile:
+    def __init__(self, folder: str, chunk_size: int, compression: Compression = Compression.none):
+        self._chunk_size = chunk_size
+        self._received = ChunkBitmap()
+
+        self._pending: dict[int, bytes] = {}
+        self._next_to_write = 0
+        self._written_length = 0
+
+        self._path = self._temporary_path(folder)
+        self._fp: Optional[BinaryIO] = open(self._path, "w+b")
+
+        self._decompressor = None
+        self._decompressed_path: Optional[str] = None
+        self._decompressed_fp: Optional[BinaryIO] = None
+        self._decompressed_input_length = 0
+        self._decompressed_length = 0
+
+        if compression != Compression.none:
+            self._decompressor = decompressor(compression)
+            self._decompressed_path = self._temporary_path(folder)
+            self._decompressed_fp = open(self._decompressed_path, "w+b")
+
+    @staticmethod
+    def _temporary_path(folder: str) -> str:
+        return os.path.join(folder, f".receiving-{uuid.uuid4().hex}.part")
+
+    @property
+    def received_count(self) -> int:
+        return len(self._received)
+
+    @property
+    def next_missing(self) -> int:
+        return self._received.next_missing
+
+    @property
+    def received_length(self) -> int:
+        # Length of the content received without a gap, from its start
+        if self._decompressor is not None:
+            return self._decompressed_length
+
+        return self._received_length()
+
+    def _received_length(self) -> int:
+        if self._chunk_size:
+            # The last chunk is shorter
+            return min(self._received.next_missing * self._chunk_size, self._written_length)
+
+        return self._written_length
+
+    def missing(self) -> Optional[int]:
+        # The first gap before the last received chunk, the chunks after it are not known to exist
+        if self._received.next_missing > self._received.last_sequence:
+            return None
+
+        return self._received.next_missing
+
+    def missing_runs(self) -> list[tuple[int, int]]:
+        return self._received.missing_runs()
+
+    def __contains__(self, sequence: int) -> bool:
+        return sequence in self._received
+
+    def read_chunk(self, sequence: int) -> bytes:
+        # As received, before any decompression, with a known chunk size
+        self._fp.seek(sequence * self._chunk_size)
+
+        return self._fp.read(self._chunk_size)
+
+    def add(self, sequence: int, payload: bytes) -> bool:
+        if not self._received.add(sequence):
+            return False
+
+        if self._chunk_size:
+            self._write(sequence * self._chunk_size, payload)
+            self._written_length = max(self._written_length, sequence * self._chunk_size + len(payload))
+        else:
+            self._pending[sequence] = payload
+            while self._next_to_write in self._pending:
+                payload = self._pending.pop(self._next_to_write)
+                self._write(self._written_length, payload)
+                self._written_length += len(payload)
+                self._next_to_write += 1
+
+        if self._decompressor is not None:
+            self._decompress()
+
+        return True
+
+    def _write(self, offset: int, payload: bytes) -> None:
+        self._fp.seek(offset)
+        self._fp.write(payload)
+
+    def _decompress(self) -> None:
+        received_length = self._received_length()
+        while self._decompressed_input_length < received_length:
+            self._fp.seek(self._decompressed_input_length)
+            block = self._fp.read(min(received_length - self._decompressed_input_length, COPY_BLOCK_SIZE))
+            if not block:
+                break
+
+            self._decompressed_input_length += len(block)
+
+            decompressed = self._decompressor.decompress(block)
+            self._decompressed_fp.seek(self._decompressed_length)
+            self._decompressed_fp.write(decompressed)
+            self._decompressed_length += len(decompressed)
+
+    def _content(self) -> tuple[str, BinaryIO]:
+        if self._decompressor is not None:
+            return self._decompressed_path, self._decompressed_fp
+
+        return self._path, self._fp
+
+    def read(self, offset: int, length: int) -> bytes:
+        _, fp = self._content()
+        fp.seek(offset)
+
+        return fp.read(length)
+
+    def save_range(self, offset: int, length: int, path: str) -> None:
+        # Copied to a temporary file next to the destination first, so that the destination is only ever complete
+        temporary_path = self._temporary_path(os.path.dirname(path))
+        with open(temporary_path, "wb") as fp:
+            while length > 0:
+                block = self.read(offset, min(length, COPY_BLOCK_SIZE))
+                if not block:
+                    break
+
+                fp.write(block)
+                offset += len(block)
+                length -= len(block)
+
+        os.replace(temporary_path, path)
+
+    def save(self, path: str) -> None:
+        content_path, content_fp = self._content()
+        content_fp.close()
+
+        os.replace(content_path, path)
+
+        self.discard()
+
+    def discard(self) -> None:
+        for path, fp in [(self._path, self._fp), (self._decompressed_path, self._decompressed_fp)]:
+            if fp is None:
+                continue
+
+            if not fp.closed:
+                fp.close()
+
+            if os.path.exists(path):
+                os.remove(path)
+
+        self._fp = None
+        self._decompressed_fp = None
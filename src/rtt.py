@@ -0,0 +1,67 @@
+from typing import Optional
+
+"""
+Round trip time of the data frames, from showing a frame to seeing its acknowledgement, and the retransmission timeout
+derived from it as TCP does (RFC 6298, Jacobson / Karels): a smoothed RTT and its mean deviation, and a timeout of
+RTT + 4 deviations. Only frames shown once are sampled (Karn's algorithm), the acknowledgement of a frame shown again
+may answer any of its shows. The timeout doubles on every expiry until the next sample.
+"""
+
+RTT_GAIN = 1 / 8
+DEVIATION_GAIN = 1 / 4
+DEVIATION_FACTOR = 4
+
+# In seconds. The upper bound is the fixed wait the sender used to have
+INITIAL_RTO = 1.0
+MIN_RTO = 0.2
+MAX_RTO = 10.0
+MAX_BACKOFF = 64
+
+# Timeouts in a row before the sender gives the session up
+MAX_RETRANSMISSIONS = 5
+
+
+class RttEstimator:
+    def __init__(self, initial_rto: float = INITIAL_RTO, min_rto: float = MIN_RTO, max_rto: float = MAX_RTO):
+        self._initial_rto = initial_rto
+        self._min_rto = min_rto
+        self._max_rto = max_rto
+
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.samples = 0
+        self._backoff = 1
+
+    def sample(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - DEVIATION_GAIN) * self.rttvar + DEVIATION_GAIN * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_GAIN) * self.srtt + RTT_GAIN * rtt
+
+        self.samples += 1
+        self._backoff = 1
+
+    def back_off(self) -> None:
+        self._backoff = min(self._backoff * 2, MAX_BACKOFF)
+
+    @property
+    def rto(self) -> float:
+        rto = self._initial_rto if self.srtt is None else self.srtt + DEVIATION_FACTOR * self.rttvar
+
+        return min(self._max_rto, max(self._min_rto, rto) * self._backoff)
+
+    def snapshot(self) -> dict:
+        return {
+            "rtt_seconds": self.srtt,
+            "rtt_deviation_seconds": self.rttvar if self.srtt is not None else None,
+            "rto_seconds": self.rto,
+            "rtt_samples": self.samples,
+        }
+
+    def __str__(self) -> str:
+        if self.srtt is None:
+            return f"RTT unknown, RTO {self.rto:.2f}s"
+
+        return f"RTT {self.srtt:.2f}s (±{self.rttvar:.2f}s, {self.samples} samples), RTO {self.rto:.2f}s"
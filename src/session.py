@@ -0,0 +1,105 @@
+from dataclasses import dataclass, fields, replace
+from enum import Enum
+
+from chunking import DEFAULT_CHUNK_SIZE
+from color_planes import COLORS
+from compression import Compression
+from fec import MAX_FEC_SYMBOLS
+from payload_encoding import PayloadEncoding
+from protocol import LATEST_VERSION, VERSION
+
+MAX_WINDOW_SIZE = 64
+MAX_TILES = 9
+
+
+# The options negotiated in the start_connection / confirm_connection handshake. The defaults are the behaviour of
+# a peer that knows no options at all, and only the values that differ from them are sent.
+@dataclass(frozen=True)
+class SessionOptions:
+    window: int = 1
+    tiles: int = 1
+    encoding: PayloadEncoding = PayloadEncoding.base64
+    version: int = VERSION
+    # 0 when the chunk sizes vary
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    # Length of the manifest of a batch session, 0 for a single file
+    batch: int = 0
+    # Of the session content, the compression level only matters to the sender
+    compression: Compression = Compression.none
+    # Offered as a random token, the offer with the lower one gives way when both peers offer at once. Accepted as 1
+    # by a peer that sends a file back in the same session
+    duplex: int = 0
+    # Parity chunks added to every block of data chunks, with a window of chunks of a known size
+    fec_data: int = 0
+    fec_parity: int = 0
+    # Chunks drawn into the colour planes of every code, 1 or 3
+    colors: int = 1
+
+    @classmethod
+    def parse(cls, options: dict[str, str]) -> "SessionOptions":
+        values = {}
+        for field in fields(cls):
+            if field.name not in options:
+                continue
+
+            try:
+                values[field.name] = field.type(options[field.name])
+            except ValueError:
+                # Unknown values are ignored, the option keeps its default
+                continue
+
+        return cls(**values)
+
+    def encode(self) -> dict[str, object]:
+        default = SessionOptions()
+        encoded = {}
+        for field in fields(self):
+            value = getattr(self, field.name)
+            if value != getattr(default, field.name):
+                encoded[field.name] = value.value if isinstance(value, Enum) else value
+
+        return encoded
+
+    def accepted(self) -> "SessionOptions":
+        # What a receiver supports out of the requested options
+        window = max(1, min(self.window, MAX_WINDOW_SIZE))
+        fec = (
+            window > 1
+            and self.chunk_size > 0
+            and self.fec_data > 0
+            and self.fec_parity > 0
+            and self.fec_data + self.fec_parity <= MAX_FEC_SYMBOLS
+        )
+
+        return replace(
+            self,
+            window=window,
+            tiles=max(1, min(self.tiles, MAX_TILES)) if window > 1 else 1,
+            version=max(VERSION, min(self.version, LATEST_VERSION)),
+            chunk_size=max(0, self.chunk_size),
+            batch=max(0, self.batch),
+            # Only a receiver that has a file to send accepts it
+            duplex=0,
+            fec_data=self.fec_data if fec else 0,
+            fec_parity=self.fec_parity if fec else 0,
+            colors=COLORS if self.colors == COLORS and window > 1 else 1,
+        )
+
+    def agreed(self, accepted: "SessionOptions") -> "SessionOptions":
+        # What a sender uses, out of what it offered and what the receiver accepted
+        window = max(1, min(self.window, accepted.window))
+        fec = window > 1 and (accepted.fec_data, accepted.fec_parity) == (self.fec_data, self.fec_parity)
+
+        return replace(
+            accepted,
+            window=window,
+            tiles=max(1, min(self.tiles, accepted.tiles, window)),
+            encoding=accepted.encoding if accepted.encoding == self.encoding else PayloadEncoding.base64,
+            compression=accepted.compression if accepted.compression == self.compression else Compression.none,
+            version=max(VERSION, min(self.version, accepted.version)),
+            chunk_size=self.chunk_size,
+            duplex=1 if self.duplex and accepted.duplex else 0,
+            fec_data=self.fec_data if fec else 0,
+            fec_parity=self.fec_parity if fec else 0,
+            colors=COLORS if self.colors == COLORS and accepted.colors == COLORS and window > 1 else 1,
+        )
@@ -1,3 +1,4 @@
+import os
 from typing import Optional
 from unittest.mock import MagicMock
 
@@ -5,6 +6,7 @@ import pytest
 from cv2 import cv2
 
 from main import QRCodeCommunication
+from payload_encoding import PayloadEncoding
 from protocol import RequestHeader, HEADER_LENGTH
 from qr_creator import QRCodeCreator
 from webcam import WebcamReader
@@ -23,11 +25,13 @@ class QRCodeCreatorMock(QRCodeCreator):
         super().__init__()
 
         self.responses = []
+        self.encodings = []
 
     def create(self, *args, **kwargs):
         super_result = super().create(*args, **kwargs)
 
         self.responses.append(super_result)
+        self.encodings.append(kwargs.get("encoding", PayloadEncoding.base64))
 
         return super_result
 
@@ -40,8 +44,8 @@ def qr_creator():
 
 
 @pytest.fixture
-def qr_code_communation_mock(webcam_reader_mock):
-    qrcode = QRCodeCommunication("received-files")
+def qr_code_communation_mock(webcam_reader_mock, tmp_path):
+    qrcode = QRCodeCommunication(str(tmp_path))
     qrcode._qr_code_creator = QRCodeCreatorMock()
     qrcode.show_image = MagicMock(return_value=None)
     return qrcode
@@ -59,3 +63,12 @@ def parse_image(webcam_reader_mock, image, mode=cv2.COLOR_BGR2GRAY) -> tuple[Opt
     raw_payload = raw_data[HEADER_LENGTH:]
 
     return header, raw_payload
+
+
+def received_files(folder: str) -> dict[str, bytes]:
+    files = {}
+    for file_name in os.listdir(folder):
+        with open(os.path.join(folder, file_name), "rb") as f:
+            files[file_name] = f.read()
+
+    return files
@@ -0,0 +1,72 @@
+import qrcode.constants
+
+from adaptive import AdaptiveController
+from protocol import HEADER_LENGTH
+from qr_creator import max_data_size
+
+
+def test_additive_increase_multiplicative_decrease():
+    controller = AdaptiveController(HEADER_LENGTH, chunk_size=150, increase_step=32)
+
+    controller.on_success()
+    controller.on_success()
+    assert controller.chunk_size == 214
+
+    controller.on_failure()
+    assert controller.chunk_size == 107
+
+
+def test_chunk_size_is_bounded():
+    controller = AdaptiveController(HEADER_LENGTH, chunk_size=40, min_chunk_size=32)
+
+    for _ in range(5):
+        controller.on_failure()
+    assert controller.chunk_size == 32
+
+    for _ in range(200):
+        controller.on_success()
+    assert controller.chunk_size == controller.max_chunk_size
+    assert controller.max_chunk_size == max_data_size(controller.error_correction_level) - HEADER_LENGTH
+
+
+def test_error_correction_level_follows_the_link():
+    controller = AdaptiveController(HEADER_LENGTH, success_streak_to_lower_level=4, failures_to_raise_level=2)
+    assert controller.error_correction_level == qrcode.constants.ERROR_CORRECT_H
+
+    # A clean link ends on the densest level with chunks well beyond the default maximum
+    for _ in range(500):
+        controller.on_success()
+    assert controller.error_correction_level == qrcode.constants.ERROR_CORRECT_L
+    assert controller.chunk_size > max_data_size(qrcode.constants.ERROR_CORRECT_H)
+
+    controller.on_failure()
+    assert controller.error_correction_level == qrcode.constants.ERROR_CORRECT_L
+
+    controller.on_failure()
+    assert controller.error_correction_level == qrcode.constants.ERROR_CORRECT_M
+    assert controller.chunk_size <= controller.max_chunk_size
+
+
+def test_chunk_size_grows_a_step_beyond_the_acknowledged_chunks():
+    controller = AdaptiveController(HEADER_LENGTH, chunk_size=150, increase_step=32)
+
+    # Acknowledgements of chunks shown before the growth don't grow it further
+    for _ in range(5):
+        controller.on_success(150)
+    assert controller.chunk_size == 182
+
+    controller.on_success(182)
+    assert controller.chunk_size == 214
+
+    # Nor do the ones of chunks read only when shown again
+    controller.on_success(0)
+    assert controller.chunk_size == 214
+
+
+def test_chunk_size_is_bounded_by_the_version():
+    controller = AdaptiveController(HEADER_LENGTH, max_version=16)
+
+    for _ in range(200):
+        controller.on_success()
+    assert controller.max_chunk_size == max_data_size(controller.error_correction_level, 16) - HEADER_LENGTH
+    assert controller.chunk_size <= controller.max_chunk_size
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from batch import BatchContent, BatchFile, BatchReception, build_manifest, parse_manifest
+from reception import ReceivedFile
+
+FILES = {"a.txt": b"ABCD" * 100, "empty.bin": b"", "b.png": bytes(range(256))}
+
+
+def _batch() -> tuple[bytes, bytes]:
+    manifest = build_manifest([BatchFile(name, len(content)) for name, content in FILES.items()])
+
+    return manifest, manifest + b"".join(FILES.values())
+
+
+def test_manifest():
+    files = [BatchFile("a.txt", 400), BatchFile("ä.bin", 0)]
+
+    assert parse_manifest(build_manifest(files)) == files
+
+    with pytest.raises(ValueError):
+        parse_manifest(build_manifest(files)[:-1])
+
+
+def test_batch_content():
+    manifest, expected = _batch()
+    content = BatchContent([manifest, *FILES.values()])
+
+    assert len(content) == len(expected)
+    for start, stop in [(0, 150), (10, 40), (len(manifest) - 1, len(manifest) + 401), (600, 10000), (5, 5)]:
+        assert content[start:stop] == expected[start:stop]
+
+
+@pytest.mark.parametrize("chunk_size", [150, 0])
+def test_batch_reception(tmp_path, chunk_size):
+    manifest, content = _batch()
+    chunks = [content[i : i + 150] for i in range(0, len(content), 150)]
+
+    received_file = ReceivedFile(str(tmp_path), chunk_size)
+    reception = BatchReception(len(manifest))
+
+    saved = []
+    for sequence in [1, 0, 2, 4, 3]:
+        received_file.add(sequence, chunks[sequence])
+        saved.append(reception.save_completed(received_file, str(tmp_path)))
+
+    # Reported as soon as the chunks without a gap cover the file
+    assert saved == [[], [], ["a.txt", "empty.bin"], [], ["b.png"]]
+
+    received_file.discard()
+
+    assert sorted(os.listdir(tmp_path)) == sorted(FILES)
+    for name, file_content in FILES.items():
+        assert (tmp_path / name).read_bytes() == file_content
+
+
+def test_batch_reception_names(tmp_path):
+    (tmp_path / "a.txt").write_bytes(b"old")
+
+    manifest = build_manifest([BatchFile("../a.txt", 3), BatchFile("..", 0)])
+    received_file = ReceivedFile(str(tmp_path), 0)
+    received_file.add(0, manifest + b"new")
+
+    assert BatchReception(len(manifest)).save_completed(received_file, str(tmp_path)) == ["a (1).txt", ".. (1)"]
+    assert (tmp_path / "a.txt").read_bytes() == b"old"
+    assert (tmp_path / "a (1).txt").read_bytes() == b"new"
+
+    received_file.discard()
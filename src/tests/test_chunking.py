@@ -0,0 +1,75 @@
+import io
+
+import pytest
+
+from chunking import ContentChunks, MappedFile
+
+CONTENT = bytes(range(256)) * 4
+
+
+def _join(chunks: ContentChunks) -> bytes:
+    return b"".join(chunks[i] for i in range(len(chunks)))
+
+
+def test_fixed_size_chunks():
+    chunks = ContentChunks(CONTENT, 150)
+
+    assert len(chunks) == 7
+    assert [len(chunks[i]) for i in range(len(chunks))] == [150] * 6 + [124]
+    assert _join(chunks) == CONTENT
+
+
+def test_resize_keeps_previous_chunks():
+    chunks = ContentChunks(CONTENT, 150)
+    first_chunks = [chunks[0], chunks[1]]
+
+    chunks.resize_from(2, 300)
+    assert [len(chunks[i]) for i in range(len(chunks))] == [150, 150, 300, 300, 124]
+
+    chunks.resize_from(3, 64)
+    assert [len(chunks[i]) for i in range(len(chunks))] == [150, 150, 300] + [64] * 6 + [40]
+
+    assert [chunks[0], chunks[1]] == first_chunks
+    assert _join(chunks) == CONTENT
+    assert chunks.offset(3) == 600
+
+
+def test_empty_content():
+    chunks = ContentChunks(b"", 150)
+
+    assert len(chunks) == 1
+    assert chunks[0] == b""
+
+    with pytest.raises(IndexError):
+        chunks[1]
+
+
+def test_mapped_file_chunks(tmp_path):
+    path = tmp_path / "file_to_send.bin"
+    path.write_bytes(CONTENT)
+
+    with open(path, "rb") as fp:
+        mapped_file = MappedFile(fp)
+
+    assert isinstance(mapped_file.content, memoryview)
+    assert len(mapped_file) == len(CONTENT)
+
+    chunks = ContentChunks(mapped_file.content, 150)
+    assert isinstance(chunks[1], bytes)
+    assert _join(chunks) == CONTENT
+
+    mapped_file.close()
+    path.unlink()
+
+
+def test_unmapped_files_are_read(tmp_path):
+    path = tmp_path / "empty_file"
+    path.write_bytes(b"")
+
+    # Empty files can't be mapped
+    with open(path, "rb") as fp:
+        assert MappedFile(fp).content == b""
+
+    mapped_file = MappedFile(io.BytesIO(CONTENT))
+    assert mapped_file.content == CONTENT
+    mapped_file.close()
@@ -0,0 +1,94 @@
+import numpy
+import pytest
+
+from color_planes import ColorCalibration, merge_planes, split_planes
+from degradation import mix_colors
+from protocol import RequestHeader, RequestType
+from session import SessionOptions
+from webcam import WebcamReader
+
+
+def _frames(count: int) -> list[bytes]:
+    frames = []
+    for sequence in range(count):
+        payload = bytes([sequence]) * 150
+        header = RequestHeader(request_type=RequestType.send_data, sequence_number=sequence)
+        header.add_payload(payload)
+        frames.append(header.build() + payload)
+
+    return frames
+
+
+def _observed(image: numpy.ndarray, mixing: numpy.ndarray, offset: float) -> numpy.ndarray:
+    pixels = image.reshape(-1, 3).astype(numpy.float32) / 255
+
+    return (pixels @ mixing.T + offset).clip(0, 255).astype(numpy.uint8).reshape(image.shape)
+
+
+def test_merge_and_split_planes():
+    images = [numpy.full((4, 4), 0, dtype=numpy.uint8), numpy.full((2, 6), 100, dtype=numpy.uint8)]
+    merged = merge_planes(images)
+
+    assert merged.shape == (4, 6, 3)
+    assert (merged[:4, :4, 0] == 0).all() and (merged[:, 4:, 0] == 255).all()
+    assert (merged[:2, :, 1] == 100).all() and (merged[2:, :, 1] == 255).all()
+    assert (merged[:, :, 2] == 255).all()
+
+    assert [(plane == merged[:, :, i]).all() for i, plane in enumerate(split_planes(merged, ColorCalibration()))] == [
+        True
+    ] * 3
+
+
+@pytest.mark.parametrize("crosstalk", [0.0, 0.6])
+def test_parse_colored_code(qr_creator, crosstalk):
+    frames = _frames(3)
+    image = mix_colors(qr_creator.create_colored(frames), crosstalk)
+
+    messages, _ = WebcamReader.parse_all_from_planes(image, ColorCalibration())
+
+    assert sorted(messages) == frames
+
+
+def test_parse_grayscale_code_once(qr_creator):
+    frame = _frames(1)[0]
+    image = numpy.repeat(qr_creator.create(frame)[:, :, None], 3, axis=2)
+
+    assert WebcamReader.parse_all_from_planes(image, ColorCalibration())[0] == [frame]
+
+
+def test_calibration(qr_creator):
+    mixing = numpy.float32([[0.6, 0.3, 0.1], [0.25, 0.5, 0.25], [0.1, 0.35, 0.55]]) * 230
+    image = _observed(qr_creator.create_colored(_frames(3)), mixing, 15)
+
+    calibration = ColorCalibration().refined(image)
+
+    assert numpy.abs(calibration.mixing - mixing).max() < 10
+    assert numpy.abs(calibration.offset - 15).max() < 10
+
+    # The planes are unmixed back to the codes
+    corrected = calibration.correct(image)
+    assert numpy.abs(corrected.astype(int) - qr_creator.create_colored(_frames(3))).mean() < 5
+
+
+def test_no_calibration_from_gray_frames(qr_creator):
+    gray = numpy.repeat(qr_creator.create(_frames(1)[0])[:, :, None], 3, axis=2)
+
+    assert ColorCalibration().refined(gray) is None
+    assert ColorCalibration().refined(numpy.full((10, 10, 3), 255, dtype=numpy.uint8)) is None
+
+
+def test_create_tiled_colored_codes(qr_creator):
+    image = qr_creator.create_tiled(_frames(6), colors=3)
+
+    assert image.ndim == 3
+    assert sorted(WebcamReader.parse_all_from_planes(image, ColorCalibration())[0]) == _frames(6)
+
+
+def test_colors_options():
+    offered = SessionOptions(window=8, colors=3)
+
+    assert offered.accepted().colors == 3
+    assert offered.agreed(offered.accepted()).colors == 3
+    assert offered.agreed(SessionOptions(window=8)).colors == 1
+    assert SessionOptions(window=1, colors=3).accepted().colors == 1
+    assert SessionOptions(window=8, colors=2).accepted().colors == 1
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from compression import Compression, compress_to_mapped_file, compresses, decompressor, validate_level
+from main import QRCodeCommunication
+
+TEXT = b"timestamp,level,message\n" + b"".join(b"%d,INFO,request %d served\n" % (i, i % 7) for i in range(5000))
+
+
+@pytest.mark.parametrize("compression", [Compression.zlib, Compression.lzma, Compression.bz2])
+def test_compress_to_mapped_file(compression):
+    compressed = compress_to_mapped_file(memoryview(TEXT), compression, 1)
+
+    assert len(compressed) < len(TEXT) / 5
+    assert decompressor(compression).decompress(bytes(compressed.content)) == TEXT
+
+    compressed.close()
+
+
+def test_compresses():
+    assert compresses(TEXT, Compression.zlib)
+    # Random bytes, like an already compressed file
+    assert not compresses(os.urandom(10000), Compression.zlib)
+    assert not compresses(b"", Compression.zlib)
+
+
+def test_no_compression():
+    with pytest.raises(ValueError):
+        decompressor(Compression.none)
+
+
+@pytest.mark.parametrize(
+    "compression, level", [(Compression.zlib, 20), (Compression.bz2, 0), (Compression.lzma, -1), (Compression.bz2, 10)]
+)
+def test_bad_level(tmp_path, compression, level):
+    with pytest.raises(ValueError):
+        validate_level(compression, level)
+
+    with pytest.raises(ValueError):
+        QRCodeCommunication(str(tmp_path), compression=compression, compression_level=level)
+
+
+def test_good_levels():
+    for compression in Compression:
+        validate_level(compression, None)
+    validate_level(Compression.zlib, 0)
+    validate_level(Compression.bz2, 9)
+    validate_level(Compression.none, 20)
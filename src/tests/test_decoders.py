@@ -0,0 +1,102 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from cv2 import cv2
+
+from decoders import (
+    BackendBenchmark,
+    CalibratingDecoder,
+    DecodedCode,
+    DecoderBackend,
+    QRDecoder,
+    available_backends,
+    calibrate,
+    choose_decoder,
+    create_decoder,
+)
+from tracking import RegionTracker
+from webcam import WebcamReader
+
+IMAGES = [f"images/{i}_qr_code.png" for i in range(1, 4)]
+
+
+def _decoders(pyzbar_codes: list, opencv_codes: list) -> dict:
+    return {
+        DecoderBackend.pyzbar: MagicMock(side_effect=pyzbar_codes),
+        DecoderBackend.opencv: MagicMock(side_effect=opencv_codes),
+    }
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_decode_with_backend(backend):
+    decoder = QRDecoder(backend)
+    frame = cv2.imread(IMAGES[0])
+
+    assert WebcamReader.parse_from_image(frame, cv2.COLOR_BGR2GRAY, decoder=decoder) == WebcamReader.parse_from_image(
+        frame, cv2.COLOR_BGR2GRAY
+    )
+    assert WebcamReader.parse_from_image(frame, cv2.COLOR_BGR2GRAY, RegionTracker(), decoder=decoder) is not None
+
+
+def test_fallback_on_misses():
+    code = DecodedCode(b"A", [])
+    decoders = _decoders([[], [code]], [[code]])
+
+    with patch.dict("decoders.DECODERS", decoders):
+        decoder = QRDecoder(DecoderBackend.pyzbar, DecoderBackend.opencv)
+
+        assert decoder.decode(None) == [code]
+        assert decoder.decode(None) == [code]
+
+    assert decoders[DecoderBackend.opencv].call_count == 1
+    assert (decoder.fallback_decodes, decoder.fallback_hits) == (1, 1)
+
+
+def test_choose_decoder():
+    slow = BackendBenchmark(DecoderBackend.pyzbar, frames=10, codes=20, reference_codes=20, seconds=1.0)
+    fast = BackendBenchmark(DecoderBackend.opencv, frames=10, codes=19, reference_codes=20, seconds=0.5)
+
+    decoder = choose_decoder([slow, fast], 0.9, fallback=True)
+    assert (decoder.backend, decoder.fallback) == (DecoderBackend.opencv, DecoderBackend.pyzbar)
+
+    # Below the decode rate, the faster backend doesn't qualify
+    decoder = choose_decoder([slow, fast], 0.99)
+    assert (decoder.backend, decoder.fallback) == (DecoderBackend.pyzbar, None)
+
+    assert choose_decoder([BackendBenchmark(DecoderBackend.pyzbar, frames=10, reference_codes=0)]) is None
+
+
+def test_calibrating_decoder():
+    code_a, code_b = DecodedCode(b"A", []), DecodedCode(b"B", [])
+    decoders = _decoders([[], [code_a], [code_a], [code_a]], [[], [code_a, code_b], [code_b], [code_a, code_b]])
+
+    with patch.dict("decoders.DECODERS", decoders):
+        decoder = CalibratingDecoder(2, fallback=True, backends=[DecoderBackend.pyzbar, DecoderBackend.opencv])
+
+        # What any backend read, frames without codes are not counted
+        assert decoder.decode(None) == []
+        assert decoder.decode(None) == [code_a, code_b]
+        assert decoder.decoder is None
+        assert decoder.decode(None) == [code_a, code_b]
+
+        # Only opencv read every code
+        assert (decoder.decoder.backend, decoder.decoder.fallback) == (DecoderBackend.opencv, DecoderBackend.pyzbar)
+        assert decoder.decode(None) == [code_a, code_b]
+
+    assert [benchmark.codes for benchmark in decoder.benchmarks] == [2, 3]
+    assert decoders[DecoderBackend.pyzbar].call_count == 3
+
+
+def test_calibrate_on_images():
+    decoder, benchmarks = calibrate([cv2.imread(path, cv2.IMREAD_GRAYSCALE) for path in IMAGES])
+
+    assert decoder is not None and decoder.backend in available_backends()
+    assert max(benchmark.codes for benchmark in benchmarks) == len(IMAGES)
+
+
+def test_create_decoder():
+    assert isinstance(create_decoder("auto"), CalibratingDecoder)
+    assert create_decoder("opencv").backend == DecoderBackend.opencv
+
+    with pytest.raises(ValueError):
+        create_decoder("zxing")
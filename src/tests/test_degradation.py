@@ -0,0 +1,38 @@
+import numpy
+from cv2 import cv2
+
+from degradation import Degradation, place_on_frame
+from protocol import RequestHeader, RequestType
+from webcam import WebcamReader
+
+
+def test_place_on_frame(qr_creator):
+    code = qr_creator.create(b"ABCD", box_size=3)
+    frame = place_on_frame(code, (480, 640), left=600, top=10)
+
+    assert frame.shape == (480, 640)
+    assert frame[0, 0] == 180
+    assert (frame[10 : 10 + code.shape[0], 600:] == code[:, :40]).all()
+
+
+def test_degradations_keep_the_code_readable(qr_creator):
+    header = RequestHeader(request_type=RequestType.send_data, sequence_number=0)
+    header.add_payload(b"ABCD" * 10)
+    data = header.build() + b"ABCD" * 10
+
+    code = cv2.cvtColor(qr_creator.create(data, box_size=4), cv2.COLOR_GRAY2BGR)
+    frame = place_on_frame(code, left=100, top=50)
+
+    for degradation in [Degradation(noise=10), Degradation(blur=3), Degradation(perspective=0.05)]:
+        degraded = degradation.apply(frame, numpy.random.default_rng(0))
+
+        assert degraded.shape == frame.shape
+        assert degraded.dtype == numpy.uint8
+        assert not (degraded == frame).all()
+        assert WebcamReader.parse_from_image(degraded, cv2.COLOR_BGR2GRAY) == data
+
+
+def test_no_degradation():
+    frame = numpy.full((10, 10), 255, dtype=numpy.uint8)
+
+    assert Degradation().apply(frame, numpy.random.default_rng(0)) is frame
@@ -0,0 +1,94 @@
+import itertools
+import os
+
+import numpy
+import pytest
+
+from chunking import ContentChunks
+from fec import BlockCode, FecChunks, FecReception, build_parity_payload, parse_parity_payload
+from reception import ReceivedFile
+from session import SessionOptions
+
+CONTENT = bytes(range(256)) * 4
+
+
+def test_block_code_any_erasures():
+    code = BlockCode(5, 3)
+    data = numpy.random.default_rng(0).integers(0, 256, (5, 20), dtype=numpy.uint8)
+    parity = code.encode(data)
+
+    for lost in range(1, 4):
+        for missing in itertools.combinations(range(5), lost):
+            for rows in itertools.combinations(range(3), lost):
+                recovered = code.decode(data, list(missing), {row: parity[row].tobytes() for row in rows})
+
+                assert (recovered == data[list(missing)]).all()
+
+
+def test_block_code_not_enough_parity():
+    code = BlockCode(4, 2)
+    data = numpy.zeros((4, 10), dtype=numpy.uint8)
+
+    with pytest.raises(ValueError):
+        code.decode(data, [0, 1], {0: bytes(10)})
+
+
+@pytest.mark.parametrize("data_chunks, parity_chunks", [(0, 2), (4, 0), (200, 56)])
+def test_bad_block_code(data_chunks, parity_chunks):
+    with pytest.raises(ValueError):
+        BlockCode(data_chunks, parity_chunks)
+
+
+def test_parity_payload_round_trip():
+    assert parse_parity_payload(build_parity_payload(1000, b"ABCD")) == (1000, b"ABCD")
+
+    with pytest.raises(ValueError):
+        parse_parity_payload(b"\x01\x02\x03\x04")
+
+
+def test_window_symbols():
+    fec_chunks = FecChunks(ContentChunks(CONTENT, 100), 4, 2)
+
+    # Block 0 is in the window, block 1 is not yet
+    assert fec_chunks.window_symbols([1, 3, 4, 5], 6) == [1, 3, -1, -2, 4, 5]
+    # The last block has 3 chunks
+    assert fec_chunks.window_symbols([8, 10], 11) == [8, 10, -5, -6]
+    assert sorted([0, 3, 4, -1, -2, -3], key=fec_chunks.order) == [0, 3, -1, -2, 4, -3]
+
+
+@pytest.mark.parametrize("lost", [[1], [0, 3], [9, 10], [8, 10]])
+def test_recover_block(tmp_path, lost):
+    chunks = ContentChunks(CONTENT, 100)
+    fec_chunks = FecChunks(chunks, 4, 2)
+    fec_reception = FecReception(4, 2, 100)
+    received_file = ReceivedFile(str(tmp_path), 100)
+
+    for sequence in range(len(chunks)):
+        if sequence not in lost:
+            received_file.add(sequence, bytes(chunks[sequence]))
+
+    block = fec_reception.block(lost[0])
+    assert fec_reception.recover(block, received_file) == []
+
+    for parity_id in fec_chunks.parity_ids(block):
+        assert fec_reception.add_parity(parity_id, fec_chunks.payload(parity_id)) == block
+
+    assert fec_reception.recover(block, received_file) == lost
+    # Already rebuilt
+    assert fec_reception.add_parity(block * 2, fec_chunks.payload(block * 2)) is None
+
+    path = os.path.join(str(tmp_path), "received.bin")
+    received_file.save(path)
+    with open(path, "rb") as fp:
+        assert fp.read() == CONTENT
+
+
+def test_fec_options():
+    offered = SessionOptions(window=8, chunk_size=150, fec_data=16, fec_parity=4)
+
+    assert offered.accepted() == offered
+    assert offered.agreed(offered.accepted()) == offered
+    assert offered.agreed(SessionOptions(window=8, chunk_size=150)).fec_data == 0
+    assert SessionOptions(window=1, chunk_size=150, fec_data=16, fec_parity=4).accepted().fec_data == 0
+    assert SessionOptions(window=8, chunk_size=0, fec_data=16, fec_parity=4).accepted().fec_parity == 0
+    assert SessionOptions(window=8, chunk_size=150, fec_data=250, fec_parity=10).accepted().fec_data == 0
@@ -1,11 +1,35 @@
+import asyncio
+import random
 import time
-from datetime import datetime
+import zlib
+from datetime import datetime, timedelta
+from functools import partial
 from unittest.mock import patch, MagicMock, mock_open as MockOpen
 
+import pytest
+import qrcode.constants
 from cv2 import cv2
 
-from protocol import RequestHeader, RequestType
-from tests.conftest import parse_image
+from adaptive import AdaptiveController
+from batch import BatchFile, build_manifest
+from chunking import ContentChunks
+from compression import Compression
+from fec import FecChunks
+from fountain import BroadcastInfo, FountainEncoder
+from main import NUM_BYTES_PER_MESSAGE, Status
+from payload_encoding import PayloadEncoding
+from protocol import (
+    HEADER_LENGTH,
+    RequestHeader,
+    RequestType,
+    build_ack_payload,
+    build_duplex_payload,
+    build_nack_payload,
+    calculate_hash,
+)
+from rtt import RttEstimator
+from session import SessionOptions
+from tests.conftest import parse_image, received_files
 from webcam import WebcamReader
 
 
@@ -42,9 +66,11 @@ def test_happy_flow_listener(qr_code_communation_mock, webcam_reader_mock):
         except StopIteration:
             pass
 
-    assert mock_open.call_args_list[0][0][0].startswith("received-files\\File-")
-    assert mock_open.call_args_list[0][0][0].endswith(".png")
-    assert mock_open.call_args_list[0][0][1] == "wb"
+    files = received_files(qr_code_communation_mock._received_files_folder)
+    assert len(files) == 1
+    file_name = next(iter(files))
+    assert file_name.startswith("File-")
+    assert file_name.endswith(".png")
 
     assert len(qr_code_communation_mock._qr_code_creator.responses) == 3
 
@@ -114,9 +140,11 @@ def test_flow_with_repeat_listener(qr_code_communation_mock, webcam_reader_mock,
         except StopIteration:
             pass
 
-    assert mock_open.call_args_list[0][0][0].startswith("received-files\\File-")
-    assert mock_open.call_args_list[0][0][0].endswith(".png")
-    assert mock_open.call_args_list[0][0][1] == "wb"
+    files = received_files(qr_code_communation_mock._received_files_folder)
+    assert len(files) == 1
+    file_name = next(iter(files))
+    assert file_name.startswith("File-")
+    assert file_name.endswith(".png")
 
     assert len(qr_code_communation_mock._qr_code_creator.responses) == 4
 
@@ -193,7 +221,7 @@ def test_happy_flow_sender(qr_code_communation_mock, webcam_reader_mock, qr_crea
     mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
 
     with patch("main.WebcamReader", Test3), patch("main.open", mock_open), patch("main.os.remove", MagicMock), patch(
-        "main.glob", mock_glob
+        "outbox.glob", mock_glob
     ):
         try:
             qr_code_communation_mock.start()
@@ -280,7 +308,7 @@ def test_happy_flow_sender_repeat(qr_code_communation_mock, webcam_reader_mock,
     mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
 
     with patch("main.WebcamReader", Test4), patch("main.open", mock_open), patch("main.os.remove", MagicMock), patch(
-        "main.glob", mock_glob
+        "outbox.glob", mock_glob
     ):
         try:
             qr_code_communation_mock.start()
@@ -401,7 +429,7 @@ def test_flow_sender_timeout_and_start_again(qr_code_communation_mock, webcam_re
     mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
 
     with patch("main.WebcamReader", Test5), patch("main.open", mock_open), patch("main.os.remove", MagicMock), patch(
-        "main.glob", mock_glob
+        "outbox.glob", mock_glob
     ), patch("main.time.sleep", MagicMock):
         try:
             qr_code_communation_mock.start()
@@ -545,8 +573,11 @@ def test_flow_listener_timeout_and_start_again(qr_code_communation_mock, webcam_
         except StopIteration:
             pass
 
-    assert mock_open.call_args_list[0][0][0].startswith("received-files\\File")
-    assert mock_open.call_args_list[0][0][0].endswith(".txt")
+    files = received_files(qr_code_communation_mock._received_files_folder)
+    assert len(files) == 1
+    file_name = next(iter(files))
+    assert file_name.startswith("File-")
+    assert files[file_name] == b"ABCDEFG"
 
     assert len(qr_code_communation_mock._qr_code_creator.responses) == 5
 
@@ -660,3 +691,1263 @@ def test_flow_listener_bad_header_version(qr_code_communation_mock, webcam_reade
 
     assert mock_open.call_args_list == []
     assert len(qr_code_communation_mock._qr_code_creator.responses) == 0
+
+
+def test_window_flow_sender(qr_code_communation_mock, webcam_reader_mock):
+    qr_code_communation_mock._options = SessionOptions(window=4)
+
+    qr_codes = []
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0), b"window=4"),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=1), build_ack_payload(0, [1])),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=0), build_ack_payload(2, [0])),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=2), build_ack_payload(3, [2])),
+        (RequestHeader(request_type=RequestType.confirm_finish, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test8(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None] + qr_codes)
+
+    mock_open = MockOpen(read_data=b"ABCD" * 100)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
+
+    with patch("main.WebcamReader", Test8), patch("main.open", mock_open), patch("main.os.remove", MagicMock), patch(
+        "outbox.glob", mock_glob
+    ), patch("main.WINDOW_FRAME_INTERVAL", timedelta(hours=1)):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    expected_requests = [
+        (RequestType.start_connection, 0, b".txt?window=4"),
+        (RequestType.send_data, 0, (b"ABCD" * 100)[:150]),
+        # Chunk 1 was acknowledged out of order, so the next one to show is 2
+        (RequestType.send_data, 2, (b"ABCD" * 100)[300:]),
+        (RequestType.finish, 0, b""),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+
+    for response, (request_type, sequence_number, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_requests
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_header.sequence_number == sequence_number
+        assert parsed_payload == expected_payload
+
+
+def test_window_progress_flow_sender(qr_code_communation_mock, webcam_reader_mock):
+    qr_code_communation_mock._options = SessionOptions(window=4)
+
+    qr_codes = [None]
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0), b"window=4"),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=1), build_ack_payload(0, [1])),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=2), build_ack_payload(0, [2])),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=3), build_ack_payload(0, [3])),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=0), build_ack_payload(4, [0])),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    def capture(*_, **__):
+        # Slower than the waiting timeout in total, every acknowledgement is of a chunk that isn't displayed
+        time.sleep(0.1)
+
+        return qr_codes.pop(0) if qr_codes else next(iter([]))
+
+    class Test32(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=capture)
+
+    mock_open = MockOpen(read_data=b"ABCD" * 150)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
+
+    with patch("main.WebcamReader", Test32), patch("main.open", mock_open), patch("main.os.remove", MagicMock), patch(
+        "outbox.glob", mock_glob
+    ), patch("main.WINDOW_FRAME_INTERVAL", timedelta(hours=1)), patch("main.WAITING_TIMEOUT_SECONDS", 0.25), patch(
+        "main.TIMEOUT_PAUSE_SECONDS", 0
+    ):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    # The acknowledgements kept the session alive
+    assert qr_code_communation_mock._status == Status.finished
+
+
+def test_window_flow_listener(qr_code_communation_mock, webcam_reader_mock):
+    qr_codes = []
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.start_connection, sequence_number=0), b".txt?window=4&chunk_size=3"),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=1), b"DEF"),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=0), b"ABC"),
+        (RequestHeader(request_type=RequestType.finish, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test9(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=qr_codes)
+
+    mock_open = MagicMock()
+
+    with patch("main.WebcamReader", Test9), patch("main.open", mock_open), patch("main.os.mkdir", MagicMock):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    assert list(received_files(qr_code_communation_mock._received_files_folder).values()) == [b"ABCDEF"]
+
+    expected_responses = [
+        (RequestType.confirm_connection, 0, b"window=4&chunk_size=3"),
+        (RequestType.confirm_data, 1, build_ack_payload(0, [1])),
+        (RequestType.confirm_data, 0, build_ack_payload(2, [0])),
+        (RequestType.confirm_finish, 0, b""),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_responses)
+
+    for response, (request_type, sequence_number, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_responses
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_header.sequence_number == sequence_number
+        assert parsed_payload == expected_payload
+
+
+def test_missing_sequences_flow_listener(qr_code_communation_mock, webcam_reader_mock):
+    qr_codes = []
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.start_connection, sequence_number=0), b".txt?window=4&chunk_size=3"),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=0), b"ABC"),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=2), b"GHI"),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=5), b"PQR"),
+        (RequestHeader(request_type=RequestType.finish, sequence_number=0), b""),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=1), b"DEF"),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=3), b"JKL"),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=4), b"MNO"),
+        (RequestHeader(request_type=RequestType.finish, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test27(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=qr_codes)
+
+    with patch("main.WebcamReader", Test27):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    assert list(received_files(qr_code_communation_mock._received_files_folder).values()) == [b"ABCDEFGHIJKLMNOPQR"]
+
+    # Every gap is asked for at once
+    missing = qr_code_communation_mock._qr_code_creator.responses[4]
+    parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=missing, mode=5)
+
+    assert parsed_header.request_type == RequestType.repeat_data
+    assert parsed_header.sequence_number == 1
+    assert parsed_payload == build_nack_payload([(1, 1), (3, 2)])
+
+    parsed_header, _ = parse_image(
+        webcam_reader_mock, image=qr_code_communation_mock._qr_code_creator.responses[-1], mode=5
+    )
+    assert parsed_header.request_type == RequestType.confirm_finish
+
+
+def test_missing_sequences_flow_sender(qr_code_communation_mock, webcam_reader_mock):
+    qr_codes = []
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0), b""),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=0), b""),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=1), b""),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=2), b""),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=3), b""),
+        (RequestHeader(request_type=RequestType.repeat_data, sequence_number=0), build_nack_payload([(0, 1), (2, 1)])),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=0), b""),
+        # Stale, chunk 2 is still missing
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=0), b""),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=2), b""),
+        (RequestHeader(request_type=RequestType.confirm_finish, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test28(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None] + qr_codes)
+
+    content = bytes(range(150)) * 4
+    mock_open = MockOpen(read_data=content)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
+    mock_remove = MagicMock()
+
+    with patch("main.WebcamReader", Test28), patch("main.open", mock_open), patch("main.os.remove", mock_remove), patch(
+        "outbox.glob", mock_glob
+    ):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    mock_remove.assert_called_once_with("file_to_send.txt")
+
+    expected_requests = [
+        (RequestType.start_connection, 0),
+        (RequestType.send_data, 0),
+        (RequestType.send_data, 1),
+        (RequestType.send_data, 2),
+        (RequestType.send_data, 3),
+        (RequestType.finish, 0),
+        # Only the missing chunks are sent again
+        (RequestType.send_data, 0),
+        (RequestType.send_data, 2),
+        (RequestType.finish, 0),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+
+    for response, (request_type, sequence_number) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_requests
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_header.sequence_number == sequence_number
+        if request_type == RequestType.send_data:
+            assert parsed_payload == content[sequence_number * 150 : (sequence_number + 1) * 150]
+
+
+def test_broadcast_flow_listener(qr_code_communation_mock, webcam_reader_mock):
+    content = b"ABCDEFGHIJ" * 40
+    chunks = qr_code_communation_mock._split_content_to_byte_array(content)
+    encoder = FountainEncoder(chunks, BroadcastInfo(1, len(content), NUM_BYTES_PER_MESSAGE, ".txt"))
+
+    qr_codes = []
+
+    # Only coded symbols, nothing is ever answered
+    for symbol_id in range(encoder.num_chunks, encoder.num_chunks * 10):
+        rh = RequestHeader(request_type=RequestType.fountain_data, sequence_number=symbol_id)
+        payload = encoder.payload(symbol_id)
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test10(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=qr_codes)
+
+    mock_open = MagicMock()
+
+    with patch("main.WebcamReader", Test10), patch("main.open", mock_open), patch("main.os.mkdir", MagicMock):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    assert mock_open.call_count == 1
+    assert mock_open.call_args_list[0][0][0].endswith(".txt")
+    mock_open.return_value.write.assert_called_once_with(content)
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == 0
+
+
+def test_broadcast_flow_sender(qr_code_communation_mock, webcam_reader_mock):
+    qr_code_communation_mock._broadcast = True
+
+    class Test30(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None] * 20)
+
+    content = b"ABCD" * 100
+    mock_open = MockOpen(read_data=content)
+    mock_remove = MagicMock()
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
+
+    with patch("main.WebcamReader", Test30), patch("main.open", mock_open), patch("main.os.remove", mock_remove), patch(
+        "outbox.glob", mock_glob
+    ), patch("main.BROADCAST_FRAME_INTERVAL", timedelta(0)):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    # num_chunks * overhead symbols, then the file is removed so that it isn't broadcast again
+    num_chunks = len(qr_code_communation_mock._split_content_to_byte_array(content))
+    responses = qr_code_communation_mock._qr_code_creator.responses
+    assert len(responses) == num_chunks * 2
+
+    for symbol_id, response in enumerate(responses):
+        parsed_header, _ = parse_image(webcam_reader_mock, image=response, mode=5)
+        assert parsed_header.request_type == RequestType.fountain_data
+        assert parsed_header.sequence_number == symbol_id
+
+    mock_remove.assert_called_once_with("file_to_send.txt")
+    assert qr_code_communation_mock._status == Status.waiting
+
+
+def test_tiled_window_flow_listener(qr_code_communation_mock, webcam_reader_mock):
+    messages = []
+
+    for rh, payload in [
+        (
+            RequestHeader(request_type=RequestType.start_connection, sequence_number=0),
+            b".txt?window=4&tiles=2&chunk_size=3",
+        ),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=0), b"ABC"),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=1), b"DEF"),
+        (RequestHeader(request_type=RequestType.finish, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        messages.append(rh.build() + payload)
+
+    class Test11(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[messages[0]])
+            # Both chunks arrive in the same captured frame
+            self.capture_all = MagicMock(side_effect=[[messages[1], messages[2]], [messages[3]]])
+
+    mock_open = MagicMock()
+
+    with patch("main.WebcamReader", Test11), patch("main.open", mock_open), patch("main.os.mkdir", MagicMock):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    assert list(received_files(qr_code_communation_mock._received_files_folder).values()) == [b"ABCDEF"]
+
+    expected_responses = [
+        (RequestType.confirm_connection, 0, b"window=4&tiles=2&chunk_size=3"),
+        (RequestType.confirm_data, 1, build_ack_payload(2, [0, 1])),
+        (RequestType.confirm_finish, 0, b""),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_responses)
+
+    for response, (request_type, sequence_number, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_responses
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_header.sequence_number == sequence_number
+        assert parsed_payload == expected_payload
+
+
+def test_adaptive_flow_sender(qr_code_communation_mock, webcam_reader_mock):
+    qr_code_communation_mock._adaptive_enabled = True
+
+    qr_codes = []
+
+    for rh in [
+        RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0),
+        RequestHeader(request_type=RequestType.confirm_data, sequence_number=0),
+        RequestHeader(request_type=RequestType.repeat_data, sequence_number=1),
+        RequestHeader(request_type=RequestType.confirm_data, sequence_number=1),
+    ]:
+        rh.add_payload(b"")
+        qr_codes.append(rh.build())
+
+    class Test12(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None] + qr_codes)
+
+    content = bytes(range(256)) * 4
+    mock_open = MockOpen(read_data=content)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
+
+    with patch("main.WebcamReader", Test12), patch("main.open", mock_open), patch("main.os.remove", MagicMock), patch(
+        "outbox.glob", mock_glob
+    ):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    expected_requests = [
+        (RequestType.start_connection, 0, b".txt?chunk_size=0"),
+        (RequestType.send_data, 0, content[:150]),
+        # Acknowledged, the next chunk grows
+        (RequestType.send_data, 1, content[150:332]),
+        # Repeated chunks keep their bounds, the chunks after them shrink
+        (RequestType.send_data, 1, content[150:332]),
+        (RequestType.send_data, 2, content[332:455]),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+
+    for response, (request_type, sequence_number, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_requests
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_header.sequence_number == sequence_number
+        assert parsed_payload == expected_payload
+
+
+def test_adaptive_repeat_after_raise_flow_sender(qr_code_communation_mock, webcam_reader_mock):
+    qr_code_communation_mock._adaptive_enabled = True
+
+    qr_codes = []
+
+    for rh in [
+        RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0),
+        RequestHeader(request_type=RequestType.confirm_data, sequence_number=0),
+        RequestHeader(request_type=RequestType.repeat_data, sequence_number=1),
+        RequestHeader(request_type=RequestType.confirm_data, sequence_number=1),
+    ]:
+        rh.add_payload(b"")
+        qr_codes.append(rh.build())
+
+    class Test31(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None] + qr_codes)
+
+    content = bytes(range(256)) * 12
+    mock_open = MockOpen(read_data=content)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
+    creator = qr_code_communation_mock._qr_code_creator
+    # From the level with the most capacity, a single repeat raises it
+    controller = partial(
+        AdaptiveController,
+        error_correction_level=qrcode.constants.ERROR_CORRECT_L,
+        increase_step=4096,
+        failures_to_raise_level=1,
+    )
+
+    with patch("main.WebcamReader", Test31), patch("main.open", mock_open), patch(
+        "main.AdaptiveController", controller
+    ), patch("outbox.glob", mock_glob), patch.object(creator, "create", wraps=creator.create) as create_mock:
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    data_frames = [
+        (header.sequence_number, header.payload_length, call.kwargs["error_correction_level"])
+        for call in create_mock.call_args_list[1:]
+        for header in [RequestHeader.parse(call.args[0][:HEADER_LENGTH])]
+    ]
+
+    # The chunk sized for level L is repeated at L, the chunks after it are sized for M
+    level_l, level_m = qrcode.constants.ERROR_CORRECT_L, qrcode.constants.ERROR_CORRECT_M
+    assert data_frames == [(0, 150, level_l), (1, 2196, level_l), (1, 2196, level_l), (2, 726, level_m)]
+
+
+@pytest.mark.parametrize("encoding", [PayloadEncoding.base45, PayloadEncoding.binary])
+def test_encoding_flow_sender(qr_code_communation_mock, webcam_reader_mock, encoding):
+    qr_code_communation_mock._options = SessionOptions(encoding=encoding)
+
+    qr_codes = []
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0), f"encoding={encoding.value}"),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=0), ""),
+        (RequestHeader(request_type=RequestType.confirm_finish, sequence_number=0), ""),
+    ]:
+        rh.add_payload(payload.encode())
+        qr_codes.append(rh.build() + payload.encode())
+
+    class Test13(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None] + qr_codes)
+
+    content = bytes(range(150))
+    mock_open = MockOpen(read_data=content)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
+
+    with patch("main.WebcamReader", Test13), patch("main.open", mock_open), patch("main.os.remove", MagicMock), patch(
+        "outbox.glob", mock_glob
+    ):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    expected_requests = [
+        (RequestType.start_connection, 0, f".txt?encoding={encoding.value}".encode(), PayloadEncoding.base64),
+        (RequestType.send_data, 0, content, encoding),
+        (RequestType.finish, 0, b"", PayloadEncoding.base64),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+    assert qr_code_communation_mock._qr_code_creator.encodings == [e for _, _, _, e in expected_requests]
+
+    for response, (request_type, sequence_number, expected_payload, _) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_requests
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_header.sequence_number == sequence_number
+        assert parsed_payload == expected_payload
+
+
+def test_render_ahead_flow_sender(qr_code_communation_mock, webcam_reader_mock):
+    qr_codes = []
+
+    for rh in [
+        RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0),
+        RequestHeader(request_type=RequestType.confirm_data, sequence_number=0),
+        RequestHeader(request_type=RequestType.repeat_data, sequence_number=1),
+        RequestHeader(request_type=RequestType.confirm_data, sequence_number=1),
+    ]:
+        rh.add_payload(b"")
+        qr_codes.append(rh.build())
+
+    class Test14(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None] + qr_codes)
+
+    content = bytes(range(256)) * 2
+    mock_open = MockOpen(read_data=content)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
+    creator = qr_code_communation_mock._qr_code_creator
+    prerender_mock = MagicMock(wraps=creator.prerender)
+
+    with patch("main.WebcamReader", Test14), patch("main.open", mock_open), patch(
+        "outbox.glob", mock_glob
+    ), patch.object(creator, "prerender", prerender_mock), patch.object(
+        creator, "_create", wraps=creator._create
+    ) as create_mock:
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+        creator._render_executor.shutdown(wait=True)
+
+    # The next data frames are rendered ahead while the current one is shown
+    assert [len(call.args[0]) for call in prerender_mock.call_args_list] == [2, 2, 2, 1]
+    assert prerender_mock.call_args_list[0].args[0][0][-NUM_BYTES_PER_MESSAGE:] == content[150:300]
+
+    # The repeated chunk is not rendered again, the last chunk was rendered ahead but not shown yet
+    assert len(creator.responses) == 5
+    assert create_mock.call_count == 5
+    assert creator.responses[3] is creator.responses[2]
+
+
+def test_version_2_flow_sender(qr_code_communation_mock, webcam_reader_mock):
+    qr_code_communation_mock._options = SessionOptions(version=2)
+
+    qr_codes = []
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0, version=2), b"version=2"),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=0, version=2), b""),
+        (RequestHeader(request_type=RequestType.confirm_finish, sequence_number=0, version=2), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test15(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None] + qr_codes)
+
+    content = b"ABCD" * 10
+    mock_open = MockOpen(read_data=content)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
+
+    with patch("main.WebcamReader", Test15), patch("main.open", mock_open), patch("main.os.remove", MagicMock), patch(
+        "outbox.glob", mock_glob
+    ):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    expected_requests = [
+        (RequestType.start_connection, 1, b".txt?version=2"),
+        (RequestType.send_data, 2, content),
+        (RequestType.finish, 2, b""),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+
+    for response, (request_type, version, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_requests
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_header.version == version
+        assert parsed_header.checksum == calculate_hash(
+            version, request_type, parsed_header.sequence_number, parsed_payload
+        )
+        assert parsed_payload == expected_payload
+
+
+def test_version_2_flow_listener(qr_code_communation_mock, webcam_reader_mock):
+    qr_codes = []
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.start_connection, sequence_number=0), b".txt?version=2"),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=0, version=2), b"ABCD"),
+        (RequestHeader(request_type=RequestType.finish, sequence_number=0, version=2), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test16(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=qr_codes)
+
+    mock_open = MagicMock()
+
+    with patch("main.WebcamReader", Test16), patch("main.open", mock_open), patch("main.os.mkdir", MagicMock):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    assert list(received_files(qr_code_communation_mock._received_files_folder).values()) == [b"ABCD"]
+
+    expected_requests = [
+        (RequestType.confirm_connection, b"version=2"),
+        (RequestType.confirm_data, b""),
+        (RequestType.confirm_finish, b""),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+
+    for response, (request_type, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_requests
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_header.version == 2
+        assert parsed_payload == expected_payload
+
+
+def test_finish_confirmed_again_flow_listener(qr_code_communation_mock, webcam_reader_mock):
+    qr_codes = []
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.start_connection, sequence_number=0), b".txt"),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=0), b"ABCD"),
+        (RequestHeader(request_type=RequestType.finish, sequence_number=0), b""),
+        (None, None),
+        (RequestHeader(request_type=RequestType.finish, sequence_number=0), b""),
+    ]:
+        if rh is None:
+            qr_codes.append(None)
+            continue
+
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test23(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=qr_codes)
+
+    with patch("main.WebcamReader", Test23):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    # The file is saved once, the sender missed the confirmation and gets it again
+    assert list(received_files(qr_code_communation_mock._received_files_folder).values()) == [b"ABCD"]
+
+    expected_requests = [
+        RequestType.confirm_connection,
+        RequestType.confirm_data,
+        RequestType.confirm_finish,
+        RequestType.confirm_finish,
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+
+    for response, request_type in zip(qr_code_communation_mock._qr_code_creator.responses, expected_requests):
+        parsed_header, _ = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+
+
+def test_batch_flow_sender(qr_code_communation_mock, webcam_reader_mock):
+    qr_code_communation_mock._batch_enabled = True
+
+    content = b"ABCD" * 10
+    manifest = build_manifest([BatchFile("a.txt", len(content)), BatchFile("b.png", len(content))])
+    batch_option = f"batch={len(manifest)}".encode()
+
+    qr_codes = []
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0), batch_option),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=0), b""),
+        (RequestHeader(request_type=RequestType.confirm_finish, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test17(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None] + qr_codes)
+
+    mock_open = MockOpen(read_data=content)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["send-files/b.png", "send-files/a.txt"]))
+    mock_remove = MagicMock()
+
+    with patch("main.WebcamReader", Test17), patch("main.open", mock_open), patch("main.os.remove", mock_remove), patch(
+        "outbox.glob", mock_glob
+    ):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    assert [call[0][0] for call in mock_remove.call_args_list] == ["send-files/a.txt", "send-files/b.png"]
+
+    expected_requests = [
+        (RequestType.start_connection, 0, b"?" + batch_option),
+        (RequestType.send_data, 0, manifest + content * 2),
+        (RequestType.finish, 0, b""),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+
+    for response, (request_type, sequence_number, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_requests
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_header.sequence_number == sequence_number
+        assert parsed_payload == expected_payload
+
+
+def test_batch_not_supported_flow_sender(qr_code_communation_mock, webcam_reader_mock):
+    qr_code_communation_mock._batch_enabled = True
+
+    qr_codes = []
+
+    for rh in [
+        # A receiver that doesn't know the batch option
+        RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0),
+        RequestHeader(request_type=RequestType.confirm_finish, sequence_number=0),
+    ]:
+        rh.add_payload(b"")
+        qr_codes.append(rh.build())
+
+    class Test18(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None] + qr_codes + [None])
+
+    mock_open = MockOpen(read_data=b"ABCD")
+    mock_glob = MagicMock(glob=MagicMock(return_value=["send-files/a.txt", "send-files/b.png"]))
+    mock_remove = MagicMock()
+
+    with patch("main.WebcamReader", Test18), patch("main.open", mock_open), patch("main.os.remove", mock_remove), patch(
+        "outbox.glob", mock_glob
+    ):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    mock_remove.assert_not_called()
+
+    expected_requests = [
+        (RequestType.start_connection, b"?batch=30"),
+        (RequestType.finish, b""),
+        # The files are sent one by one
+        (RequestType.start_connection, b".txt"),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+
+    for response, (request_type, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_requests
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_payload == expected_payload
+
+
+def test_batch_flow_listener(qr_code_communation_mock, webcam_reader_mock):
+    files = {"a.txt": b"ABCD" * 50, "b.png": b"EFGH" * 10}
+    manifest = build_manifest([BatchFile(name, len(content)) for name, content in files.items()])
+    content = manifest + b"".join(files.values())
+
+    qr_codes = []
+
+    for rh, payload in [
+        (
+            RequestHeader(request_type=RequestType.start_connection, sequence_number=0),
+            f"?batch={len(manifest)}".encode(),
+        ),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=0), content[:150]),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=1), content[150:]),
+        (RequestHeader(request_type=RequestType.finish, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test19(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=qr_codes)
+
+    with patch("main.WebcamReader", Test19):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    assert received_files(qr_code_communation_mock._received_files_folder) == files
+
+    expected_responses = [
+        (RequestType.confirm_connection, f"batch={len(manifest)}".encode()),
+        (RequestType.confirm_data, b""),
+        (RequestType.confirm_data, b""),
+        (RequestType.confirm_finish, b""),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_responses)
+
+    for response, (request_type, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_responses
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_payload == expected_payload
+
+
+@pytest.mark.parametrize("accepted", [True, False])
+def test_compression_flow_sender(qr_code_communation_mock, webcam_reader_mock, accepted):
+    qr_code_communation_mock._options = SessionOptions(compression=Compression.zlib)
+
+    content = b"ABCD" * 100
+    rh = RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0)
+    payload = b"compression=zlib" if accepted else b""
+    rh.add_payload(payload)
+
+    class Test20(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None, rh.build() + payload])
+
+    mock_open = MockOpen(read_data=content)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
+
+    with patch("main.WebcamReader", Test20), patch("main.open", mock_open), patch("outbox.glob", mock_glob):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    expected_requests = [
+        (RequestType.start_connection, b".txt?compression=zlib"),
+        # The content as is when the receiver doesn't support the compression
+        (RequestType.send_data, zlib.compress(content) if accepted else content[:150]),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+
+    for response, (request_type, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_requests
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_payload == expected_payload
+
+
+def test_incompressible_flow_sender(qr_code_communation_mock, webcam_reader_mock):
+    qr_code_communation_mock._options = SessionOptions(compression=Compression.zlib)
+
+    class Test21(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None])
+
+    mock_open = MockOpen(read_data=random.Random(0).randbytes(400))
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.png"]))
+
+    with patch("main.WebcamReader", Test21), patch("main.open", mock_open), patch("outbox.glob", mock_glob):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == 1
+
+    parsed_header, parsed_payload = parse_image(
+        webcam_reader_mock, image=qr_code_communation_mock._qr_code_creator.responses[0], mode=5
+    )
+
+    assert parsed_header.request_type == RequestType.start_connection
+    assert parsed_payload == b".png"
+
+
+def test_compression_flow_listener(qr_code_communation_mock, webcam_reader_mock):
+    content = b"ABCDEFGH" * 500
+    compressed = zlib.compress(content)
+
+    qr_codes = []
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.start_connection, sequence_number=0), b".txt?compression=zlib"),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=0), compressed),
+        (RequestHeader(request_type=RequestType.finish, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test22(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=qr_codes)
+
+    with patch("main.WebcamReader", Test22):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    assert list(received_files(qr_code_communation_mock._received_files_folder).values()) == [content]
+
+    parsed_header, parsed_payload = parse_image(
+        webcam_reader_mock, image=qr_code_communation_mock._qr_code_creator.responses[0], mode=5
+    )
+
+    assert parsed_header.request_type == RequestType.confirm_connection
+    assert parsed_payload == b"compression=zlib"
+
+
+def _duplex_frame(sequence: int, next_missing: int, chunk: bytes) -> tuple[RequestHeader, bytes]:
+    return RequestHeader(request_type=RequestType.duplex_data, sequence_number=sequence), build_duplex_payload(
+        next_missing, chunk
+    )
+
+
+def test_duplex_flow_sender(qr_code_communation_mock, webcam_reader_mock):
+    qr_code_communation_mock._duplex_enabled = True
+
+    content = b"ABCD" * 50
+    qr_codes = []
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0), b"duplex=1&suffix=.png"),
+        # The receiver acknowledges the first chunk and sends its whole file
+        _duplex_frame(0, 1, b"WXYZ"),
+        # Then its file was acknowledged, and the second chunk
+        _duplex_frame(1, 2, b""),
+        (RequestHeader(request_type=RequestType.confirm_finish, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test24(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None] + qr_codes)
+
+    mock_open = MockOpen(read_data=content)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["send-files/a.txt"]))
+    mock_remove = MagicMock()
+
+    with patch("main.WebcamReader", Test24), patch("main.open", mock_open), patch("main.os.remove", mock_remove), patch(
+        "outbox.glob", mock_glob
+    ), patch("main.random.getrandbits", return_value=6):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    mock_remove.assert_called_once_with("send-files/a.txt")
+
+    files = received_files(qr_code_communation_mock._received_files_folder)
+    assert list(files.values()) == [b"WXYZ"]
+    assert next(iter(files)).endswith(".png")
+
+    expected_requests = [
+        (RequestType.start_connection, 0, b".txt?duplex=7"),
+        (RequestType.duplex_data, 0, build_duplex_payload(0, content[:150])),
+        (RequestType.duplex_data, 1, build_duplex_payload(1, content[150:])),
+        (RequestType.finish, 0, b""),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+
+    for response, (request_type, sequence_number, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_requests
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_header.sequence_number == sequence_number
+        assert parsed_payload == expected_payload
+
+
+def test_duplex_flow_listener(qr_code_communation_mock, webcam_reader_mock):
+    qr_code_communation_mock._duplex_enabled = True
+
+    qr_codes = []
+
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.start_connection, sequence_number=0), b".txt?window=4&duplex=5"),
+        _duplex_frame(0, 0, b"ABCD"),
+        _duplex_frame(1, 1, b""),
+        (RequestHeader(request_type=RequestType.finish, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test25(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=qr_codes)
+
+    mock_open = MockOpen(read_data=b"WXYZ")
+    mock_glob = MagicMock(glob=MagicMock(return_value=["send-files/b.png"]))
+    mock_remove = MagicMock()
+
+    with patch("main.WebcamReader", Test25), patch("main.open", mock_open), patch("main.os.remove", mock_remove), patch(
+        "outbox.glob", mock_glob
+    ):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    mock_remove.assert_called_once_with("send-files/b.png")
+    assert list(received_files(qr_code_communation_mock._received_files_folder).values()) == [b"ABCD"]
+
+    expected_requests = [
+        (RequestType.confirm_connection, 0, b"duplex=1&suffix=.png"),
+        (RequestType.duplex_data, 0, build_duplex_payload(1, b"WXYZ")),
+        (RequestType.duplex_data, 1, build_duplex_payload(1, b"")),
+        (RequestType.confirm_finish, 0, b""),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+
+    for response, (request_type, sequence_number, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_requests
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_header.sequence_number == sequence_number
+        assert parsed_payload == expected_payload
+
+
+@pytest.mark.parametrize("peer_token,gives_way", [(9, True), (3, False)])
+def test_duplex_simultaneous_offers(qr_code_communation_mock, webcam_reader_mock, peer_token, gives_way):
+    qr_code_communation_mock._duplex_enabled = True
+
+    rh = RequestHeader(request_type=RequestType.start_connection, sequence_number=0)
+    payload = f".png?duplex={peer_token}".encode()
+    rh.add_payload(payload)
+
+    class Test26(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=[None, rh.build() + payload])
+
+    mock_open = MockOpen(read_data=b"ABCD")
+    mock_glob = MagicMock(glob=MagicMock(return_value=["send-files/a.txt"]))
+
+    with patch("main.WebcamReader", Test26), patch("main.open", mock_open), patch("outbox.glob", mock_glob), patch(
+        "main.random.getrandbits", return_value=4
+    ):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    expected_requests = [(RequestType.start_connection, b".txt?duplex=5")]
+    if gives_way:
+        expected_requests.append((RequestType.confirm_connection, b"duplex=1&suffix=.txt"))
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_requests)
+
+    for response, (request_type, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_requests
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_payload == expected_payload
+
+
+def test_fec_window_flow_listener(qr_code_communation_mock, webcam_reader_mock):
+    qr_codes = []
+    fec_chunks = FecChunks(ContentChunks(b"ABCDEFGH", 3), 2, 1)
+
+    for rh, payload in [
+        (
+            RequestHeader(request_type=RequestType.start_connection, sequence_number=0),
+            b".txt?window=4&chunk_size=3&fec_data=2&fec_parity=1",
+        ),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=0), b"ABC"),
+        # Chunk 1 is lost, the parity of block 0 rebuilds it
+        (RequestHeader(request_type=RequestType.parity_data, sequence_number=0), fec_chunks.payload(0)),
+        (RequestHeader(request_type=RequestType.parity_data, sequence_number=1), fec_chunks.payload(1)),
+        (RequestHeader(request_type=RequestType.finish, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class Test29(WebcamReaderMock):
+        def __init__(self):
+            self.capture = MagicMock(side_effect=qr_codes)
+
+    with patch("main.WebcamReader", Test29), patch("main.os.mkdir", MagicMock):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    # The short last block is rebuilt from its parity alone
+    assert list(received_files(qr_code_communation_mock._received_files_folder).values()) == [b"ABCDEFGH"]
+
+    expected_responses = [
+        (RequestType.confirm_connection, 0, b"window=4&chunk_size=3&fec_data=2&fec_parity=1"),
+        (RequestType.confirm_data, 0, build_ack_payload(1, [0])),
+        (RequestType.confirm_data, 1, build_ack_payload(2, [1])),
+        (RequestType.confirm_data, 2, build_ack_payload(3, [2])),
+        (RequestType.confirm_finish, 0, b""),
+    ]
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == len(expected_responses)
+
+    for response, (request_type, sequence_number, expected_payload) in zip(
+        qr_code_communation_mock._qr_code_creator.responses, expected_responses
+    ):
+        parsed_header, parsed_payload = parse_image(webcam_reader_mock, image=response, mode=5)
+
+        assert parsed_header.request_type == request_type
+        assert parsed_header.sequence_number == sequence_number
+        assert parsed_payload == expected_payload
+
+
+class TimedReaderMock(WebcamReaderMock):
+    # Captures the frames one by one, then nothing until the seconds are over
+    def __init__(self, frames: list[bytes], seconds: float):
+        super().__init__()
+
+        self._frames = frames
+        self._seconds = seconds
+        self._started = time.monotonic()
+        self.captured_at = []
+
+        self.capture = self._capture
+
+    def is_capturing(self):
+        return bool(self._frames) or time.monotonic() - self._started < self._seconds
+
+    def _capture(self):
+        time.sleep(0.01)
+        self.captured_at.append(time.monotonic())
+
+        return self._frames.pop(0) if self._frames else None
+
+
+def test_event_loop_flow_listener(qr_code_communation_mock):
+    reader = TimedReaderMock(
+        [WebcamReader.parse_from_image(cv2.imread(f"images/{i}_qr_code.png"), cv2.COLOR_BGR2GRAY) for i in range(1, 4)],
+        0,
+    )
+
+    with patch("main.open", MagicMock()), patch("main.os.mkdir", MagicMock):
+        asyncio.run(qr_code_communation_mock.run(reader))
+
+    files = received_files(qr_code_communation_mock._received_files_folder)
+    assert len(files) == 1
+    assert next(iter(files)).endswith(".png")
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == 3
+
+
+def test_event_loop_timeout(qr_code_communation_mock, webcam_reader_mock):
+    header = RequestHeader(request_type=RequestType.start_connection, sequence_number=0)
+    header.add_payload(b".txt")
+    reader = TimedReaderMock([header.build() + b".txt"], 1.0)
+
+    with patch("main.WAITING_TIMEOUT_SECONDS", 0.2), patch("main.TIMEOUT_PAUSE_SECONDS", 0.3):
+        asyncio.run(qr_code_communation_mock.run(reader))
+
+    # The session was reset by its timer, while the frames kept coming
+    assert qr_code_communation_mock._status == Status.waiting
+    assert qr_code_communation_mock._received_file is None
+    assert max(b - a for a, b in zip(reader.captured_at, reader.captured_at[1:])) < 0.1
+
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == 1
+    parsed_header, _ = parse_image(
+        webcam_reader_mock, image=qr_code_communation_mock._qr_code_creator.responses[0], mode=5
+    )
+    assert parsed_header.request_type == RequestType.confirm_connection
+
+
+def test_retransmission_timeout_flow_sender(qr_code_communation_mock):
+    qr_codes = []
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0), b""),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+    reader = TimedReaderMock([None] + qr_codes, 2.0)
+
+    qr_code_communation_mock._rtt = RttEstimator(initial_rto=0.05, min_rto=0.05, max_rto=0.2)
+    qr_code_communation_mock._max_retransmissions = 1
+    nudges = MagicMock(wraps=qr_code_communation_mock._nudge_image)
+    qr_code_communation_mock._nudge_image = nudges
+
+    mock_open = MockOpen(read_data=b"ABCD" * 100)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
+
+    with patch("main.open", mock_open), patch("outbox.glob", mock_glob):
+        asyncio.run(qr_code_communation_mock.run(reader))
+
+    # Chunk 1 was shown again once, and the session given up at the second timeout, long before the waiting timeout
+    assert nudges.call_count == 1
+    assert qr_code_communation_mock._rtt.samples == 1
+    assert qr_code_communation_mock._status == Status.waiting
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == 3
+
+
+def test_retransmission_timeout_displayed_answer_flow_sender(qr_code_communation_mock):
+    qr_codes = []
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.confirm_connection, sequence_number=0), b""),
+        (RequestHeader(request_type=RequestType.confirm_data, sequence_number=0), b""),
+    ]:
+        rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+    # The receiver keeps displaying the acknowledgement of chunk 0, chunk 1 is never acknowledged
+    reader = TimedReaderMock([None] + qr_codes + [qr_codes[-1]] * 100, 0)
+
+    qr_code_communation_mock._rtt = RttEstimator(initial_rto=0.05, min_rto=0.05, max_rto=0.2)
+    qr_code_communation_mock._max_retransmissions = 1
+    nudges = MagicMock(wraps=qr_code_communation_mock._nudge_image)
+    qr_code_communation_mock._nudge_image = nudges
+
+    mock_open = MockOpen(read_data=b"ABCD" * 100)
+    mock_glob = MagicMock(glob=MagicMock(return_value=["file_to_send.txt"]))
+
+    with patch("main.open", mock_open), patch("outbox.glob", mock_glob):
+        asyncio.run(qr_code_communation_mock.run(reader))
+
+    assert nudges.call_count == 1
+    assert qr_code_communation_mock._status == Status.waiting
+    assert len(qr_code_communation_mock._qr_code_creator.responses) == 3
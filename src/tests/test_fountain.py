@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from fountain import BroadcastInfo, FountainDecoder, FountainEncoder, build_symbol_payload, parse_symbol_payload
+
+
+def _encoder(content: bytes, chunk_size: int = 150) -> FountainEncoder:
+    chunks = {i: content[offset : offset + chunk_size] for i, offset in enumerate(range(0, len(content), chunk_size))}
+
+    return FountainEncoder(chunks, BroadcastInfo(7, len(content), chunk_size, ".bin"))
+
+
+@pytest.mark.parametrize("content_length", [0, 1, 150, 151, 150 * 64 + 3])
+def test_systematic_symbols_rebuild_content(content_length):
+    content = os.urandom(content_length)
+    encoder = _encoder(content)
+
+    decoder = FountainDecoder(BroadcastInfo(7, content_length, 150, ".bin"))
+    for symbol_id in range(encoder.num_chunks):
+        decoder.add_symbol(symbol_id, encoder.symbol(symbol_id))
+
+    assert decoder.is_complete()
+    assert decoder.content() == content
+
+
+def test_coded_symbols_rebuild_content_without_systematic_ones():
+    content = os.urandom(150 * 50)
+    encoder = _encoder(content)
+    decoder = FountainDecoder(BroadcastInfo(7, len(content), 150, ".bin"))
+
+    # Every third chunk is lost, the gaps are filled by coded symbols only
+    for symbol_id in range(encoder.num_chunks):
+        if symbol_id % 3:
+            decoder.add_symbol(symbol_id, encoder.symbol(symbol_id))
+
+    symbol_id = encoder.num_chunks
+    while not decoder.is_complete():
+        decoder.add_symbol(symbol_id, encoder.symbol(symbol_id))
+        symbol_id += 1
+
+        assert symbol_id < encoder.num_chunks * 4
+
+    assert decoder.content() == content
+
+
+def test_content_before_complete():
+    decoder = FountainDecoder(BroadcastInfo(7, 300, 150, ".bin"))
+
+    with pytest.raises(ValueError):
+        decoder.content()
+
+
+def test_symbol_payload_round_trip():
+    info = BroadcastInfo(123, 1000, 4, ".txt")
+    payload = build_symbol_payload(info, b"ABCD")
+
+    assert parse_symbol_payload(payload) == (info, b"ABCD")
+
+    with pytest.raises(ValueError):
+        parse_symbol_payload(payload[:-1])
+
+
+def test_large_content_length():
+    info = BroadcastInfo(123, 3 * 2**30, 150, ".bin")
+    payload = build_symbol_payload(info, bytes(150))
+
+    assert parse_symbol_payload(payload) == (info, bytes(150))
+
+    with pytest.raises(ValueError):
+        BroadcastInfo(123, 2**31 * 4 + 1, 4, ".bin")
@@ -0,0 +1,65 @@
+import random
+
+from loopback import LinkOptions, run_transfer
+
+
+def test_loopback_transfer():
+    content = random.Random(0).randbytes(500)
+
+    report = run_transfer(content, link=LinkOptions(latency=0.02, frame_rate=100), timeout=30)
+
+    assert report.errors == []
+    assert report.completed
+    assert report.intact
+    assert report.chunks == 4
+    assert report.goodput > 0
+
+
+def test_loopback_empty_file_transfer():
+    report = run_transfer(b"", link=LinkOptions(latency=0.02, frame_rate=100), timeout=30)
+
+    assert report.errors == []
+    assert report.completed
+    assert report.intact
+    assert report.chunks == 1
+
+
+def test_loopback_transfer_with_dropped_frames():
+    content = random.Random(1).randbytes(300)
+
+    report = run_transfer(content, link=LinkOptions(latency=0.02, frame_rate=100, drop_probability=0.3), timeout=60)
+
+    assert report.completed
+    assert report.intact
+    assert report.dropped_frames > 0
+
+
+def test_loopback_duplex_transfer():
+    content = random.Random(2).randbytes(400)
+    reverse_content = random.Random(3).randbytes(200)
+
+    report = run_transfer(
+        content,
+        link=LinkOptions(latency=0.02, frame_rate=100),
+        timeout=30,
+        reverse_content=reverse_content,
+        duplex=True,
+    )
+
+    assert report.errors == []
+    assert report.completed
+    assert report.intact
+    assert report.content_length == 600
+    assert report.chunks == 5
+
+
+def test_loopback_tiled_adaptive_transfer():
+    content = random.Random(4).randbytes(8000)
+
+    report = run_transfer(
+        content, link=LinkOptions(latency=0.02, frame_rate=100), timeout=60, window_size=8, tiles=4, adaptive=True
+    )
+
+    assert report.errors == []
+    assert report.completed
+    assert report.intact
@@ -0,0 +1,127 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from metrics import Histogram, Metrics, TransferProgress
+from protocol import RequestHeader, RequestType
+from tests.conftest import received_files
+
+
+def test_histogram():
+    histogram = Histogram((0.01, 0.1, 1.0))
+
+    for value in [0.005, 0.005, 0.05, 0.5, 2.0]:
+        histogram.observe(value)
+
+    assert histogram.count == 5
+    assert histogram.sum == pytest.approx(2.56)
+    assert histogram.cumulative() == [("0.01", 2), ("0.1", 3), ("1.0", 4), ("+Inf", 5)]
+    assert histogram.quantile(0.4) == 0.01
+    assert histogram.quantile(0.6) == 0.1
+    assert histogram.quantile(1.0) == 2.0
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_transfer_progress():
+    progress = TransferProgress("sent", 1000)
+    progress._started -= 10
+    progress.done_bytes = 250
+
+    assert progress.goodput == pytest.approx(25, rel=0.01)
+    assert progress.eta == pytest.approx(30, rel=0.01)
+    assert str(progress).startswith("Sent 250/1000 bytes (25%) in 10s, 25 B/s, ETA 30s")
+    assert TransferProgress("received", None).eta is None
+
+
+def test_metrics_export(tmp_path):
+    metrics = Metrics()
+
+    with metrics.time("decode"):
+        pass
+    metrics.count("checksum_failures")
+    metrics.count("checksum_failures")
+    metrics.start_transfer("sent", 300)
+    metrics.update_transfer(150)
+    metrics.set_gauge("rto_seconds", 0.5)
+    metrics.set_gauge("rtt_seconds", None)
+
+    metrics.export(str(tmp_path))
+
+    snapshot = json.loads((tmp_path / "metrics.json").read_text())
+    assert snapshot["stages"]["decode"]["count"] == 1
+    assert snapshot["stages"]["render"]["count"] == 0
+    assert snapshot["counters"]["checksum_failures"] == 2
+    assert snapshot["transfer"]["done_bytes"] == 150
+    assert snapshot["memory"] is None
+    assert snapshot["gauges"] == {"rto_seconds": 0.5, "rtt_seconds": None}
+
+    prometheus = (tmp_path / "metrics.prom").read_text().splitlines()
+    assert 'qr_communication_stage_seconds_bucket{stage="decode",le="+Inf"} 1' in prometheus
+    assert 'qr_communication_stage_seconds_count{stage="render"} 0' in prometheus
+    assert "qr_communication_checksum_failures_total 2" in prometheus
+    assert "qr_communication_transfer_total_bytes 300" in prometheus
+    assert "qr_communication_rto_seconds 0.5" in prometheus
+    assert not any(line.startswith("qr_communication_rtt_seconds") for line in prometheus)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["metrics.json", "metrics.prom"]
+
+    metrics.end_transfer()
+
+    assert metrics.transfer is None
+    assert metrics.counters["transfers"] == 1
+    assert metrics.counters["transferred_bytes"] == 150
+
+
+def test_metrics_flow_listener(qr_code_communation_mock, tmp_path):
+    qr_code_communation_mock._metrics = Metrics()
+    qr_code_communation_mock._metrics_folder = str(tmp_path / "metrics")
+
+    bad_header = RequestHeader(request_type=RequestType.send_data, sequence_number=0)
+    bad_header.add_payload(b"ABCE")
+
+    qr_codes = []
+    for rh, payload in [
+        (RequestHeader(request_type=RequestType.start_connection, sequence_number=0), b".txt"),
+        (bad_header, b"ABCD"),
+        (RequestHeader(request_type=RequestType.send_data, sequence_number=0), b"ABCD"),
+        (RequestHeader(request_type=RequestType.finish, sequence_number=0), b""),
+    ]:
+        if rh is not bad_header:
+            rh.add_payload(payload)
+        qr_codes.append(rh.build() + payload)
+
+    class WebcamReaderMock:
+        def __init__(self, **options):
+            self.capture = MagicMock(side_effect=qr_codes + [None])
+
+        def is_capturing(self):
+            return True
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+    with patch("main.WebcamReader", WebcamReaderMock):
+        try:
+            qr_code_communation_mock.start()
+        except StopIteration:
+            pass
+
+    assert list(received_files(qr_code_communation_mock._received_files_folder).values()) == [b"ABCD"]
+
+    metrics = qr_code_communation_mock._metrics
+    assert metrics.counters["frames"] == 5
+    assert metrics.counters["empty_frames"] == 1
+    assert metrics.counters["checksum_failures"] == 1
+    assert metrics.counters["repeats_requested"] == 1
+    assert metrics.counters["transfers"] == 1
+    assert metrics.counters["transferred_bytes"] == 4
+    assert metrics.stages["checksum"].count == 2
+    assert metrics.stages["parse"].count == 5
+    assert metrics.stages["render"].count == 4
+
+    # Written once the interval passed, the capture stopped before
+    metrics.export(qr_code_communation_mock._metrics_folder)
+    assert json.loads((tmp_path / "metrics" / "metrics.json").read_text())["counters"]["frames"] == 5
@@ -0,0 +1,61 @@
+import os
+
+from outbox import Outbox
+
+
+def _age(path, seconds: float):
+    mtime = os.stat(path).st_mtime - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_outbox_lists_folder_once_per_change(tmp_path):
+    (tmp_path / "b.txt").write_bytes(b"B")
+    (tmp_path / "a.txt").write_bytes(b"A")
+    _age(tmp_path, 10)
+
+    outbox = Outbox(str(tmp_path), poll_interval=0)
+
+    assert outbox.next_file() == str(tmp_path / "a.txt")
+    assert outbox.next_file() == str(tmp_path / "a.txt")
+    assert outbox.scans == 1
+
+    (tmp_path / "c.txt").write_bytes(b"C")
+
+    outbox.remove(str(tmp_path / "a.txt"))
+    os.remove(tmp_path / "a.txt")
+
+    assert outbox.next_file() == str(tmp_path / "b.txt")
+    assert outbox.scans == 2
+
+
+def test_outbox_poll_interval(tmp_path):
+    outbox = Outbox(str(tmp_path), poll_interval=60)
+
+    assert outbox.next_file() is None
+
+    (tmp_path / "a.txt").write_bytes(b"A")
+
+    # Not checked again before the interval
+    assert outbox.next_file() is None
+
+    outbox.refresh()
+
+    assert outbox.next_file() == str(tmp_path / "a.txt")
+
+
+def test_outbox_recent_mtime_is_listed_again(tmp_path):
+    (tmp_path / "a.txt").write_bytes(b"A")
+
+    outbox = Outbox(str(tmp_path), poll_interval=0)
+
+    # A file added within the mtime resolution may not change the folder mtime
+    outbox.next_file()
+    outbox.next_file()
+
+    assert outbox.scans == 2
+
+
+def test_outbox_missing_folder(tmp_path):
+    outbox = Outbox(str(tmp_path / "send-files"), poll_interval=0)
+
+    assert outbox.next_file() is None
@@ -1,9 +1,11 @@
 import callee as callee
 import cv2
+import numpy
 import pytest as pytest
 
-from protocol import RequestType
+from protocol import RequestType, RequestHeader, HEADER_LENGTH
 from tests.conftest import parse_image
+from webcam import WebcamReader
 
 
 @pytest.mark.parametrize(
@@ -44,3 +46,18 @@ def test_parsing_wounded_qr_code(webcam_reader_mock):
 
     assert header is None
     assert raw_payload is None
+
+
+def test_parsing_all_skips_unrelated_qr_codes():
+    protocol_image = cv2.imread("images/1_qr_code.png")
+    unrelated_image = cv2.imread("images/unrelated_qr_code.png")
+
+    height = max(protocol_image.shape[0], unrelated_image.shape[0])
+    frame = numpy.full((height, protocol_image.shape[1] + unrelated_image.shape[1], 3), 255, dtype=numpy.uint8)
+    frame[: protocol_image.shape[0], : protocol_image.shape[1]] = protocol_image
+    frame[: unrelated_image.shape[0], protocol_image.shape[1] :] = unrelated_image
+
+    messages = WebcamReader.parse_all_from_image(frame, cv2.COLOR_BGR2GRAY)
+
+    assert len(messages) == 1
+    assert RequestHeader.parse(messages[0][:HEADER_LENGTH]).request_type == RequestType.start_connection
@@ -0,0 +1,56 @@
+import pytest
+
+from payload_encoding import PayloadEncoding, b45decode, b45encode, decode_payload, encode_payload
+from session import SessionOptions
+
+
+@pytest.mark.parametrize(
+    "data,encoded",
+    [
+        (b"AB", b"BB8"),
+        (b"Hello!!", b"%69 VD92EX0"),
+        (b"base-45", b"UJCLQE7W581"),
+        (b"ietf!", b"QED8WEX0"),
+        (b"", b""),
+    ],
+)
+def test_base45_vectors(data, encoded):
+    assert b45encode(data) == encoded
+    assert b45decode(encoded) == data
+
+
+@pytest.mark.parametrize("encoded", [b"GGW", b"A", b"ab1"])
+def test_base45_invalid(encoded):
+    with pytest.raises(ValueError):
+        b45decode(encoded)
+
+
+@pytest.mark.parametrize("encoding", list(PayloadEncoding))
+@pytest.mark.parametrize("data", [bytes(range(256)) * 2, bytes(1000), b""])
+def test_payload_round_trip(encoding, data):
+    assert decode_payload(encode_payload(data, encoding)) == data
+
+
+def test_payload_has_no_zero_runs():
+    assert bytes(4) not in encode_payload(bytes(2000), PayloadEncoding.binary)
+    assert b"000000" not in encode_payload(bytes(2000), PayloadEncoding.base45)
+
+
+def test_binary_payload_converted_to_text():
+    data = bytes(range(256))
+
+    # A reader that returns byte mode data as UTF-8 text after assuming ISO-8859-1
+    text = encode_payload(data, PayloadEncoding.binary).decode("latin-1").encode()
+
+    assert decode_payload(text) == data
+
+
+def test_session_encoding_negotiation():
+    offered = SessionOptions(window=4, encoding=PayloadEncoding.binary)
+
+    assert offered.encode() == {"window": 4, "encoding": "binary"}
+    assert SessionOptions.parse({"encoding": "unknown"}).encoding == PayloadEncoding.base64
+
+    accepted = SessionOptions.parse({"window": "4", "encoding": "binary"}).accepted()
+    assert offered.agreed(accepted) == offered
+    assert offered.agreed(SessionOptions(window=2)) == SessionOptions(window=2)
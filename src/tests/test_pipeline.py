@@ -0,0 +1,98 @@
+import time
+from unittest.mock import patch
+
+from cv2 import cv2
+
+from pipeline import PipelinedWebcamReader
+from tracking import RegionTracker
+from webcam import WebcamReader
+
+
+class CameraMock:
+    def __init__(self, frames: list, frame_interval: float = 0.005):
+        self._frames = iter(frames)
+        self._frame = None
+        self._frame_interval = frame_interval
+
+    def set(self, *args):
+        pass
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        time.sleep(self._frame_interval)
+        self._frame = next(self._frames, self._frame)
+
+        return True, self._frame
+
+    def release(self):
+        pass
+
+
+def _capture_for(reader: PipelinedWebcamReader, seconds: float) -> list[bytes]:
+    messages = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        messages += reader.capture_all()
+
+    return messages
+
+
+def test_pipeline_decodes_frames():
+    image = cv2.imread("images/1_qr_code.png")
+
+    with PipelinedWebcamReader(2, capture_webcam=CameraMock([image])) as reader:
+        message = None
+        end = time.perf_counter() + 5
+        while message is None and time.perf_counter() < end:
+            message = reader.capture()
+
+    assert message == WebcamReader.parse_from_image(image, cv2.COLOR_BGR2GRAY)
+    assert reader.stats.capture.count > 0
+    assert reader.stats.decode.count > 0
+    assert reader.stats.delivery.count > 0
+
+
+def test_pipeline_drops_stale_frames():
+    def slow_decode(reader, frame, mode, colors=1):
+        time.sleep(0.03)
+
+        return [frame]
+
+    frames = [i.to_bytes(4, "big") for i in range(1000)]
+
+    with patch("pipeline.WebcamReader.decode_frame", slow_decode):
+        with PipelinedWebcamReader(2, capture_webcam=CameraMock(frames)) as reader:
+            messages = _capture_for(reader, 0.5)
+
+    # Frames that waited while the decoders were busy were replaced by newer ones
+    assert reader.stats.capture.dropped > 0
+    assert len(messages) < reader.stats.capture.count
+
+    # Delivered in capture order
+    assert messages == sorted(messages)
+    assert len(messages) == reader.stats.delivery.count
+
+
+def test_pipeline_workers_decode_apart():
+    trackers = set()
+    calibrations = set()
+
+    def recording_decode(reader, frame, mode, colors=1):
+        trackers.add(id(reader._tracker))
+        calibrations.add(id(reader._calibration))
+        time.sleep(0.01)
+
+        return [frame]
+
+    tracker = RegionTracker()
+    frames = [i.to_bytes(4, "big") for i in range(1000)]
+
+    with patch("pipeline.WebcamReader.decode_frame", recording_decode):
+        with PipelinedWebcamReader(3, capture_webcam=CameraMock(frames), tracker=tracker) as reader:
+            _capture_for(reader, 0.3)
+
+    # A region tracker and a colour calibration per worker, none of them the reader's own
+    assert len(trackers) == len(calibrations) == 3
+    assert id(tracker) not in trackers
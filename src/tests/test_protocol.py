@@ -0,0 +1,105 @@
+import pytest
+
+from protocol import (
+    LATEST_VERSION,
+    RequestHeader,
+    RequestType,
+    build_connection_payload,
+    parse_connection_payload,
+    build_ack_payload,
+    parse_ack_payload,
+    build_duplex_payload,
+    parse_duplex_payload,
+    build_nack_payload,
+    parse_nack_payload,
+    calculate_hash,
+)
+from session import SessionOptions
+
+
+@pytest.mark.parametrize(
+    "payload,suffix,options",
+    [
+        (b".txt", ".txt", {}),
+        (b"", "", {}),
+        (b".txt?window=8", ".txt", {"window": "8"}),
+        (b".txt?window=8&unknown", ".txt", {"window": "8"}),
+        (b".averyverylongsuffix?window=8", None, {"window": "8"}),
+        (b"\xff\xfe", None, {}),
+    ],
+)
+def test_parse_connection_payload(payload, suffix, options):
+    assert parse_connection_payload(payload) == (suffix, options)
+
+
+def test_connection_payload_round_trip():
+    payload = build_connection_payload(".png", {"window": 16})
+
+    assert payload == b".png?window=16"
+    assert parse_connection_payload(payload) == (".png", {"window": "16"})
+    assert build_connection_payload(".png") == b".png"
+    # A receiver from before the options reads a sender left at the defaults
+    assert build_connection_payload(".png", SessionOptions(chunk_size=150).encode()) == b".png"
+
+
+def test_ack_payload_round_trip():
+    assert parse_ack_payload(build_ack_payload(5, [7, 9])) == (5, [7, 9])
+    assert parse_ack_payload(build_ack_payload(0, [])) == (0, [])
+
+
+@pytest.mark.parametrize("payload", [b"", b"\x01\x02\x03", b"\x00" * 5])
+def test_parse_bad_ack_payload(payload):
+    with pytest.raises(ValueError):
+        parse_ack_payload(payload)
+
+
+def test_nack_payload_round_trip():
+    runs = [(3, 2), (10, 1), (200, 1000)]
+    payload = build_nack_payload(runs)
+
+    assert payload == b"\x02\x05\x01\xbd\x01\xe8\x07"
+    assert parse_nack_payload(3, payload) == runs
+    # The runs that don't fit are left out
+    assert parse_nack_payload(3, build_nack_payload(runs, max_length=4)) == runs[:2]
+    assert build_nack_payload([]) == b""
+
+
+@pytest.mark.parametrize("payload", [b"\x01\x02", b"\x81", b"\xff\xff\xff\xff\xff\x01"])
+def test_parse_bad_nack_payload(payload):
+    with pytest.raises(ValueError):
+        parse_nack_payload(0, payload)
+
+
+def test_duplex_payload_round_trip():
+    assert parse_duplex_payload(build_duplex_payload(3, b"ABCD")) == (3, b"ABCD")
+    assert parse_duplex_payload(build_duplex_payload(0, b"")) == (0, b"")
+
+    with pytest.raises(ValueError):
+        parse_duplex_payload(b"\x01\x02")
+
+
+def test_duplex_options():
+    offered = SessionOptions(window=4, duplex=12345)
+
+    assert offered.accepted().duplex == 0
+    assert offered.agreed(SessionOptions(window=1, duplex=1)) == SessionOptions(duplex=1)
+    assert offered.agreed(SessionOptions(window=4)).duplex == 0
+    assert SessionOptions().agreed(SessionOptions(duplex=1)).duplex == 0
+
+
+@pytest.mark.parametrize("payload", [None, b"", b"ABCD" * 100])
+def test_checksum_version_2(payload):
+    header = RequestHeader(RequestType.send_data, 7, version=LATEST_VERSION)
+    header.add_payload(payload)
+
+    parsed_header = RequestHeader.parse(header.build())
+
+    assert parsed_header == header
+    assert header.checksum == calculate_hash(LATEST_VERSION, RequestType.send_data, 7, payload)
+    assert header.checksum != calculate_hash(1, RequestType.send_data, 7, payload)
+    assert header.checksum != calculate_hash(LATEST_VERSION, RequestType.send_data, 8, payload)
+    assert header.checksum != calculate_hash(LATEST_VERSION, RequestType.repeat_data, 7, payload)
+
+    if payload:
+        corrupted = bytes([payload[0] ^ 1]) + payload[1:]
+        assert header.checksum != calculate_hash(LATEST_VERSION, RequestType.send_data, 7, corrupted)
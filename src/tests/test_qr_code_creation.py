@@ -1,9 +1,15 @@
+from unittest.mock import patch
+
 import pytest
+import qrcode.constants
 from cv2 import cv2
 
+from payload_encoding import PayloadEncoding
 from protocol import RequestHeader, RequestType
-from qr_creator import MAX_DATA_SIZE
+import qr_creator as qr_creator_module
+from qr_creator import MAX_DATA_SIZE, TILE_ERROR_CORRECTION_LEVEL, TILE_GAP_MODULES, QRCodeCreator, max_data_size
 from tests.conftest import parse_image
+from webcam import WebcamReader
 
 
 @pytest.mark.parametrize(
@@ -40,3 +46,155 @@ def test_create_qr_code(webcam_reader_mock, qr_creator, request_type, sequence_n
 
     assert parsed_header == header
     assert parsed_raw_payload == payload
+
+
+@pytest.mark.parametrize("encoding", list(PayloadEncoding))
+def test_create_qr_code_with_encoding(webcam_reader_mock, qr_creator, encoding):
+    header = RequestHeader(request_type=RequestType.send_data, sequence_number=7)
+    payload = bytes(range(256)) * 3
+    header.add_payload(payload)
+
+    qr_code_image = qr_creator.create(header.build() + payload, encoding=encoding)
+
+    parsed_header, parsed_raw_payload = parse_image(webcam_reader_mock, qr_code_image, cv2.COLOR_BGR2RGB)
+
+    assert parsed_header == header
+    assert parsed_raw_payload == payload
+
+
+@pytest.mark.parametrize(
+    "level", [qrcode.constants.ERROR_CORRECT_H, qrcode.constants.ERROR_CORRECT_M, qrcode.constants.ERROR_CORRECT_L]
+)
+def test_max_data_size_fits_version_40(qr_creator, level):
+    data = bytes(range(256)) * 12
+
+    qr_creator.create(data[: max_data_size(level)], error_correction_level=level)
+
+    with pytest.raises(ValueError) as e:
+        qr_creator.create(data[: max_data_size(level) + 1], error_correction_level=level)
+
+    assert e.value.args[0] == "Data is too big"
+
+
+@pytest.mark.parametrize("encoding", [PayloadEncoding.base45, PayloadEncoding.binary])
+def test_encoding_max_data_size(qr_creator, encoding):
+    level = qrcode.constants.ERROR_CORRECT_L
+    data = bytes(range(256)) * 12
+
+    qr_creator.create(data[: max_data_size(level, encoding=encoding)], error_correction_level=level, encoding=encoding)
+
+    with pytest.raises(ValueError) as e:
+        qr_creator.create(
+            data[: max_data_size(level, encoding=encoding) + 1], error_correction_level=level, encoding=encoding
+        )
+
+    assert e.value.args[0] == "Data is too big"
+    assert max_data_size(level, encoding=encoding) > max_data_size(level)
+
+
+@pytest.mark.parametrize("count", [2, 4, 9])
+def test_create_tiled_qr_codes(qr_creator, count):
+    messages = []
+    for sequence_number in range(count):
+        header = RequestHeader(request_type=RequestType.send_data, sequence_number=sequence_number)
+        payload = bytes([sequence_number]) * 40
+        header.add_payload(payload)
+        messages.append(header.build() + payload)
+
+    tiled_image = qr_creator.create_tiled(messages)
+
+    assert sorted(WebcamReader.parse_all_from_image(tiled_image, cv2.COLOR_GRAY2BGR)) == sorted(messages)
+
+
+@pytest.mark.parametrize("count", [2, 4, 9])
+def test_max_tile_version(qr_creator, count):
+    version = qr_creator.max_tile_version(count)
+    data = bytes(range(256)) * 2
+    messages = [data[: max_data_size(TILE_ERROR_CORRECTION_LEVEL, version)]] * count
+
+    # Not wider than a single code of the highest version
+    tiled_image = qr_creator.create_tiled(messages)
+    level = qrcode.constants.ERROR_CORRECT_L
+    single_image = qr_creator.create((data * 6)[: max_data_size(level)], qr_creator._tile_box_size, level)
+
+    assert tiled_image.shape[1] <= single_image.shape[1]
+    assert qr_creator.max_tile_version(count * 4) < version
+
+
+def test_tiles_are_apart(qr_creator):
+    messages = [bytes([i]) * 40 for i in range(2)]
+    tile = qr_creator.create(messages[0], 4, TILE_ERROR_CORRECTION_LEVEL)
+
+    tiled_image = qr_creator.create_tiled(messages)
+
+    assert tiled_image.shape == (tile.shape[0], 2 * tile.shape[1] + TILE_GAP_MODULES * 4)
+    assert (tiled_image[:, tile.shape[1] : -tile.shape[1]] == 255).all()
+
+
+@pytest.mark.parametrize(
+    "creator_options",
+    [{}, {"fill_color": "red", "back_color": "yellow"}, {"border": 0, "box_size": 3}, {"color_profile": "L"}],
+)
+@pytest.mark.parametrize("encoding", list(PayloadEncoding))
+def test_render_matches_png_round_trip(creator_options, encoding):
+    data = bytes(range(256)) * 2
+
+    for image_size in [None, 560]:
+        image = QRCodeCreator(**creator_options).create(data, encoding=encoding, image_size=image_size)
+
+        with patch.object(qr_creator_module, "LOSSLESS_IMAGE_TYPES", ()):
+            png_image = QRCodeCreator(**creator_options).create(data, encoding=encoding, image_size=image_size)
+
+        assert image.dtype == png_image.dtype
+        assert image.shape == png_image.shape
+        assert (image == png_image).all()
+
+
+def test_frames_cache():
+    creator = QRCodeCreator(cache_size=2)
+    frames = [bytes([i]) * 100 for i in range(3)]
+
+    with patch.object(creator, "_create", wraps=creator._create) as create_mock:
+        first_image = creator.create(frames[0])
+        creator.create(frames[1])
+
+        assert creator.create(frames[0]) is first_image
+        assert create_mock.call_count == 2
+
+        # The least recently used frame is dropped
+        creator.create(frames[2])
+        creator.create(frames[0])
+        assert create_mock.call_count == 3
+
+        creator.create(frames[1])
+        assert create_mock.call_count == 4
+
+        # Different render options are different frames
+        creator.create(frames[1], encoding=PayloadEncoding.binary)
+        assert create_mock.call_count == 5
+
+
+def test_prerender(qr_creator):
+    frames = [bytes([i]) * 100 for i in range(3)]
+
+    with patch.object(qr_creator, "_create", wraps=qr_creator._create) as create_mock:
+        qr_creator.prerender(frames, encoding=PayloadEncoding.binary)
+        qr_creator.prerender(frames, encoding=PayloadEncoding.binary)
+        images = [qr_creator.create(frame, encoding=PayloadEncoding.binary) for frame in frames]
+
+        assert create_mock.call_count == 3
+
+    for image, frame in zip(images, frames):
+        assert (image == QRCodeCreator().create(frame, encoding=PayloadEncoding.binary)).all()
+
+
+@pytest.mark.parametrize("tiled,colors", [(True, 1), (True, 3), (False, 3)])
+def test_prerender_tiled(qr_creator, tiled, colors):
+    frames = [bytes([i]) * 100 for i in range(6 if tiled else 3)]
+
+    with patch.object(qr_creator, "_create", wraps=qr_creator._create) as create_mock:
+        qr_creator.prerender(frames, tiled=tiled, colors=colors)
+        qr_creator.create_tiled(frames, colors=colors)
+
+        # The frame is drawn from the codes rendered ahead
+        assert create_mock.call_count == len(frames)
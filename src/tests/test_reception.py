@@ -0,0 +1,106 @@
+import os
+import zlib
+
+import pytest
+
+from compression import Compression
+from reception import ChunkBitmap, ReceivedFile
+
+CONTENT = bytes(range(256)) * 4
+
+
+def _chunks(chunk_size: int) -> list[bytes]:
+    return [CONTENT[i : i + chunk_size] for i in range(0, len(CONTENT), chunk_size)]
+
+
+def test_chunk_bitmap():
+    bitmap = ChunkBitmap()
+
+    assert bitmap.add(0)
+    assert bitmap.add(2)
+    assert not bitmap.add(2)
+    assert bitmap.add(100)
+
+    assert len(bitmap) == 3
+    assert 2 in bitmap
+    assert 1 not in bitmap
+    assert 1000 not in bitmap
+    assert bitmap.next_missing == 1
+    assert bitmap.last_sequence == 100
+
+    assert bitmap.missing_runs() == [(1, 1), (3, 97)]
+
+    bitmap.add(1)
+
+    assert bitmap.next_missing == 3
+
+    with pytest.raises(IndexError):
+        bitmap.add(-1)
+
+
+@pytest.mark.parametrize("chunk_size", [150, 0])
+def test_received_file_out_of_order(tmp_path, chunk_size):
+    chunks = _chunks(150)
+    received_file = ReceivedFile(str(tmp_path), chunk_size)
+
+    for sequence in [1, 0, 3, 2, 3, 6, 5, 4]:
+        received_file.add(sequence, chunks[sequence])
+
+    assert received_file.received_count == len(chunks)
+    assert received_file.missing() is None
+    assert received_file.received_length == len(CONTENT)
+
+    received_file.save(str(tmp_path / "file.bin"))
+
+    assert os.listdir(tmp_path) == ["file.bin"]
+    assert (tmp_path / "file.bin").read_bytes() == CONTENT
+
+
+def test_received_file_missing(tmp_path):
+    chunks = _chunks(150)
+    received_file = ReceivedFile(str(tmp_path), 150)
+
+    received_file.add(0, chunks[0])
+    assert received_file.missing() is None
+
+    received_file.add(2, chunks[2])
+    assert received_file.missing() == 1
+    assert received_file.next_missing == 1
+
+    for sequence in range(4, 30):
+        received_file.add(sequence, b"ABC")
+    received_file.add(31, b"ABC")
+    assert received_file.missing_runs() == [(1, 1), (3, 1), (30, 1)]
+
+
+def test_received_file_discard(tmp_path):
+    received_file = ReceivedFile(str(tmp_path), 0)
+    received_file.add(1, b"ABC")
+
+    received_file.discard()
+    received_file.discard()
+
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("chunk_size", [150, 0])
+def test_received_file_compressed(tmp_path, chunk_size):
+    content = b"ABCDEFGH" * 1000 + CONTENT
+    compressed = zlib.compress(content)
+    chunks = [compressed[i : i + 150] for i in range(0, len(compressed), 150)]
+
+    received_file = ReceivedFile(str(tmp_path), chunk_size, Compression.zlib)
+
+    received_file.add(1, chunks[1])
+    assert received_file.received_length == 0
+
+    for sequence in range(len(chunks)):
+        received_file.add(sequence, chunks[sequence])
+
+    assert received_file.received_length == len(content)
+    assert received_file.read(8000, 10) == CONTENT[:10]
+
+    received_file.save(str(tmp_path / "file.bin"))
+
+    assert os.listdir(tmp_path) == ["file.bin"]
+    assert (tmp_path / "file.bin").read_bytes() == content
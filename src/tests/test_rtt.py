@@ -0,0 +1,72 @@
+import pytest
+
+from rtt import INITIAL_RTO, MAX_RTO, MIN_RTO, RttEstimator
+
+
+def test_first_sample():
+    estimator = RttEstimator()
+    assert estimator.rto == INITIAL_RTO
+    assert estimator.srtt is None
+
+    estimator.sample(0.4)
+
+    assert estimator.srtt == pytest.approx(0.4)
+    assert estimator.rttvar == pytest.approx(0.2)
+    assert estimator.rto == pytest.approx(0.4 + 4 * 0.2)
+
+
+def test_smoothed_samples():
+    estimator = RttEstimator()
+    estimator.sample(0.4)
+    estimator.sample(0.8)
+
+    assert estimator.rttvar == pytest.approx(0.75 * 0.2 + 0.25 * 0.4)
+    assert estimator.srtt == pytest.approx(0.875 * 0.4 + 0.125 * 0.8)
+    assert estimator.samples == 2
+
+    # A steady round trip time narrows the timeout down to it
+    for _ in range(50):
+        estimator.sample(0.5)
+    assert estimator.srtt == pytest.approx(0.5, abs=0.01)
+    assert estimator.rto == pytest.approx(0.5, abs=0.05)
+
+
+def test_rto_bounds():
+    estimator = RttEstimator()
+    estimator.sample(0.001)
+    assert estimator.rto == MIN_RTO
+
+    estimator.sample(30)
+    assert estimator.rto == MAX_RTO
+
+
+def test_back_off():
+    estimator = RttEstimator()
+    estimator.sample(0.1)
+    rto = estimator.rto
+
+    estimator.back_off()
+    estimator.back_off()
+    assert estimator.rto == pytest.approx(rto * 4)
+
+    for _ in range(10):
+        estimator.back_off()
+    assert estimator.rto == MAX_RTO
+
+    # Until the next sample
+    estimator.sample(0.1)
+    assert estimator.rto < rto * 2
+
+
+def test_snapshot():
+    assert RttEstimator().snapshot()["rtt_seconds"] is None
+
+    estimator = RttEstimator()
+    estimator.sample(0.4)
+    assert estimator.snapshot() == {
+        "rtt_seconds": 0.4,
+        "rtt_deviation_seconds": 0.2,
+        "rto_seconds": estimator.rto,
+        "rtt_samples": 1,
+    }
+    assert str(estimator).startswith("RTT 0.40s")
@@ -0,0 +1,58 @@
+import numpy
+from cv2 import cv2
+
+from protocol import RequestHeader, RequestType
+from tracking import RegionTracker
+from webcam import WebcamReader
+
+
+def _message() -> bytes:
+    header = RequestHeader(request_type=RequestType.send_data, sequence_number=3)
+    payload = b"ABCD" * 20
+    header.add_payload(payload)
+
+    return header.build() + payload
+
+
+def _frame(code=None, left: int = 0, top: int = 0):
+    frame = numpy.full((480, 640), 255, dtype=numpy.uint8)
+    if code is not None:
+        frame[top : top + code.shape[0], left : left + code.shape[1]] = code
+
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+
+def test_region_tracking(qr_creator):
+    message = _message()
+    code = qr_creator.create(message, box_size=3)
+    tracker = RegionTracker(max_misses=2)
+
+    assert WebcamReader.parse_all_from_image(_frame(code, 100, 50), cv2.COLOR_BGR2GRAY, tracker) == [message]
+    assert tracker.full_scans == 1
+    left, top, right, bottom = tracker.region
+    assert left < 100 + code.shape[1] and right > 100 and top < 50 + code.shape[0] and bottom > 50
+    assert (right - left) * (bottom - top) < 640 * 480
+
+    # The code moved a little, it is still found in the region
+    assert WebcamReader.parse_all_from_image(_frame(code, 110, 55), cv2.COLOR_BGR2GRAY, tracker) == [message]
+    assert (tracker.full_scans, tracker.region_scans) == (1, 1)
+
+    # Missed in the region, the whole frame is scanned only after max_misses
+    for _ in range(2):
+        assert WebcamReader.parse_all_from_image(_frame(), cv2.COLOR_BGR2GRAY, tracker) == []
+    assert (tracker.full_scans, tracker.region_scans) == (1, 3)
+
+    assert WebcamReader.parse_all_from_image(_frame(code, 400, 200), cv2.COLOR_BGR2GRAY, tracker) == [message]
+    assert (tracker.full_scans, tracker.region_scans) == (2, 3)
+    assert tracker.region[0] > 300
+
+
+def test_region_tracking_downscaled(qr_creator):
+    message = _message()
+    code = qr_creator.create(message, box_size=6)
+    tracker = RegionTracker(scale=0.5)
+
+    for left in [20, 24, 28]:
+        assert WebcamReader.parse_all_from_image(_frame(code, left, 10), cv2.COLOR_BGR2GRAY, tracker) == [message]
+
+    assert (tracker.full_scans, tracker.region_scans) == (1, 2)
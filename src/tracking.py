@@ -0,0 +1,68 @@
+from typing import Callable, Optional
+
+from cv2 import cv2
+from numpy import ndarray
+
+from decoders import decode_pyzbar
+
+MAX_MISSES = 5
+REGION_MARGIN = 0.25  # of the region size, on every side
+
+
+# Scans only the region where the QR codes were last decoded, the peer's screen barely moves between frames.
+# After max_misses frames without a code in the region, the whole frame is scanned again.
+class RegionTracker:
+    def __init__(self, max_misses: int = MAX_MISSES, margin: float = REGION_MARGIN, scale: float = 1.0):
+        self._max_misses = max_misses
+        self._margin = margin
+        # The region is downscaled by it before scanning, when the codes are large enough on the frame
+        self._scale = scale
+
+        # (left, top, right, bottom) in frame pixels
+        self._region: Optional[tuple[int, int, int, int]] = None
+        self._misses = 0
+
+        self.full_scans = 0
+        self.region_scans = 0
+
+    @property
+    def region(self) -> Optional[tuple[int, int, int, int]]:
+        return self._region
+
+    def decode(self, image: ndarray, decode: Callable[[ndarray], list] = decode_pyzbar) -> list:
+        if self._region is None or self._misses >= self._max_misses:
+            self.full_scans += 1
+            decoded_objects = decode(image)
+            self._track(decoded_objects, image.shape, 0, 0, 1.0)
+
+            return decoded_objects
+
+        self.region_scans += 1
+        left, top, right, bottom = self._region
+        region_image = image[top:bottom, left:right]
+        if self._scale != 1.0:
+            region_image = cv2.resize(region_image, None, fx=self._scale, fy=self._scale, interpolation=cv2.INTER_AREA)
+
+        decoded_objects = decode(region_image)
+        self._track(decoded_objects, image.shape, left, top, self._scale)
+
+        return decoded_objects
+
+    def _track(self, decoded_objects: list, shape: tuple, left: int, top: int, scale: float) -> None:
+        if not decoded_objects:
+            self._misses += 1
+            return
+
+        xs = [left + point.x / scale for decoded in decoded_objects for point in decoded.polygon]
+        ys = [top + point.y / scale for decoded in decoded_objects for point in decoded.polygon]
+
+        margin_x = (max(xs) - min(xs)) * self._margin
+        margin_y = (max(ys) - min(ys)) * self._margin
+
+        self._region = (
+            max(0, int(min(xs) - margin_x)),
+            max(0, int(min(ys) - margin_y)),
+            min(shape[1], int(max(xs) + margin_x) + 1),
+            min(shape[0], int(max(ys) + margin_y) + 1),
+        )
+        self._misses = 0
@@ -1,18 +1,37 @@
 from __future__ import print_function
 
-import base64
+import copy
 from typing import Optional
 
-import pyzbar.pyzbar as pyzbar
 from cv2 import cv2
 
+from color_planes import ColorCalibration, split_planes
+from decoders import decode_pyzbar
+from metrics import Metrics, timed
+from payload_encoding import decode_payload
+from protocol import is_protocol_message
+from tracking import RegionTracker
+
 
 class WebcamReader:
     def __init__(
-        self, font: int = cv2.FONT_HERSHEY_SIMPLEX, width: int = 640, height: int = 480, capture_webcam: Optional = None
+        self,
+        font: int = cv2.FONT_HERSHEY_SIMPLEX,
+        width: int = 640,
+        height: int = 480,
+        capture_webcam: Optional = None,
+        tracker: Optional[RegionTracker] = None,
+        metrics: Optional[Metrics] = None,
+        decoder=None,
     ):
         self._font = font
+        self._tracker = tracker
+        self._metrics = metrics
+        # A QRDecoder or CalibratingDecoder of the decoders module, pyzbar when none is given
+        self._decoder = decoder
         self._capture_webcam = capture_webcam or cv2.VideoCapture(0, cv2.CAP_DSHOW)
+        # Of the colour multiplexed frames, refined whenever a plane can't be decoded
+        self._calibration = ColorCalibration()
 
         self._capture_webcam.set(3, width)
         self._capture_webcam.set(4, height)
@@ -20,36 +39,115 @@ class WebcamReader:
     def __enter__(self):
         return self
 
+    def decoding_copy(self) -> "WebcamReader":
+        # Reads the same webcam, with its own region tracker and colour calibration. The state of a decoded frame is
+        # kept per decode thread instead of being shared without a lock
+        reader = copy.copy(self)
+        reader._tracker = copy.deepcopy(self._tracker)
+        reader._calibration = ColorCalibration()
+
+        return reader
+
     def is_capturing(self) -> bool:
         return self._capture_webcam.isOpened()
 
+    def read_frame(self):
+        with timed(self._metrics, "capture"):
+            _, frame = self._capture_webcam.read()
+
+        return frame
+
     def capture(self, mode=cv2.COLOR_BGR2GRAY) -> Optional[bytes]:
-        _, frame = self._capture_webcam.read()
+        return self.parse_from_image(self.read_frame(), mode, self._tracker, self._metrics, self._decoder)
 
-        return self.parse_from_image(frame, mode)
+    def capture_all(self, mode=cv2.COLOR_BGR2GRAY, colors: int = 1) -> list[bytes]:
+        return self.decode_frame(self.read_frame(), mode, colors)
 
-    @staticmethod
-    def parse_from_image(frame, mode) -> Optional[bytes]:
-        frame_image = cv2.cvtColor(frame, mode)
+    def decode_frame(self, frame, mode=cv2.COLOR_BGR2GRAY, colors: int = 1) -> list[bytes]:
+        if colors > 1:
+            messages, self._calibration = self.parse_all_from_planes(
+                frame, self._calibration, self._tracker, self._metrics, self._decoder
+            )
+
+            return messages
 
-        # Decode the QR code
-        decoded_objects = pyzbar.decode(frame_image)
-        if len(decoded_objects) == 0:
+        return self.parse_all_from_image(frame, mode, self._tracker, self._metrics, self._decoder)
+
+    @staticmethod
+    def parse_from_image(
+        frame, mode, tracker: Optional[RegionTracker] = None, metrics: Optional[Metrics] = None, decoder=None
+    ) -> Optional[bytes]:
+        messages = WebcamReader.parse_all_from_image(frame, mode, tracker, metrics, decoder)
+        if len(messages) == 0:
             return
-        elif len(decoded_objects) > 1:
+        elif len(messages) > 1:
             # Too many QR codes. Ignore them.
             return
 
-        decoded_object = decoded_objects[0]
+        return messages[0]
 
-        try:
-            data_to_bytes = base64.b64decode(decoded_object.data)
-        except ValueError:
-            print("Bad data received")
+    @staticmethod
+    def parse_all_from_image(
+        frame, mode, tracker: Optional[RegionTracker] = None, metrics: Optional[Metrics] = None, decoder=None
+    ) -> list[bytes]:
+        with timed(metrics, "color"):
+            frame_image = cv2.cvtColor(frame, mode)
 
-            return
+        return WebcamReader._decode_image(frame_image, tracker, metrics, decoder)
 
-        return data_to_bytes
+    @staticmethod
+    def parse_all_from_planes(
+        frame,
+        calibration: ColorCalibration,
+        tracker: Optional[RegionTracker] = None,
+        metrics: Optional[Metrics] = None,
+        decoder=None,
+    ) -> tuple[list[bytes], ColorCalibration]:
+        # The codes of the colour planes of a BGR frame, and the calibration to use for the next frames. A grayscale
+        # code is seen in all the planes, and returned once
+        with timed(metrics, "color"):
+            planes = split_planes(frame, calibration)
+        plane_messages = [WebcamReader._decode_image(plane, tracker, metrics, decoder) for plane in planes]
+
+        if not all(plane_messages):
+            with timed(metrics, "color"):
+                refined = calibration.refined(frame)
+
+            if refined is not None:
+                with timed(metrics, "color"):
+                    planes = split_planes(frame, refined)
+                refined_messages = [WebcamReader._decode_image(plane, tracker, metrics, decoder) for plane in planes]
+
+                if sum(map(bool, refined_messages)) > sum(map(bool, plane_messages)):
+                    calibration, plane_messages = refined, refined_messages
+
+        return list(dict.fromkeys(message for messages in plane_messages for message in messages)), calibration
+
+    @staticmethod
+    def _decode_image(
+        frame_image, tracker: Optional[RegionTracker], metrics: Optional[Metrics], decoder=None
+    ) -> list[bytes]:
+        # Decode the QR codes
+        decode = decoder.decode if decoder is not None else decode_pyzbar
+        with timed(metrics, "decode"):
+            decoded_objects = tracker.decode(frame_image, decode) if tracker is not None else decode(frame_image)
+
+        messages = []
+        for decoded_object in decoded_objects:
+            try:
+                data_to_bytes = decode_payload(decoded_object.data)
+            except ValueError:
+                print("Bad data received")
+                if metrics is not None:
+                    metrics.count("bad_data")
+
+                continue
+
+            # Codes that are not ours (or are too damaged) are skipped without dropping the rest of the frame
+            if is_protocol_message(data_to_bytes):
+                messages.append(data_to_bytes)
+
+        return messages
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         print("Releasing the webcam resources")